@@ -0,0 +1,177 @@
+"""Trade recall@k against query latency for Chroma's HNSW and the quantized index
+
+Usage (from the repository root):
+
+    PYTHONPATH=. python benchmarks/bench_ann.py --vectors 50000 --output ann.json
+    PYTHONPATH=. python benchmarks/bench_ann.py --data-dir scraped_data --docs 2000 \
+        --model all-MiniLM-L6-v2 --output ann.json
+
+Embeddings are either clustered random vectors (the default, no model
+needed) or a sample of the scraped corpus chunked and embedded with
+--model, with queries drawn from the same distribution. Exact brute-force
+neighbours are the ground truth. Chroma is built once per M and then
+queried at every ef_search; the quantized index (int8 and float16) is
+queried at every candidate count. Reported per setting: recall@k, p50/p95
+query latency, build time and resident bytes per vector.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+VECTOR_DB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector_db')
+sys.path.insert(0, VECTOR_DB_DIR)
+
+from quantized import QuantizedIndex, QUANTIZED_FORMATS  # noqa: E402
+
+
+def clustered_vectors(rng, count, dimension, clusters=256):
+    """Unit vectors around random centres, closer to real embeddings than uniform noise"""
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 4 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def corpus_vectors(args, rng):
+    """Embed chunks of a corpus sample; queries are held-out chunks"""
+    from sentence_transformers import SentenceTransformer
+    from common.chunking import Chunker
+    from bench_chunking import load_documents
+    chunker = Chunker()
+    texts = [chunk for doc in load_documents(args.data_dir, args.docs) for chunk in chunker.chunk(doc['text'])]
+    rng.shuffle(texts)
+    model = SentenceTransformer(args.model)
+    vectors = model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+    return vectors[args.queries:], vectors[:args.queries]
+
+
+def exact_neighbours(vectors, queries, k, space):
+    if space == "l2":
+        scores = -(np.einsum("ij,ij->i", vectors, vectors)[None, :] - 2 * queries @ vectors.T)
+    elif space == "cosine":
+        scores = (queries @ vectors.T) / np.linalg.norm(vectors, axis=1)[None, :]
+    else:
+        scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def measure(search, queries, truth, k):
+    """Recall@k and latency percentiles of a search returning row numbers"""
+    for query in queries[:5]:
+        search(query)
+    samples, hits = [], 0
+    for query, relevant in zip(queries, truth):
+        started = time.perf_counter()
+        found = search(query)
+        samples.append((time.perf_counter() - started) * 1000)
+        hits += len(relevant & set(found[:k]))
+    samples.sort()
+    return {
+        "recall": round(hits / (len(queries) * k), 4),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3)
+    }
+
+
+def open_client(directory):
+    import chromadb
+    from chromadb.config import Settings
+    from chromadb.api.client import SharedSystemClient
+    # A loaded HNSW index keeps its ef_search, so reopen the store to pick up a new one
+    SharedSystemClient.clear_system_cache()
+    return chromadb.PersistentClient(path=directory, settings=Settings(anonymized_telemetry=False))
+
+
+def bench_hnsw(args, vectors, queries, truth, directory):
+    ids = [str(i) for i in range(len(vectors))]
+    runs = []
+    for m in [int(value) for value in args.m.split(',')]:
+        client = open_client(directory)
+        collection = client.create_collection(f"ann_m{m}", metadata={
+            "hnsw:space": args.space, "hnsw:M": m, "hnsw:construction_ef": args.ef_construction})
+        started = time.perf_counter()
+        batch = client.get_max_batch_size()
+        for start in range(0, len(vectors), batch):
+            collection.add(ids=ids[start:start + batch], embeddings=vectors[start:start + batch])
+        build_seconds = time.perf_counter() - started
+        for ef in [int(value) for value in args.ef_search.split(',')]:
+            open_client(directory).get_collection(f"ann_m{m}").modify(configuration={"hnsw": {"ef_search": ef}})
+            collection = open_client(directory).get_collection(f"ann_m{m}")
+
+            def search(query):
+                found = collection.query(query_embeddings=query[None, :], n_results=args.k, include=[])
+                return [int(doc_id) for doc_id in found["ids"][0]]
+            runs.append({"M": m, "ef_construction": args.ef_construction, "ef_search": ef,
+                         "build_seconds": round(build_seconds, 2), **measure(search, queries, truth, args.k)})
+    return runs
+
+
+def bench_quantized(args, vectors, queries, truth, directory):
+    runs = []
+    for dtype in QUANTIZED_FORMATS:
+        index = QuantizedIndex(os.path.join(directory, dtype), dtype, args.space)
+        started = time.perf_counter()
+        for start in range(0, len(vectors), 10000):
+            index.add([str(i) for i in range(start, min(start + 10000, len(vectors)))], vectors[start:start + 10000])
+        build_seconds = time.perf_counter() - started
+        for candidates in [int(value) for value in args.candidates.split(',')]:
+            def search(query):
+                return [int(doc_id) for doc_id in index.search(query, args.k, candidates)[0][0]]
+            runs.append({"dtype": dtype, "candidates": candidates, "build_seconds": round(build_seconds, 2),
+                         "bytes_per_vector": round(index.memory_bytes() / len(index), 1),
+                         **measure(search, queries, truth, args.k)})
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vectors', type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--data-dir', help="embed a sample of this corpus instead of synthetic vectors")
+    parser.add_argument('--docs', type=int, default=1000, help="documents sampled from --data-dir")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--space', choices=['l2', 'cosine', 'ip'], default='l2')
+    parser.add_argument('--m', default='16,32', help="HNSW M values to build")
+    parser.add_argument('--ef-construction', type=int, default=100)
+    parser.add_argument('--ef-search', default='10,25,50,100,200')
+    parser.add_argument('--candidates', default='20,50,100,200', help="quantized candidates re-scored exactly")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.data_dir:
+        vectors, queries = corpus_vectors(args, rng)
+    else:
+        vectors = clustered_vectors(rng, args.vectors + args.queries, args.dimension)
+        vectors, queries = vectors[args.queries:], vectors[:args.queries]
+    truth = exact_neighbours(vectors, queries, args.k, args.space)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            "vectors": len(vectors),
+            "dimension": vectors.shape[1],
+            "queries": len(queries),
+            "k": args.k,
+            "space": args.space,
+            "float32_bytes_per_vector": vectors.shape[1] * 4,
+            "hnsw": bench_hnsw(args, vectors, queries, truth, os.path.join(directory, "chroma")),
+            "quantized": bench_quantized(args, vectors, queries, truth, os.path.join(directory, "quantized"))
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
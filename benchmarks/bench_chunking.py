@@ -0,0 +1,226 @@
+"""Compare the token-aware chunker with the original fixed-size chunk_document
+
+Usage (from the repository root):
+
+    PYTHONPATH=. python benchmarks/bench_chunking.py --docs data/documents \
+        --model all-MiniLM-L6-v2 --retrieval --output chunking.json
+
+Without --docs a synthetic corpus shaped like Red Hat documentation is
+generated. Speed is reported for both chunkers; quality is reported as the
+share of tokens the embedding model would silently truncate, the number of
+command/code lines cut in half, and (with --retrieval) recall@k and MRR for
+sentence-level pseudo-queries.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+from common.chunking import Chunker, make_chunker, segment, CODE
+from common.corpus import CorpusReader, is_corpus
+
+
+def legacy_chunk_document(text, chunk_size=1000, overlap=200):
+    """Split document into chunks with overlap (rag_service before the shared chunker)"""
+    chunks = []
+    start = 0
+    text_length = len(text)
+
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
+        if end < text_length and end - start == chunk_size:
+            # Find the last period within the last 100 chars to create cleaner chunks
+            last_period = text.rfind('.', start + chunk_size - 100, start + chunk_size)
+            if last_period != -1:
+                end = last_period + 1
+
+        chunks.append(text[start:end])
+        start = end - overlap if end < text_length else text_length
+
+    return chunks
+
+
+def legacy_spans(text):
+    """Character spans of legacy_chunk_document, recomputed for the quality metrics"""
+    spans = []
+    position = 0
+    for chunk in legacy_chunk_document(text):
+        start = text.find(chunk, position)
+        spans.append((start, start + len(chunk)))
+        position = start + 1
+    return spans
+
+
+WORDS = ("system service configure network firewall port zone package repository kernel module "
+         "storage volume subscription container image registry cluster node user group policy "
+         "security selinux context boolean journal log unit target socket timer").split()
+COMMANDS = ["firewall-cmd --add-port={n}/tcp", "dnf install -y {w}", "systemctl enable --now {w}.service",
+            "nmcli connection modify {w} ipv4.addresses 192.0.2.{n}/24", "semanage port -a -t http_port_t -p tcp {n}",
+            "subscription-manager repos --enable {w}-rpms", "podman run -d --name {w} registry.example.com/{w}:latest"]
+
+
+def synthetic_document(rng, index):
+    """A document with numbered headings, prose paragraphs and command listings"""
+    parts = [f"Chapter {index}. Managing the {rng.choice(WORDS)} {rng.choice(WORDS)}"]
+    for section in range(1, rng.randint(3, 8)):
+        parts.append(f"{index}.{section}. Configuring {rng.choice(WORDS)} {rng.choice(WORDS)}")
+        for _ in range(rng.randint(1, 4)):
+            sentences = []
+            for _ in range(rng.randint(2, 12)):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(6, 20))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            parts.append(" ".join(sentences))
+        if rng.random() < 0.7:
+            lines = [f"# {rng.choice(COMMANDS).format(n=rng.randint(1, 9999), w=rng.choice(WORDS))}"
+                     for _ in range(rng.randint(1, 25))]
+            parts.append("\n".join(lines))
+    return {"url": f"https://example.com/doc/{index}", "title": parts[0], "text": "\n\n".join(parts)}
+
+
+def load_documents(directory, limit):
+    docs = []
+    if is_corpus(directory):
+        for _, doc in CorpusReader(directory).latest():
+            docs.append(doc)
+            if len(docs) >= limit:
+                return docs
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json') and len(docs) < limit:
+            with open(os.path.join(directory, name)) as f:
+                docs.append(json.load(f))
+    return docs
+
+
+def time_chunking(docs, chunk_fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for doc in docs:
+            chunk_fn(doc['text'])
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def quality(docs, spans_fn, counter, budget):
+    """Token statistics, truncation and split command lines for one chunker"""
+    token_counts = []
+    truncated = 0
+    total = 0
+    split_lines = 0
+    for doc in docs:
+        text = doc['text']
+        code_blocks = [(s, e) for s, e, kind in segment(text) if kind == CODE]
+        for start, end in spans_fn(text):
+            tokens = counter.count_tokens(text[start:end])
+            token_counts.append(tokens)
+            total += tokens
+            truncated += max(tokens - budget, 0)
+            # A chunk ending inside a code block but not at a line end cuts a command in half
+            if end < len(text) and text[end] != '\n' and any(s < end < e for s, e in code_blocks):
+                split_lines += 1
+    return {
+        "chunks": len(token_counts),
+        "mean_tokens": round(statistics.mean(token_counts), 1) if token_counts else 0,
+        "max_tokens": max(token_counts, default=0),
+        "chunks_over_budget": sum(1 for t in token_counts if t > budget),
+        "truncated_token_share": round(truncated / total, 4) if total else 0.0,
+        "split_command_lines": split_lines
+    }
+
+
+def retrieval(docs, spans_fn, model, rng_seed, queries_per_doc, k):
+    """Recall@k and MRR for queries made from sentences of the documents"""
+    import numpy as np
+    rng = random.Random(rng_seed)
+    chunk_texts, doc_chunks = [], []
+    for doc in docs:
+        owned = []
+        for start, end in spans_fn(doc['text']):
+            owned.append((len(chunk_texts), start, end))
+            chunk_texts.append(doc['text'][start:end])
+        doc_chunks.append(owned)
+    queries, relevant = [], []
+    for doc, owned in zip(docs, doc_chunks):
+        text = doc['text']
+        sentence_ends = [i for i, c in enumerate(text) if c == '.' and i + 1 < len(text) and text[i + 1] == ' ']
+        for _ in range(min(queries_per_doc, len(sentence_ends) - 1)):
+            i = rng.randrange(len(sentence_ends) - 1)
+            start, end = sentence_ends[i] + 2, sentence_ends[i + 1] + 1
+            queries.append(text[start:end])
+            relevant.append({c for c, s, e in owned if s <= start and end <= e})
+    chunk_vectors = model.encode(chunk_texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    query_vectors = model.encode(queries, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+    scores = query_vectors @ chunk_vectors.T
+    hits, reciprocal_ranks = 0, []
+    for row, wanted in zip(scores, relevant):
+        ranking = np.argsort(-row)
+        rank = next((r for r, c in enumerate(ranking[:100]) if c in wanted), None)
+        hits += rank is not None and rank < k
+        reciprocal_ranks.append(0.0 if rank is None else 1.0 / (rank + 1))
+    return {
+        "queries": len(queries),
+        f"recall@{k}": round(hits / len(queries), 4) if queries else 0.0,
+        "mrr": round(statistics.mean(reciprocal_ranks), 4) if reciprocal_ranks else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', help="corpus or legacy JSON directory; synthetic documents if omitted")
+    parser.add_argument('--limit', type=int, default=2000, help="maximum number of documents")
+    parser.add_argument('--model', help="SentenceTransformer whose tokenizer sizes the chunks")
+    parser.add_argument('--retrieval', action='store_true', help="also measure recall@k (needs --model)")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries-per-doc', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.docs:
+        docs = load_documents(args.docs, args.limit)
+    else:
+        rng = random.Random(args.seed)
+        docs = [synthetic_document(rng, i) for i in range(1, args.limit + 1)]
+    total_chars = sum(len(doc['text']) for doc in docs)
+
+    model = None
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+        chunker = make_chunker(model.tokenizer, model.max_seq_length)
+    else:
+        chunker = Chunker()
+    # The model always sees at most this many content tokens per chunk
+    budget = chunker.max_tokens
+
+    # (function timed, producing chunk strings; span function used for the quality metrics)
+    chunkers = {
+        "legacy": (legacy_chunk_document, legacy_spans),
+        "structured": (chunker.chunk, chunker.spans)
+    }
+    results = {"documents": len(docs), "characters": total_chars, "chunker_version": chunker.version,
+               "token_budget": budget, "chunkers": {}}
+    for name, (chunk_fn, spans_fn) in chunkers.items():
+        seconds = time_chunking(docs, chunk_fn, args.repeat)
+        entry = {
+            "seconds": round(seconds, 4),
+            "docs_per_sec": round(len(docs) / seconds, 1),
+            "mb_per_sec": round(total_chars / seconds / 1e6, 2)
+        }
+        entry.update(quality(docs, spans_fn, chunker, budget))
+        if args.retrieval and model is not None:
+            entry.update(retrieval(docs, spans_fn, model, args.seed, args.queries_per_doc, args.k))
+        results["chunkers"][name] = entry
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
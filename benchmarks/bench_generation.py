@@ -0,0 +1,131 @@
+"""Load-test the rag_service generation client against the stub model server
+
+Usage (from the repository root):
+
+    PYTHONPATH=. python benchmarks/bench_generation.py --backend openai \
+        --requests 200 --clients 32 --batch-sizes 1,4,16 --output generation.json
+
+Starts rag_service/stub_llm.py in-process (or uses --url for a running
+server) and drives Generator.stream from many concurrent clients, once per
+batch size. Reported per batch size: throughput, time to first token and
+end-to-end latency percentiles, mean batch size and queue wait on the
+client side, and the stub's own batching statistics.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+
+import httpx
+
+RAG_SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag_service')
+sys.path.insert(0, RAG_SERVICE_DIR)
+
+from generation import make_generator, build_prompt  # noqa: E402
+
+QUESTION = "How do I open port 8080/tcp in firewalld permanently?"
+CONTEXTS = ["Use firewall-cmd --add-port=8080/tcp --permanent and then firewall-cmd --reload.",
+            "The firewalld service manages zones; the default zone is public."]
+
+
+def start_stub(port):
+    import uvicorn
+    import stub_llm
+    server = uvicorn.Server(uvicorn.Config(stub_llm.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return round(ordered[max(int(len(ordered) * fraction) - 1, 0)], 2)
+
+
+async def run_load(args, url, batch_size):
+    generator = make_generator(args.backend, url, args.model, batch_size=batch_size,
+                               max_concurrency=args.max_concurrency, max_queue=args.requests)
+    prompt = build_prompt(QUESTION, CONTEXTS, lambda text: len(text.split()))
+    first_token, latency, tokens = [], [], []
+    remaining = iter(range(args.requests))
+
+    async def client():
+        for _ in remaining:
+            started = time.perf_counter()
+            first = None
+            count = 0
+            async for _ in generator.stream(prompt, args.max_tokens):
+                if first is None:
+                    first = time.perf_counter() - started
+                count += 1
+            first_token.append(first * 1000)
+            latency.append((time.perf_counter() - started) * 1000)
+            tokens.append(count)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+    stats = generator.stats()
+    await generator.aclose()
+    return {
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(args.requests / elapsed, 2),
+        "tokens_per_sec": round(sum(tokens) / elapsed, 1),
+        "first_token_p50_ms": percentile(first_token, 0.5),
+        "first_token_p95_ms": percentile(first_token, 0.95),
+        "latency_p50_ms": percentile(latency, 0.5),
+        "latency_p95_ms": percentile(latency, 0.95),
+        "latency_mean_ms": round(statistics.mean(latency), 2),
+        "generator": stats
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['ollama', 'openai'], default='openai')
+    parser.add_argument('--url', help="model server to test; the stub is started in-process if omitted")
+    parser.add_argument('--port', type=int, default=11500, help="port for the in-process stub")
+    parser.add_argument('--model', default='stub')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=32, help="concurrent clients")
+    parser.add_argument('--batch-sizes', default='1,4,16')
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        start_stub(args.port)
+        url = f"http://127.0.0.1:{args.port}"
+
+    results = {"backend": args.backend, "url": url, "requests": args.requests, "clients": args.clients,
+               "max_concurrency": args.max_concurrency, "runs": []}
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        before = httpx.get(f"{url}/stats").json() if args.url is None else None
+        run = asyncio.run(run_load(args, url, batch_size))
+        if before is not None:
+            after = httpx.get(f"{url}/stats").json()
+            steps = after["steps"] - before["steps"]
+            run["server"] = {
+                "steps": steps,
+                "tokens": after["tokens"] - before["tokens"],
+                "mean_batch": round((after["tokens"] - before["tokens"]) / steps, 2) if steps else 0.0
+            }
+        results["runs"].append(run)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Measure what hybrid (BM25 + vector, fused by reciprocal rank) search costs over vector-only
+
+Usage (from the repository root):
+
+    PYTHONPATH=. python benchmarks/bench_hybrid.py --chunks 50000 --output hybrid.json
+
+A synthetic corpus shaped like Red Hat documentation is chunked and stored
+in a throwaway Chroma collection with random unit embeddings, so no model is
+needed. The vector DB handlers are called in-process, which leaves HTTP out
+of the comparison. Reported: lexical index build, save and load time, BM25
+search latency, and /query_embeddings latency in vector and hybrid mode,
+unfiltered and filtered to one product (with --partition-by product each
+product gets its own collection).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+from common.chunking import Chunker
+from bench_chunking import synthetic_document, COMMANDS, WORDS
+
+PRODUCTS = ["Red Hat Enterprise Linux", "Openshift Container Platform", "Red Hat Ceph Storage",
+            "Red Hat Jboss Enterprise Application Platform"]
+VECTOR_DB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector_db')
+
+
+def synthetic_chunks(count, seed):
+    rng = random.Random(seed)
+    chunker = Chunker()
+    chunks = []
+    index = 0
+    while len(chunks) < count:
+        index += 1
+        doc = synthetic_document(rng, index)
+        for i, text in enumerate(chunker.chunk(doc['text'])):
+            metadata = {"url": doc['url'], "title": doc['title'], "product": PRODUCTS[index % len(PRODUCTS)],
+                        "version": str(index % 3 + 7)}
+            chunks.append((f"{index}-{i}", text, metadata))
+    return chunks[:count]
+
+
+def synthetic_queries(rng, count):
+    """Mix of exact command tokens and short prose queries"""
+    queries = []
+    for i in range(count):
+        if i % 2:
+            queries.append(rng.choice(COMMANDS).format(n=rng.randint(1, 9999), w=rng.choice(WORDS)).split()[0]
+                           + " " + rng.choice(WORDS))
+        else:
+            queries.append("how to configure " + " ".join(rng.choice(WORDS) for _ in range(3)))
+    return queries
+
+
+def latency(fn, queries, warmup=5):
+    for query in queries[:warmup]:
+        fn(query)
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.mean(samples), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--n-results', type=int, default=5)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--partition-by', default='', help="metadata field to partition collections by")
+    parser.add_argument('--seed', type=int, default=13)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-hybrid-')
+    os.environ['CHROMA_DB_DIR'] = os.path.join(workdir, 'chroma')
+    os.environ['LEXICAL_INDEX_PATH'] = os.path.join(workdir, 'lexical_index.pkl')
+    os.environ['PARTITION_BY'] = args.partition_by
+    sys.path.insert(0, VECTOR_DB_DIR)
+    import server
+    from lexical import LexicalIndex
+    server.warm_up()  # the app would run this in the background at start-up
+
+    chunks = synthetic_chunks(args.chunks, args.seed)
+    rng = np.random.default_rng(args.seed)
+    results = {"chunks": len(chunks), "n_results": args.n_results, "partition_by": args.partition_by,
+               "hybrid_candidates": server.HYBRID_CANDIDATES}
+
+    # Lexical index on its own
+    index = LexicalIndex(os.path.join(workdir, 'standalone.pkl'), facet_fields=server.FILTER_FIELDS)
+    started = time.perf_counter()
+    index.add(chunks)
+    results["lexical_build_s"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    index.save()
+    results["lexical_save_s"] = round(time.perf_counter() - started, 3)
+    results["lexical_file_mb"] = round(os.path.getsize(index.path) / 1e6, 2)
+    started = time.perf_counter()
+    LexicalIndex(index.path, facet_fields=server.FILTER_FIELDS).load()
+    results["lexical_load_s"] = round(time.perf_counter() - started, 3)
+
+    # Populate the collection through the handler so both indexes are filled
+    for start in range(0, len(chunks), 1000):
+        batch = chunks[start:start + 1000]
+        vectors = rng.normal(size=(len(batch), args.dimension)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        server.add_embeddings(server.AddEmbeddingsRequest(documents=[
+            server.EmbeddedDocument(id=chunk_id, text=text, metadata=metadata, embedding=vector.tolist())
+            for (chunk_id, text, metadata), vector in zip(batch, vectors)
+        ]))
+
+    query_rng = random.Random(args.seed)
+    queries = synthetic_queries(query_rng, args.queries)
+    query_vectors = {}
+    for query in queries:
+        vector = rng.normal(size=args.dimension).astype(np.float32)
+        query_vectors[query] = (vector / np.linalg.norm(vector)).tolist()
+
+    def search(mode, where=None):
+        def run(query):
+            server.query_embeddings(server.EmbeddingQueryRequest(
+                query_embedding=query_vectors[query], n_results=args.n_results, query_text=query, mode=mode,
+                where=where))
+        return run
+
+    results["bm25_search"] = latency(lambda query: server.lexical.search(query, server.HYBRID_CANDIDATES), queries)
+    results["vector"] = latency(search("vector"), queries)
+    results["hybrid"] = latency(search("hybrid"), queries)
+    results["hybrid_overhead_p50_ms"] = round(results["hybrid"]["p50_ms"] - results["vector"]["p50_ms"], 3)
+    where = {"product": PRODUCTS[0]}
+    results["vector_filtered"] = latency(search("vector", where), queries)
+    results["hybrid_filtered"] = latency(search("hybrid", where), queries)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
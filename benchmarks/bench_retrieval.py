@@ -0,0 +1,236 @@
+"""End-to-end ingestion and retrieval benchmark on a reproducible synthetic corpus
+
+Usage (from the repository root):
+
+    PYTHONPATH=. python benchmarks/bench_retrieval.py --docs 500 --queries 200 --output run.json
+    PYTHONPATH=. python benchmarks/bench_retrieval.py --docs 500 --queries 200 --compare run.json
+
+A corpus shaped like the scraper's JSON output (url, title, text, product,
+version) is generated from --seed, together with a labelled query set: each
+query is a command line taken from one document, and that document's URL
+is the answer. The real vector_db app is served in-process on --port and
+the real rag_service app is driven in-process through its HTTP API, so
+ingestion goes through /process_documents and queries through /query and
+/query_batch. Query caches are disabled so every query does the full work.
+
+Reported: ingest chunks/sec, sequential /query latency p50/p95/p99,
+/query_batch throughput, recall@k and MRR of the source URLs, resident
+memory after start-up, ingestion and querying, and the on-disk index
+size. With --compare, the change of every number against an earlier run
+is printed as well.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+
+from bench_chunking import synthetic_document
+from bench_hybrid import PRODUCTS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTOR_DB_DIR = os.path.join(ROOT_DIR, 'vector_db')
+RAG_SERVICE_DIR = os.path.join(ROOT_DIR, 'rag_service')
+
+
+def make_corpus(directory, docs, queries, seed):
+    """Write the documents as scraper JSON files; return [(query, relevant url)]"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for index in range(docs):
+        doc = synthetic_document(rng, index)
+        doc["product"] = rng.choice(PRODUCTS)
+        doc["version"] = str(rng.randint(7, 9))
+        doc["document_type"] = "guide"
+        with open(os.path.join(directory, f"doc_{index:06d}.json"), 'w') as f:
+            json.dump(doc, f)
+        documents.append(doc)
+    labelled = []
+    for doc in rng.sample(documents, min(queries, len(documents))):
+        # Command lines carry the port numbers and names that tell documents apart
+        commands = [line[2:] for line in doc["text"].splitlines() if line.startswith("# ")]
+        if commands:
+            labelled.append((rng.choice(commands), doc["url"]))
+    return labelled
+
+
+def rss_mb():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def directory_mb(path):
+    total = 0
+    for parent, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(parent, name)) for name in files)
+    return round(total / (1024 * 1024), 1)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda fraction: round(ordered[max(int(len(ordered) * fraction) - 1, 0)], 2)
+    return {"p50_ms": round(statistics.median(ordered), 2), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def relevance(sources, url, k):
+    """(hit within k, reciprocal rank) of the first source from the relevant document"""
+    urls = list(dict.fromkeys(source["url"] for source in sources))
+    rank = urls.index(url) if url in urls else None
+    return rank is not None and rank < k, 0.0 if rank is None else 1.0 / (rank + 1)
+
+
+def start_vector_db(port):
+    import uvicorn
+    sys.path.insert(0, VECTOR_DB_DIR)
+    import server
+    vector_db = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=vector_db.run, daemon=True).start()
+    while not (vector_db.started and server.startup.ready):
+        if server.startup.error:
+            raise RuntimeError(f"vector_db failed to start: {server.startup.error}")
+        time.sleep(0.05)
+    return vector_db
+
+
+def run(args, workdir):
+    documents_dir = os.path.join(workdir, "documents")
+    labelled = make_corpus(documents_dir, args.docs, args.queries, args.seed)
+
+    # The services read their configuration at import time
+    os.environ.update({
+        "CHROMA_DB_DIR": os.path.join(workdir, "chroma"),
+        "INGEST_MANIFEST_PATH": os.path.join(workdir, "ingest_manifest.db"),
+        "EMBEDDING_STORE_DIR": os.path.join(workdir, "embedding_store"),
+        "CONVERSATION_DB_PATH": os.path.join(workdir, "conversations.db"),
+        "VECTOR_DB_HOST": "127.0.0.1",
+        "VECTOR_DB_PORT": str(args.port),
+        "SEARCH_MODE": args.search_mode,
+        "RERANK_ENABLED": "true" if args.rerank else "false",
+        "LLM_BACKEND": "extractive",
+        "RESULT_CACHE_SIZE": "0",
+        "SEMANTIC_CACHE_SIZE": "0",
+        "QUERY_EMBEDDING_CACHE_SIZE": "0"
+    })
+    if args.model:
+        os.environ["EMBEDDING_MODEL"] = args.model
+    memory = {"baseline_mb": rss_mb()}
+    vector_db = start_vector_db(args.port)
+    sys.path.insert(0, RAG_SERVICE_DIR)
+    from fastapi.testclient import TestClient
+    import service
+
+    with TestClient(service.app) as client:
+        while client.get("/ready").status_code != 200:
+            if service.startup.error:
+                raise RuntimeError(f"rag_service failed to start: {service.startup.error}")
+            time.sleep(0.1)
+        memory["started_mb"] = rss_mb()
+        job = client.post("/process_documents", json={"document_dir": documents_dir, "force": True}).json()
+        while job["status"] in ("pending", "running"):
+            time.sleep(0.2)
+            job = client.get(f"/process_documents/{job['job_id']}").json()
+        if job["status"] != "completed":
+            raise RuntimeError(f"Ingestion {job['status']}: {job['error']}")
+        memory["ingested_mb"] = rss_mb()
+
+        samples, hits, reciprocal_ranks = [], 0, []
+        for query, url in labelled:
+            started = time.perf_counter()
+            response = client.post("/query", json={"query": query, "max_results": args.k})
+            samples.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+            hit, reciprocal_rank = relevance(response.json()["sources"], url, args.k)
+            hits += hit
+            reciprocal_ranks.append(reciprocal_rank)
+
+        started = time.perf_counter()
+        for first in range(0, len(labelled), args.batch_size):
+            batch = [{"query": query, "max_results": args.k} for query, _ in labelled[first:first + args.batch_size]]
+            client.post("/query_batch", json={"queries": batch}).raise_for_status()
+        batch_seconds = time.perf_counter() - started
+        memory["queried_mb"] = rss_mb()
+
+    vector_db.should_exit = True
+    return {
+        "config": {"docs": args.docs, "queries": len(labelled), "k": args.k, "seed": args.seed,
+                   "search_mode": args.search_mode, "rerank": args.rerank, "model": service.EMBEDDING_MODEL},
+        "ingest": {
+            "documents": job["processed_documents"],
+            "chunks": job["processed_chunks"],
+            "seconds": job["elapsed_seconds"],
+            "chunks_per_sec": job["chunks_per_sec"]
+        },
+        "query": {
+            **percentiles(samples),
+            "mean_ms": round(statistics.mean(samples), 2),
+            "queries_per_sec": round(len(samples) / (sum(samples) / 1000), 2),
+            "batch_queries_per_sec": round(len(labelled) / batch_seconds, 2)
+        },
+        "quality": {
+            f"recall@{args.k}": round(hits / len(labelled), 4),
+            "mrr": round(statistics.mean(reciprocal_ranks), 4)
+        },
+        "memory": {**memory, "index_disk_mb": directory_mb(os.path.join(workdir, "chroma"))}
+    }
+
+
+def compare(results, previous):
+    """Numbers of this run next to the previous run's, with the relative change"""
+    changes = {}
+    for section, values in results.items():
+        if section == "config":
+            continue
+        for name, value in values.items():
+            before = previous.get(section, {}).get(name)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)):
+                change = round((value - before) / before * 100, 1) if before else None
+                changes[f"{section}.{name}"] = {"before": before, "after": value, "change_pct": change}
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5, help="max_results per query, and the k of recall@k")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--search-mode', choices=['vector', 'lexical', 'hybrid'], default='hybrid')
+    parser.add_argument('--rerank', action='store_true', help="re-rank with the cross-encoder")
+    parser.add_argument('--model', help="embedding model; defaults to the service's EMBEDDING_MODEL")
+    parser.add_argument('--batch-size', type=int, default=50, help="queries per /query_batch request")
+    parser.add_argument('--port', type=int, default=8900, help="port for the in-process vector DB")
+    parser.add_argument('--workdir', help="keep the corpus and indexes here instead of a temporary directory")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.workdir:
+        results = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(args, workdir)
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = compare(results, json.load(f))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import os
+import re
+from bisect import bisect_left
+from typing import List, Tuple
+
+# all-MiniLM-L6-v2 takes 256 tokens including [CLS] and [SEP]
+DEFAULT_MAX_TOKENS = 254
+# Optional cap on content tokens per chunk; by default chunks fill the model's window
+CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', '0')) or None
+# Tokens repeated between consecutive pieces of a block that had to be split
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', '32'))
+
+TEXT = 'text'
+CODE = 'code'
+HEADING = 'heading'
+
+FENCE_RE = re.compile(r'[ \t]*(```|~~~)')
+BLANK_RE = re.compile(r'\s*$')
+# Shell prompts, indented listings and "[root@host ~]#" style prompts
+COMMAND_RE = re.compile(r'( {4}|\t|\$ |# [a-z/.~]|\[[\w.-]+@[\w.-]+)')
+# Markdown headings and Red Hat style "Chapter 3." / "1.2.3. Title" headings
+HEADING_RE = re.compile(r'(#{1,6}\s+\S|Chapter\s+\d+\.|Appendix\s+[A-Z]\.|\d+(?:\.\d+)*\.\s+[A-Z])')
+HEADING_MAX_CHARS = 120
+# Approximate tokenization used when no model tokenizer is available
+WORD_RE = re.compile(r'\w+|[^\w\s]')
+
+Span = Tuple[int, int]
+
+
+def segment(text) -> List[Tuple[int, int, str]]:
+    """Split text into (start, end, kind) blocks: paragraphs, code listings and headings
+
+    Works on offsets only; lines are never copied out of the text.
+    """
+    blocks = []
+    current = None  # [start, end, kind]
+    in_fence = False
+    pos = 0
+    length = len(text)
+
+    def flush():
+        nonlocal current
+        if current is not None:
+            blocks.append((current[0], current[1], current[2]))
+            current = None
+
+    while pos < length:
+        newline = text.find('\n', pos)
+        line_end = length if newline == -1 else newline
+        next_pos = line_end + 1
+
+        if in_fence:
+            current[1] = line_end
+            if FENCE_RE.match(text, pos, line_end):
+                in_fence = False
+                flush()
+        elif FENCE_RE.match(text, pos, line_end):
+            flush()
+            current = [pos, line_end, CODE]
+            in_fence = True
+        elif BLANK_RE.match(text, pos, line_end):
+            flush()
+        elif COMMAND_RE.match(text, pos, line_end):
+            if current is not None and current[2] == CODE:
+                current[1] = line_end
+            else:
+                flush()
+                current = [pos, line_end, CODE]
+        elif line_end - pos <= HEADING_MAX_CHARS and HEADING_RE.match(text, pos, line_end):
+            flush()
+            current = [pos, line_end, HEADING]
+            flush()
+        else:
+            if current is not None and current[2] == TEXT:
+                current[1] = line_end
+            else:
+                flush()
+                current = [pos, line_end, TEXT]
+        pos = next_pos
+
+    flush()
+    return blocks
+
+
+class Chunker:
+    """Token-budgeted chunker that breaks on headings, paragraphs and code listings
+
+    The document is tokenized once; every size decision after that is a
+    bisect over token offsets, and chunks are returned as (start, end)
+    character spans so text is only sliced when the caller needs it.
+    Blocks that fit the budget are packed whole, so commands and code
+    listings are never cut mid-line unless a single listing is larger than
+    a chunk, in which case it is split on line boundaries.
+    """
+
+    def __init__(self, tokenizer=None, max_tokens=None, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        max_tokens = max_tokens or CHUNK_MAX_TOKENS or DEFAULT_MAX_TOKENS
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    @property
+    def version(self) -> str:
+        """Identifies the chunking settings, so changing them triggers re-indexing"""
+        name = getattr(self.tokenizer, 'name_or_path', None) or 'words'
+        return f"structured-{self.max_tokens}-{self.overlap_tokens}-{name}"
+
+    def token_offsets(self, text) -> Tuple[List[int], List[int]]:
+        """Start and end character offsets of every token"""
+        if self.tokenizer is None:
+            matches = list(WORD_RE.finditer(text))
+            return [m.start() for m in matches], [m.end() for m in matches]
+        encoding = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            truncation=False,
+            verbose=False
+        )
+        offsets = encoding['offset_mapping']
+        return [start for start, _ in offsets], [end for _, end in offsets]
+
+    def count_tokens(self, text) -> int:
+        return len(self.token_offsets(text)[0])
+
+    def spans(self, text) -> List[Span]:
+        """Character spans of the chunks of a document"""
+        if not text or BLANK_RE.match(text):
+            return []
+        # Fast path: every token covers at least one character
+        if len(text) <= self.max_tokens:
+            return [(0, len(text))]
+        starts, ends = self.token_offsets(text)
+        if len(starts) <= self.max_tokens:
+            return [(0, len(text))]
+
+        chunks: List[Span] = []
+        chunk_start = None  # (char offset, token index) of the open chunk
+        chunk_end = 0
+        headings_only = False
+
+        for block_start, block_end, kind in segment(text):
+            first = bisect_left(starts, block_start)
+            last = bisect_left(starts, block_end)
+            if first == last:
+                continue
+
+            # A heading opens a new chunk unless the open chunk is just headings
+            if kind == HEADING and chunk_start is not None and not headings_only:
+                chunks.append((chunk_start[0], chunk_end))
+                chunk_start = None
+
+            if last - first > self.max_tokens:
+                # Oversized block: split it, carrying any pending headings into the first piece
+                if chunk_start is not None and headings_only:
+                    split_from = chunk_start
+                else:
+                    if chunk_start is not None:
+                        chunks.append((chunk_start[0], chunk_end))
+                    split_from = (block_start, first)
+                pieces = self._split(text, starts, ends, split_from, last, block_end, kind)
+                chunks.extend(pieces[:-1])
+                # The tail piece stays open so following small blocks can join it
+                chunk_start = (pieces[-1][0], bisect_left(starts, pieces[-1][0]))
+                chunk_end = pieces[-1][1]
+                headings_only = False
+                continue
+
+            if chunk_start is not None and last - chunk_start[1] > self.max_tokens:
+                chunks.append((chunk_start[0], chunk_end))
+                chunk_start = None
+            if chunk_start is None:
+                chunk_start = (block_start, first)
+                headings_only = True
+            headings_only = headings_only and kind == HEADING
+            chunk_end = block_end
+
+        if chunk_start is not None:
+            chunks.append((chunk_start[0], chunk_end))
+        return chunks
+
+    def chunk(self, text) -> List[str]:
+        return [text[start:end] for start, end in self.spans(text)]
+
+    __call__ = chunk
+
+    def _split(self, text, starts, ends, begin, last, end_char, kind) -> List[Span]:
+        """Split tokens [begin token, last) into budget-sized pieces with overlap"""
+        pieces = []
+        char_start, token = begin
+        while last - token > self.max_tokens:
+            cut = self._cut_point(text, starts, ends, token, token + self.max_tokens, kind)
+            pieces.append((char_start, ends[cut - 1]))
+            token = self._overlap_start(text, starts, token, cut, kind)
+            char_start = starts[token]
+        pieces.append((char_start, end_char))
+        return pieces
+
+    def _cut_point(self, text, starts, ends, token, limit, kind) -> int:
+        """Token index to end a piece at: a line end for code, a sentence end for prose"""
+        floor = token + (limit - token) * 3 // 4
+        length = len(text)
+        for cut in range(limit, floor, -1):
+            end = ends[cut - 1]
+            if end < length and text[end] == '\n':
+                return cut
+            if kind != CODE and text[end - 1] in '.!?:' and (end == length or text[end].isspace()):
+                return cut
+        return limit
+
+    def _overlap_start(self, text, starts, token, cut, kind) -> int:
+        start = max(cut - self.overlap_tokens, token + 1)
+        if kind == CODE:
+            # Restart code on a line boundary so no command is repeated half way
+            for candidate in range(start, cut):
+                if starts[candidate] == 0 or text[starts[candidate] - 1] == '\n':
+                    return candidate
+            return cut
+        return start
+
+
+def make_chunker(tokenizer=None, max_seq_length=None, **kwargs) -> Chunker:
+    """Chunker sized for a model: the budget leaves room for [CLS] and [SEP]"""
+    if max_seq_length and 'max_tokens' not in kwargs:
+        kwargs['max_tokens'] = max_seq_length - 2
+        if CHUNK_MAX_TOKENS:
+            kwargs['max_tokens'] = min(kwargs['max_tokens'], CHUNK_MAX_TOKENS)
+    return Chunker(tokenizer, **kwargs)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_DB_PATH = os.environ.get('CONVERSATION_DB_PATH', '/app/data/conversations.db')
+# Messages kept per session; older ones fall out of the ring buffer
+CONVERSATION_MAX_MESSAGES = int(os.environ.get('CONVERSATION_MAX_MESSAGES', '16'))
+# Sessions held in memory; the least recently active ones are written to SQLite
+CONVERSATION_ACTIVE_SESSIONS = int(os.environ.get('CONVERSATION_ACTIVE_SESSIONS', '1000'))
+# Sessions idle for longer than this are forgotten
+CONVERSATION_TTL = float(os.environ.get('CONVERSATION_TTL', '86400'))
+# Tokens of earlier conversation put into a prompt, newest messages first
+CONVERSATION_HISTORY_TOKENS = int(os.environ.get('CONVERSATION_HISTORY_TOKENS', '1024'))
+
+SPEAKERS = {"user": "Human", "assistant": "Assistant"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    messages TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_age ON sessions (updated_at);
+"""
+
+
+def approximate_tokens(text) -> int:
+    """About four characters per token for English text"""
+    return len(text) // 4 + 1
+
+
+class Session:
+    """One conversation: a ring buffer of (role, text, tokens) messages"""
+
+    __slots__ = ("messages", "updated_at")
+
+    def __init__(self, max_messages, messages=(), updated_at=None):
+        self.messages: Deque[Tuple[str, str, int]] = deque(messages, maxlen=max_messages)
+        self.updated_at = updated_at or time.time()
+
+
+class ConversationStore:
+    """Per-session conversation history with bounded memory
+
+    Each session keeps its last `max_messages` messages in a ring buffer,
+    with the token count of every message worked out once when it is added.
+    At most `active_sessions` sessions stay in memory, in LRU order. The
+    least recently active one is written to SQLite when another is needed,
+    and read back when its session returns. Sessions idle for longer than
+    `ttl` are dropped.
+    """
+
+    def __init__(self, path=CONVERSATION_DB_PATH, max_messages=CONVERSATION_MAX_MESSAGES,
+                 active_sessions=CONVERSATION_ACTIVE_SESSIONS, ttl=CONVERSATION_TTL,
+                 count_tokens: Callable[[str], int] = approximate_tokens):
+        self.path = path
+        self.max_messages = max_messages
+        self.active_sessions = active_sessions
+        self.ttl = ttl
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.spilled = 0
+        self.conn = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            with self.conn:
+                self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - ttl,))
+
+    def _write(self, rows: List[Tuple[str, Session]]):
+        if self.conn is None or not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sessions (session_id, messages, updated_at) VALUES (?, ?, ?)",
+                [(session_id, json.dumps(list(session.messages)), session.updated_at) for session_id, session in rows]
+            )
+
+    def _read(self, session_id) -> Optional[Session]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute("SELECT messages, updated_at FROM sessions WHERE session_id = ?",
+                                (session_id,)).fetchone()
+        if row is None:
+            return None
+        # The row stays as it is until the session is evicted again
+        return Session(self.max_messages, (tuple(message) for message in json.loads(row[0])), row[1])
+
+    def _session(self, session_id, create) -> Optional[Session]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._read(session_id)
+        if session is not None and session.updated_at < time.time() - self.ttl:
+            session = None
+        if session is None:
+            if not create:
+                self.sessions.pop(session_id, None)
+                return None
+            session = Session(self.max_messages)
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        evicted = []
+        while len(self.sessions) > self.active_sessions:
+            evicted.append(self.sessions.popitem(last=False))
+        self._write(evicted)
+        self.spilled += len(evicted)
+        return session
+
+    def append(self, session_id, role, text):
+        with self.lock:
+            session = self._session(session_id, create=True)
+            session.messages.append((role, text, self.count_tokens(text)))
+            session.updated_at = time.time()
+
+    def messages(self, session_id) -> List[Dict[str, str]]:
+        with self.lock:
+            session = self._session(session_id, create=False)
+            if session is None:
+                return []
+            return [{"role": role, "content": text} for role, text, _ in session.messages]
+
+    def has_messages(self, session_id) -> bool:
+        with self.lock:
+            session = self._session(session_id, create=False)
+            return session is not None and bool(session.messages)
+
+    def history(self, session_id, budget=CONVERSATION_HISTORY_TOKENS) -> str:
+        """The most recent messages that fit in `budget` tokens, oldest first, as Human:/Assistant: lines"""
+        with self.lock:
+            session = self._session(session_id, create=False)
+            if session is None:
+                return ""
+            lines = []
+            used = 0
+            for role, text, tokens in reversed(session.messages):
+                if used + tokens > budget:
+                    break
+                lines.append(f"{SPEAKERS.get(role, role)}: {text}")
+                used += tokens
+        return "\n".join(reversed(lines))
+
+    def clear(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stored = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] if self.conn is not None else 0
+        return {
+            "active_sessions": len(self.sessions),
+            "capacity": self.active_sessions,
+            "stored_sessions": stored,
+            "spilled": self.spilled
+        }
+
+    def close(self):
+        """Write the sessions still in memory so they survive a restart"""
+        with self.lock:
+            self._write(list(self.sessions.items()))
+            self.sessions.clear()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
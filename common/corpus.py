@@ -0,0 +1,225 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import zstandard
+
+# Name of the append-only block index inside a corpus directory
+INDEX_FILE = 'index.jsonl'
+# Records per compressed block; each block is an independent zstd frame
+CORPUS_BLOCK_RECORDS = int(os.environ.get('CORPUS_BLOCK_RECORDS', '64'))
+# Start a new shard once the current one reaches this many compressed bytes
+CORPUS_SHARD_BYTES = int(os.environ.get('CORPUS_SHARD_BYTES', str(64 * 1024 * 1024)))
+CORPUS_COMPRESSION_LEVEL = int(os.environ.get('CORPUS_COMPRESSION_LEVEL', '10'))
+# Compact after a finished crawl once this share of stored records has been superseded by newer copies
+CORPUS_COMPACT_THRESHOLD = float(os.environ.get('CORPUS_COMPACT_THRESHOLD', '0.2'))
+# Decompressed blocks kept while compaction gathers records out of write order
+COMPACT_CACHE_BLOCKS = 64
+
+
+def is_corpus(directory) -> bool:
+    """True if the directory holds a sharded corpus"""
+    return os.path.exists(os.path.join(directory, INDEX_FILE))
+
+
+class CorpusWriter:
+    """Append documents to a sharded, zstd-compressed JSONL corpus
+
+    Documents are buffered into blocks; every block is compressed as its own
+    zstd frame, appended to the current shard and only then recorded in the
+    index. Readers trust the index alone, so a crash can at worst lose the
+    block that was being written. Each writer session starts new shards, so
+    concurrent or repeated runs never overwrite each other.
+    """
+
+    def __init__(self, directory, block_records=CORPUS_BLOCK_RECORDS, shard_bytes=CORPUS_SHARD_BYTES,
+                 level=CORPUS_COMPRESSION_LEVEL):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.block_records = block_records
+        self.shard_bytes = shard_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.session = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.shard_seq = 0
+        self.shard = None
+        self.shard_name = None
+        self.block: List[bytes] = []
+        self.callbacks: List[Callable[[], None]] = []
+        self.records = 0
+        self.lock = threading.Lock()
+        self.index = open(os.path.join(directory, INDEX_FILE), 'a')
+
+    def _open_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        self.shard_name = f"shard-{self.session}-{self.shard_seq:05d}.jsonl.zst"
+        self.shard_seq += 1
+        self.shard = open(os.path.join(self.directory, self.shard_name), 'ab')
+
+    def write(self, doc: Dict[str, Any], on_durable: Optional[Callable[[], None]] = None):
+        """Queue a document; `on_durable` runs once its block is on disk and indexed"""
+        line = json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            self.block.append(line)
+            if on_durable is not None:
+                self.callbacks.append(on_durable)
+            if len(self.block) >= self.block_records:
+                callbacks = self._flush_block()
+            else:
+                callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def _flush_block(self):
+        if not self.block:
+            return []
+        if self.shard is None or self.shard.tell() >= self.shard_bytes:
+            self._open_shard()
+        frame = self.compressor.compress(b"\n".join(self.block) + b"\n")
+        offset = self.shard.tell()
+        self.shard.write(frame)
+        self.shard.flush()
+        os.fsync(self.shard.fileno())
+        self.index.write(json.dumps({
+            "shard": self.shard_name,
+            "offset": offset,
+            "length": len(frame),
+            "records": len(self.block)
+        }) + "\n")
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.records += len(self.block)
+        callbacks = self.callbacks
+        self.block = []
+        self.callbacks = []
+        return callbacks
+
+    def flush(self):
+        with self.lock:
+            callbacks = self._flush_block()
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusReader:
+    """Iterate the documents of a sharded corpus through memory-mapped shards"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def blocks(self) -> List[Dict[str, Any]]:
+        """Index entries in write order; a torn last line from a crash is ignored"""
+        entries = []
+        with open(os.path.join(self.directory, INDEX_FILE), 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+        return entries
+
+    def _iter_blocks(self, entries) -> Iterator[Tuple[str, List[bytes]]]:
+        mapped = {}
+        try:
+            for entry in entries:
+                shard = entry['shard']
+                if shard not in mapped:
+                    f = open(os.path.join(self.directory, shard), 'rb')
+                    mapped[shard] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                view = mapped[shard][1]
+                frame = view[entry['offset']:entry['offset'] + entry['length']]
+                lines = self.decompressor.decompress(frame).splitlines()
+                yield shard, lines
+        finally:
+            for f, view in mapped.values():
+                view.close()
+                f.close()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Every stored record, oldest first, including superseded versions"""
+        for _, lines in self._iter_blocks(self.blocks()):
+            for line in lines:
+                yield json.loads(line)
+
+    def latest(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """The newest record per URL as (shard, document), newest first"""
+        seen = set()
+        for shard, lines in self._iter_blocks(reversed(self.blocks())):
+            for line in reversed(lines):
+                doc = json.loads(line)
+                url = doc.get('url')
+                if url in seen:
+                    continue
+                seen.add(url)
+                yield shard, doc
+
+    def superseded(self) -> Tuple[int, int]:
+        """(stored records, records replaced by a newer one for the same URL)"""
+        stored = sum(entry['records'] for entry in self.blocks())
+        return stored, stored - sum(1 for _ in self.latest())
+
+    def compact(self, block_records=CORPUS_BLOCK_RECORDS, shard_bytes=CORPUS_SHARD_BYTES):
+        """Rewrite the corpus keeping only the newest record per URL, in the order URLs first appeared
+
+        No writer may be appending meanwhile: its blocks would go to the
+        index that is being replaced.
+        """
+        entries = self.blocks()
+        old_shards = {entry['shard'] for entry in entries}
+        # URL -> (block, line) of its newest record; updating a key keeps its first-seen position
+        newest: Dict[Any, Tuple[int, int]] = {}
+        for block, (_, lines) in enumerate(self._iter_blocks(entries)):
+            for line_number, line in enumerate(lines):
+                newest[json.loads(line).get('url')] = (block, line_number)
+
+        # Inside the corpus directory so the renames below stay on one filesystem
+        tmp_dir = os.path.join(self.directory, f".compact-{uuid.uuid4().hex[:8]}")
+        shards = {}
+        # Re-scraped pages sit in later shards than the rest, so reads follow a few sequential runs
+        cache: "OrderedDict[int, List[bytes]]" = OrderedDict()
+        try:
+            with CorpusWriter(tmp_dir, block_records, shard_bytes) as writer:
+                for block, line_number in newest.values():
+                    lines = cache.get(block)
+                    if lines is None:
+                        entry = entries[block]
+                        f = shards.get(entry['shard'])
+                        if f is None:
+                            f = shards[entry['shard']] = open(os.path.join(self.directory, entry['shard']), 'rb')
+                        f.seek(entry['offset'])
+                        lines = cache[block] = self.decompressor.decompress(f.read(entry['length'])).splitlines()
+                        if len(cache) > COMPACT_CACHE_BLOCKS:
+                            cache.popitem(last=False)
+                    else:
+                        cache.move_to_end(block)
+                    writer.write(json.loads(lines[line_number]))
+        finally:
+            for f in shards.values():
+                f.close()
+        # New shards first, then the index swap, then old shards: readers never see a gap
+        for name in os.listdir(tmp_dir):
+            if name != INDEX_FILE:
+                os.replace(os.path.join(tmp_dir, name), os.path.join(self.directory, name))
+        os.replace(os.path.join(tmp_dir, INDEX_FILE), os.path.join(self.directory, INDEX_FILE))
+        os.rmdir(tmp_dir)
+        for shard in old_shards:
+            os.remove(os.path.join(self.directory, shard))
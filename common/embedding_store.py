@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Chunk embeddings kept across re-indexes, one subdirectory per model; empty disables the store
+EMBEDDING_STORE_DIR = os.environ.get('EMBEDDING_STORE_DIR', '/app/data/embedding_store')
+
+# sha1 digest of the normalized chunk text
+DIGEST_BYTES = 20
+
+
+def normalize_text(text) -> str:
+    """Text as it is hashed: NFC with runs of whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_digest(text) -> bytes:
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).digest()
+
+
+def model_slug(model_name) -> str:
+    """Directory name for a model; the hash keeps names that only differ in punctuation apart"""
+    readable = re.sub(r'[^A-Za-z0-9._-]+', '_', model_name).strip('_')
+    return f"{readable}-{hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]}"
+
+
+class EmbeddingStore:
+    """Embeddings of chunk text on disk, keyed by model and a hash of the normalized text
+
+    Vectors are appended to a float32 file that is read through a memory map,
+    and their text digests to a parallel file that is loaded into a dict of
+    digest -> row. A vector is written before its digest, so an interrupted
+    append leaves at most a row nothing points to, which the next open trims.
+    Only one process should write to a store at a time.
+    """
+
+    def __init__(self, directory, model_name, dimension):
+        self.directory = os.path.join(directory, model_slug(model_name))
+        self.model_name = model_name
+        self.dimension = dimension
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._check_meta()
+        self.rows: Dict[bytes, int] = self._load()
+        self._mapped = None
+        self._vectors_file = open(self.vectors_path, 'ab')
+        self._keys_file = open(self.keys_path, 'ab')
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.directory, "vectors.f32")
+
+    @property
+    def keys_path(self):
+        return os.path.join(self.directory, "keys.sha1")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _check_meta(self):
+        path = os.path.join(self.directory, "meta.json")
+        meta = {"model": self.model_name, "dimension": self.dimension}
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"Embedding store {self.directory} holds {stored}, not {meta}")
+        else:
+            with open(path, 'w') as f:
+                json.dump(meta, f)
+
+    def _load(self) -> Dict[bytes, int]:
+        with open(self.keys_path, 'a+b') as f:
+            f.seek(0)
+            keys = f.read()
+        row_bytes = self.dimension * 4
+        with open(self.vectors_path, 'a+b') as f:
+            vector_rows = f.seek(0, os.SEEK_END) // row_bytes
+        count = min(len(keys) // DIGEST_BYTES, vector_rows)
+        # Drop the tail of an append that did not finish
+        os.truncate(self.keys_path, count * DIGEST_BYTES)
+        os.truncate(self.vectors_path, count * row_bytes)
+        if count:
+            logger.info(f"Embedding store for {self.model_name}: {count} vectors")
+        return {keys[i * DIGEST_BYTES:(i + 1) * DIGEST_BYTES]: i for i in range(count)}
+
+    def _read(self, rows: List[int]) -> np.ndarray:
+        if self._mapped is None or len(self._mapped) < len(self.rows):
+            self._mapped = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self.rows), self.dimension))
+        return np.asarray(self._mapped[rows])
+
+    def _put(self, digests: List[bytes], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._vectors_file.write(vectors.tobytes())
+        self._vectors_file.flush()
+        self._keys_file.write(b"".join(digests))
+        self._keys_file.flush()
+        for digest in digests:
+            self.rows[digest] = len(self.rows)
+
+    def encode(self, texts: Sequence[str], encode: Callable[[List[str]], Any]) -> np.ndarray:
+        """Embeddings for texts, calling encode only for texts not in the store yet and storing its result"""
+        digests = [text_digest(text) for text in texts]
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        with self.lock:
+            rows = [self.rows.get(digest) for digest in digests]
+            stored = [i for i, row in enumerate(rows) if row is not None]
+            if stored:
+                embeddings[stored] = self._read([rows[i] for i in stored])
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            # Identical chunks within one call are encoded once
+            first = {}
+            for i in missing:
+                first.setdefault(digests[i], i)
+            unique = list(first)
+            encoded = np.asarray(encode([texts[i] for i in first.values()]), dtype=np.float32)
+            position = {digest: n for n, digest in enumerate(unique)}
+            embeddings[missing] = encoded[[position[digests[i]] for i in missing]]
+            with self.lock:
+                new = [n for n, digest in enumerate(unique) if digest not in self.rows]
+                if new:
+                    self._put([unique[n] for n in new], encoded[new])
+        with self.lock:
+            self.hits += len(stored)
+            self.misses += len(missing)
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.rows),
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def close(self):
+        with self.lock:
+            self._vectors_file.close()
+            self._keys_file.close()
+            self._mapped = None
+
+
+def open_embedding_store(model_name, dimension, directory=EMBEDDING_STORE_DIR) -> Optional[EmbeddingStore]:
+    """The store for a model, or None when EMBEDDING_STORE_DIR is empty"""
+    if not directory:
+        return None
+    return EmbeddingStore(directory, model_name, dimension)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+# Paths served while a service is still warming up; everything else gets a 503
+PROBE_PATHS = frozenset(("/live", "/ready", "/metrics"))
+# Seconds clients are told to wait before retrying a request refused during warm-up
+WARMUP_RETRY_AFTER = os.environ.get('WARMUP_RETRY_AFTER', '5')
+
+READY = Gauge('service_ready', '1 once start-up has finished')
+STARTUP_SECONDS = Gauge('startup_seconds', 'Seconds from process start until the service was ready')
+
+_loaded_at = time.time()
+
+
+def process_age() -> float:
+    """Seconds since the process started, including interpreter start-up and imports"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks since boot; the name in field 2 may contain spaces
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time() - _loaded_at
+
+
+class Startup:
+    """Runs a service's slow initialisation in the background and reports how long each step took
+
+    The process can accept connections right away: liveness is
+    unconditional, readiness waits for the steps to finish, and a failed
+    step leaves the service live but never ready, with the error reported.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.steps: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        yield
+        self.steps[name] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"{self.service} start-up: {name} took {self.steps[name]:.0f} ms")
+
+    def run(self, warm_up: Callable[[], Any]):
+        try:
+            warm_up()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"{self.service} start-up failed: {self.error}", exc_info=True)
+            return
+        self.ready_after = round(process_age(), 2)
+        self.ready = True
+        READY.set(1)
+        STARTUP_SECONDS.set(self.ready_after)
+        logger.info(f"{self.service} ready {self.ready_after:.2f} s after process start ({json.dumps(self.steps)})")
+
+    def start(self, warm_up: Callable[[], Any]) -> threading.Thread:
+        thread = threading.Thread(target=self.run, args=(warm_up,), name=f"{self.service}-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready else ("failed" if self.error else "starting"),
+            "error": self.error,
+            "ready_after_seconds": self.ready_after,
+            "steps_ms": self.steps
+        }
+
+
+class ReadinessGate:
+    """ASGI middleware answering 503 to everything but the probes until start-up has finished"""
+
+    def __init__(self, app, startup: Startup):
+        self.app = app
+        self.startup = startup
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.startup.ready or scope["path"] in PROBE_PATHS:
+            await self.app(scope, receive, send)
+            return
+        body = json.dumps({"detail": f"{self.startup.service} is {self.startup.status()['status']}",
+                           **self.startup.status()}).encode()
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"), (b"retry-after", WARMUP_RETRY_AFTER.encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def add_probes(app, startup: Startup):
+    """/live, /ready and the warm-up gate for a FastAPI app"""
+    from fastapi.responses import JSONResponse
+    app.add_middleware(ReadinessGate, startup=startup)
+
+    def live():
+        return {"status": "alive"}
+
+    def ready():
+        return JSONResponse(status_code=200 if startup.ready else 503, content=startup.status())
+    app.add_api_route("/live", live, methods=["GET"], include_in_schema=False)
+    app.add_api_route("/ready", ready, methods=["GET"], include_in_schema=False)
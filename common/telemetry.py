@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Requests slower than this are logged with their request ID and stage breakdown
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+
+# Buckets from 1 ms to 60 s; covers a cached lookup as well as a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency until the response starts',
+                            ['method', 'path', 'status'], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram('stage_duration_seconds', 'Time spent in one stage of handling a request',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+QUEUE_DEPTH = Gauge('queue_depth', 'Work waiting in an internal queue', ['queue'])
+CACHE_HIT_RATIO = Gauge('cache_hit_ratio', 'Hit rate of an in-process cache since start', ['cache'])
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+_stage_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar('stage_timings',
+                                                                                            default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def propagation_headers() -> Dict[str, str]:
+    """Headers that carry the current request ID to the next service"""
+    request_id = _request_id.get()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.labels(name).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+
+
+def watch_queue(name, depth: Callable[[], float]):
+    QUEUE_DEPTH.labels(name).set_function(depth)
+
+
+def watch_cache(name, stats: Callable[[], dict]):
+    """Export the hit_rate reported by a cache's stats()"""
+    CACHE_HIT_RATIO.labels(name).set_function(lambda: stats()["hit_rate"])
+
+
+def _begin(request_id):
+    request_id = request_id or uuid.uuid4().hex
+    timings = {}
+    return request_id, timings, (_request_id.set(request_id), _stage_timings.set(timings))
+
+
+def _finish(tokens, method, path, status, request_id, timings, elapsed):
+    REQUEST_LATENCY.labels(method, path, str(status)).observe(elapsed)
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items())
+        logger.warning(f"Slow request {request_id}: {method} {path} {status} took {elapsed * 1000:.0f} ms"
+                       + (f" ({breakdown})" if breakdown else ""))
+    _request_id.reset(tokens[0])
+    _stage_timings.reset(tokens[1])
+
+
+class TelemetryMiddleware:
+    """ASGI middleware: request IDs, latency histogram and slow-request logging
+
+    Written against raw ASGI rather than BaseHTTPMiddleware so streamed
+    responses pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.lower().encode(), b"").decode()
+        request_id, timings, tokens = _begin(incoming)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # Label by route template so IDs in paths do not explode the series count
+            route = scope.get("route")
+            _finish(tokens, scope["method"], getattr(route, "path", "unmatched"), status, request_id, timings,
+                    time.perf_counter() - started)
+
+
+def instrument_fastapi(app):
+    """Add request telemetry and a /metrics endpoint to a FastAPI app"""
+    from fastapi import Response
+    app.add_middleware(TelemetryMiddleware)
+
+    def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+
+def instrument_flask(app):
+    """Add request telemetry and a /metrics endpoint to a Flask app"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def begin_request():
+        g.telemetry = _begin(request.headers.get(REQUEST_ID_HEADER)) + (time.perf_counter(),)
+
+    @app.after_request
+    def finish_request(response):
+        request_id, timings, tokens, started = g.pop("telemetry")
+        response.headers[REQUEST_ID_HEADER] = request_id
+        path = request.url_rule.rule if request.url_rule else "unmatched"
+        _finish(tokens, request.method, path, response.status_code, request_id, timings,
+                time.perf_counter() - started)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,192 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Collapse case and whitespace so trivially different queries share cache entries"""
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries also expire a fixed number of seconds after insertion"""
+
+    def __init__(self, capacity: int, ttl: float):
+        super().__init__(capacity)
+        self.ttl = ttl
+        self.expired = 0
+
+    def get(self, key) -> Optional[Any]:
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            with self._lock:
+                self._data.pop(key, None)
+                # The parent counted this as a hit; it is really a miss
+                self.hits -= 1
+                self.misses += 1
+                self.expired += 1
+            return None
+        return value
+
+    def put(self, key, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"ttl_seconds": self.ttl, "expired": self.expired})
+        return stats
+
+
+class SemanticCache:
+    """Answers keyed by query embedding, returned for any query whose embedding is close enough
+
+    Entries live in one preallocated matrix of unit vectors, so a lookup is a
+    single matrix-vector product; at a few thousand entries that is faster
+    than maintaining an ANN structure. Only entries with the same scope
+    (result count and filters) can match. Entries expire after `ttl`
+    seconds, the least recently used one is replaced when full, and
+    everything is dropped when the index version changes.
+    """
+
+    def __init__(self, capacity: int, threshold: float, ttl: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._scopes = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._expires = np.full(max(capacity, 0), -np.inf)
+        self._values: List[Any] = [None] * max(capacity, 0)
+        # Slot -> None in least recently used order
+        self._slots: "OrderedDict[int, None]" = OrderedDict()
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def _check_version(self, index_version) -> bool:
+        """Drop everything when the index moved on; False for a caller still on an older version"""
+        if self.index_version is not None and index_version < self.index_version:
+            return False
+        if index_version != self.index_version:
+            self._slots.clear()
+            self._expires[:] = -np.inf
+            self._values = [None] * self.capacity
+            self.index_version = index_version
+        return True
+
+    def get(self, embedding, scope: Hashable, index_version) -> Optional[Tuple[Any, float]]:
+        """(value, similarity) of the closest live entry above the threshold"""
+        if self.capacity <= 0:
+            return None
+        with self._lock:
+            if not self._check_version(index_version) or not self._slots:
+                self.misses += 1
+                return None
+            scores = self._vectors @ np.asarray(embedding, dtype=np.float32)
+            now = time.monotonic()
+            stale = (self._expires < now) & (self._expires > -np.inf)
+            for slot in np.flatnonzero(stale):
+                self._drop(int(slot))
+                self.expired += 1
+            scores[(self._scopes != hash(scope)) | (self._expires < now)] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._slots.move_to_end(best)
+            self.hits += 1
+            return self._values[best], float(scores[best])
+
+    def _drop(self, slot):
+        self._slots.pop(slot, None)
+        self._expires[slot] = -np.inf
+        self._values[slot] = None
+
+    def put(self, embedding, scope: Hashable, index_version, value):
+        if self.capacity <= 0:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, len(embedding)), dtype=np.float32)
+            if len(self._slots) < self.capacity:
+                slot = int(np.flatnonzero(self._expires == -np.inf)[0])
+            else:
+                slot, _ = self._slots.popitem(last=False)
+            self._vectors[slot] = embedding
+            self._scopes[slot] = hash(scope)
+            self._expires[slot] = time.monotonic() + self.ttl
+            self._values[slot] = value
+            self._slots[slot] = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._slots),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
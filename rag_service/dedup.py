@@ -0,0 +1,137 @@
+import os
+import re
+import zlib
+import hashlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Collapse exact and near-duplicate chunks into one stored vector
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+# Estimated Jaccard similarity of word shingles above which two chunks count as duplicates; 1 keeps exact matches only
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.9'))
+# Only chunks whose documents agree on these metadata fields are merged, so filtered searches stay exact;
+# dropping "version" also merges procedures repeated across releases, at the cost of version filters missing them
+DEDUP_SCOPE = tuple(field for field in os.environ.get('DEDUP_SCOPE', 'product,version,document_type').split(',')
+                    if field)
+
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 128
+# 16 bands of 8 rows: chunks 0.9 similar share a band with probability 0.9999, chunks 0.5 similar with 0.06
+LSH_BANDS = 16
+_PRIME = (1 << 31) - 1
+# Fixed seed: signatures are stored, so the permutations must not change between runs
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, _PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text) -> List[int]:
+    """crc32 of every run of SHINGLE_WORDS lower-cased words"""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return [zlib.crc32(" ".join(words).encode('utf-8'))]
+    return list({zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+                 for i in range(len(words) - SHINGLE_WORDS + 1)})
+
+
+def minhash(text) -> np.ndarray:
+    values = np.asarray(shingles(text), dtype=np.uint64)
+    # a * x + b stays below 2**64 for 31-bit a, b and 32-bit x
+    return ((_A[:, None] * values[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def lsh_buckets(signature: np.ndarray) -> List[int]:
+    """One bucket per band; chunks sharing any bucket are compared"""
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=7).digest(),
+                           'big')
+            for band in range(LSH_BANDS)]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return float(np.mean(a == b))
+
+
+class Fingerprint:
+    def __init__(self, text):
+        self.text_hash = hashlib.sha1(" ".join(text.split()).encode('utf-8')).hexdigest()
+        self.signature = minhash(text)
+        self.buckets = lsh_buckets(self.signature)
+
+
+def dedup_scope(metadata) -> str:
+    return "\0".join(str(metadata.get(field, '')) for field in DEDUP_SCOPE)
+
+
+class Deduplicator:
+    """Finds, for each new chunk, an indexed chunk it duplicates, for one ingestion run
+
+    Fingerprints of indexed chunks live in the ingest manifest. Chunks sent
+    during the run are kept here only until their document is recorded, so
+    later duplicates in the same run map to them without trusting chunks
+    that never reached the vector DB on a later run; after that they are
+    looked up in the manifest like any other, and memory stays bounded by
+    the chunks in flight.
+    """
+
+    def __init__(self, manifest, threshold=DEDUP_THRESHOLD, reset=False):
+        self.manifest = manifest
+        self.threshold = threshold
+        if reset:
+            # The vector DB may have been wiped: only chunks sent from now on can be reused
+            manifest.clear_fingerprints()
+        # Sent, but their documents are not recorded yet
+        self.pending: Dict[str, Tuple[str, Fingerprint]] = {}
+        self._pending_text: Dict[Tuple[str, str], str] = {}
+        self._pending_buckets: Dict[Tuple[str, int, int], List[str]] = {}
+
+    def find(self, scope, text) -> Tuple[Optional[str], Fingerprint]:
+        """(id of the chunk this text duplicates or None, the text's fingerprint)"""
+        fingerprint = Fingerprint(text)
+        match = self._pending_text.get((scope, fingerprint.text_hash))
+        if match is None:
+            match = self.manifest.fingerprint_by_text(scope, fingerprint.text_hash)
+        if match is not None or self.threshold >= 1:
+            return match, fingerprint
+
+        candidates = {}
+        for band, bucket in enumerate(fingerprint.buckets):
+            for chunk_id in self._pending_buckets.get((scope, band, bucket), ()):
+                candidates[chunk_id] = self.pending[chunk_id][1].signature
+        for chunk_id, signature in self.manifest.bucket_candidates(scope, fingerprint.buckets):
+            candidates.setdefault(chunk_id, np.frombuffer(signature, dtype=np.uint32))
+        best, best_similarity = None, self.threshold
+        for chunk_id, signature in candidates.items():
+            score = similarity(fingerprint.signature, signature)
+            if score >= best_similarity:
+                best, best_similarity = chunk_id, score
+        return best, fingerprint
+
+    def add(self, chunk_id, scope, fingerprint: Fingerprint):
+        """Make a chunk sent in this run available to later duplicates"""
+        self.pending[chunk_id] = (scope, fingerprint)
+        self._pending_text.setdefault((scope, fingerprint.text_hash), chunk_id)
+        for band, bucket in enumerate(fingerprint.buckets):
+            self._pending_buckets.setdefault((scope, band, bucket), []).append(chunk_id)
+
+    def commit(self, chunk_ids):
+        """Store the fingerprints of chunks that are now in the vector DB and stop holding them here"""
+        rows = []
+        for chunk_id in chunk_ids:
+            entry = self.pending.pop(chunk_id, None)
+            if entry is None:
+                continue
+            scope, fingerprint = entry
+            rows.append((chunk_id, scope, fingerprint.text_hash, fingerprint.signature.tobytes(),
+                         fingerprint.buckets))
+            key = (scope, fingerprint.text_hash)
+            if self._pending_text.get(key) == chunk_id:
+                del self._pending_text[key]
+            for band, bucket in enumerate(fingerprint.buckets):
+                key = (scope, band, bucket)
+                members = self._pending_buckets[key]
+                members.remove(chunk_id)
+                if not members:
+                    del self._pending_buckets[key]
+        self.manifest.add_fingerprints(rows)
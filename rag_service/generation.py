@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Set
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# "extractive" keeps the built-in answer; "ollama" or "openai" call a model server
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'extractive').lower()
+LLM_URL = os.environ.get('LLM_URL', 'http://localhost:11434')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'llama3.2')
+LLM_API_KEY = os.environ.get('LLM_API_KEY', '')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '120'))
+# Model context window, and the part of it reserved for the answer
+LLM_CONTEXT_TOKENS = int(os.environ.get('LLM_CONTEXT_TOKENS', '4096'))
+LLM_MAX_TOKENS = int(os.environ.get('LLM_MAX_TOKENS', '512'))
+# Concurrent requests are coalesced into batches of up to this size...
+LLM_BATCH_SIZE = int(os.environ.get('LLM_BATCH_SIZE', '8'))
+# ...collected for at most this long after the first one arrives
+LLM_BATCH_WAIT_MS = float(os.environ.get('LLM_BATCH_WAIT_MS', '10'))
+# Batches in flight at the model server at once
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '4'))
+# Requests allowed to wait for a batch slot before new ones are rejected
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '64'))
+
+PROMPT_TEMPLATE = """You are a helpful system administration assistant. Use the provided documentation to answer the user's question as accurately and concisely as possible.
+
+Reference Documentation:
+{context}
+{history}
+User Question: {question}
+
+Instructions:
+1. Answer the user's question based on the Reference Documentation.
+2. If the answer is not found in the Reference Documentation, truthfully say that you cannot find the answer.
+3. When providing code examples, format them correctly and include comments to explain what the code does.
+4. If the user asks about a specific error message, try to find the cause of the error and suggest possible solutions.
+5. Be concise and to the point.
+"""
+
+# End of a request's output in its queue
+_END = object()
+
+
+class GeneratorOverloaded(RuntimeError):
+    """Raised when more requests are waiting than the queue allows"""
+
+
+def build_prompt(question: str, contexts: List[str], count_tokens: Callable[[str], int],
+                 budget: int = LLM_CONTEXT_TOKENS - LLM_MAX_TOKENS, history: str = "") -> str:
+    """Fill the template with as many retrieved chunks, best first, as fit the token budget
+
+    Earlier conversation, already trimmed to its own budget, is included in
+    full and leaves less room for chunks.
+    """
+    history = f"\nPrevious Conversation:\n{history}\n" if history else ""
+    used = count_tokens(PROMPT_TEMPLATE.format(context="", question=question, history=history))
+    kept = []
+    for context in contexts:
+        tokens = count_tokens(context) + 1
+        if used + tokens > budget:
+            break
+        kept.append(context)
+        used += tokens
+    if len(kept) < len(contexts):
+        logger.debug(f"Prompt budget of {budget} tokens kept {len(kept)} of {len(contexts)} chunks")
+    return PROMPT_TEMPLATE.format(context="\n\n".join(kept), question=question, history=history)
+
+
+class GenerationRequest:
+    def __init__(self, prompt, max_tokens):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.enqueued_at = time.perf_counter()
+
+    def put(self, text):
+        self.queue.put_nowait(text)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.queue.put_nowait(error if error is not None else _END)
+
+
+class OllamaBackend:
+    """Ollama /api/generate; a batch is sent as concurrent streaming requests
+
+    Ollama schedules parallel requests itself (OLLAMA_NUM_PARALLEL), so the
+    batch only bounds how many of them reach it together.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, model):
+        self.client = client
+        self.model = model
+
+    async def _generate(self, request: GenerationRequest):
+        try:
+            async with self.client.stream("POST", "/api/generate", json={
+                "model": self.model,
+                "prompt": request.prompt,
+                "stream": True,
+                "options": {"num_predict": request.max_tokens}
+            }) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"Ollama returned {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    part = json.loads(line)
+                    if part.get("response"):
+                        request.put(part["response"])
+                    if part.get("done"):
+                        break
+            request.finish()
+        except Exception as e:
+            request.finish(e)
+
+    async def generate_batch(self, requests: List[GenerationRequest]):
+        await asyncio.gather(*(self._generate(request) for request in requests))
+
+
+class OpenAIBackend:
+    """OpenAI-compatible /v1/completions; a whole batch is one request with a list of prompts
+
+    Servers such as vLLM or llama.cpp stream the choices interleaved, tagged
+    with the index of their prompt, which routes each piece to its request.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, model):
+        self.client = client
+        self.model = model
+
+    async def generate_batch(self, requests: List[GenerationRequest]):
+        open_requests = dict(enumerate(requests))
+        try:
+            async with self.client.stream("POST", "/v1/completions", json={
+                "model": self.model,
+                "prompt": [request.prompt for request in requests],
+                "max_tokens": max(request.max_tokens for request in requests),
+                "stream": True
+            }) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise RuntimeError(f"Completion server returned {response.status_code}: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    for choice in json.loads(data).get("choices", []):
+                        request = open_requests.get(choice.get("index", 0))
+                        if request is None:
+                            continue
+                        if choice.get("text"):
+                            request.put(choice["text"])
+                        if choice.get("finish_reason"):
+                            request.finish()
+                            del open_requests[choice.get("index", 0)]
+            for request in open_requests.values():
+                request.finish()
+        except Exception as e:
+            for request in open_requests.values():
+                request.finish(e)
+
+
+BACKENDS = {"ollama": OllamaBackend, "openai": OpenAIBackend}
+
+
+class Generator:
+    """Streams completions, coalescing concurrent requests into batches
+
+    Requests wait at most `batch_wait_ms` for company before their batch is
+    dispatched, at most `max_concurrency` batches run against the model
+    server at once, and once `max_queue` requests are waiting new ones are
+    rejected rather than piling up behind a saturated server.
+    """
+
+    def __init__(self, backend, batch_size=LLM_BATCH_SIZE, batch_wait_ms=LLM_BATCH_WAIT_MS,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, max_tokens=LLM_MAX_TOKENS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_tokens = max_tokens
+        self.limiter = asyncio.Semaphore(max_concurrency)
+        self.pending: Optional[asyncio.Queue] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        # The event loop only keeps weak references to tasks, so running batches are held here
+        self.tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.requests = 0
+        self.rejected = 0
+        self.queue_wait_ms = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return self.pending.qsize() if self.pending is not None else 0
+
+    def _start(self):
+        # Created lazily so they belong to the serving event loop
+        if self.dispatcher is None:
+            self.pending = asyncio.Queue()
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self.limiter.acquire()
+            now = time.perf_counter()
+            for request in batch:
+                self.queue_wait_ms += (now - request.enqueued_at) * 1000
+            self.batches += 1
+            task = asyncio.create_task(self._run_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            await self.backend.generate_batch(batch)
+        except asyncio.CancelledError:
+            # Shutting down: fail the streams still waiting instead of leaving them hanging
+            for request in batch:
+                request.finish(RuntimeError("Generator closed"))
+            raise
+        finally:
+            self.limiter.release()
+
+    async def stream(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """Yield pieces of the completion of a prompt as the model produces them"""
+        self._start()
+        if self.pending.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise GeneratorOverloaded(f"{self.pending.qsize()} generation requests are already waiting")
+        request = GenerationRequest(prompt, max_tokens or self.max_tokens)
+        self.requests += 1
+        self.pending.put_nowait(request)
+        while True:
+            item = await request.queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def generate(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        return "".join([piece async for piece in self.stream(prompt, max_tokens)])
+
+    async def aclose(self):
+        tasks = list(self.tasks)
+        if self.dispatcher is not None:
+            tasks.append(self.dispatcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.backend.client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        dispatched = self.requests - self.waiting
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(dispatched / self.batches, 2) if self.batches else 0.0,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "mean_queue_wait_ms": round(self.queue_wait_ms / dispatched, 2) if dispatched else 0.0
+        }
+
+
+def make_generator(backend=LLM_BACKEND, url=LLM_URL, model=LLM_MODEL, api_key=LLM_API_KEY, **kwargs) -> Generator:
+    """Generator for a configured backend with a keep-alive client sized for its concurrency"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+    connections = LLM_MAX_CONCURRENCY * LLM_BATCH_SIZE
+    client = httpx.AsyncClient(
+        base_url=url,
+        headers=headers,
+        limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=5)
+    )
+    return Generator(BACKENDS[backend](client, model), **kwargs)
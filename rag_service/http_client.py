@@ -0,0 +1,63 @@
+import os
+import random
+import asyncio
+import logging
+import httpx
+from common.telemetry import propagation_headers
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and retry settings for calls to the vector DB
+VECTOR_DB_POOL_SIZE = int(os.environ.get('VECTOR_DB_POOL_SIZE', '32'))
+VECTOR_DB_TIMEOUT = float(os.environ.get('VECTOR_DB_TIMEOUT', '30'))
+VECTOR_DB_CONNECT_TIMEOUT = float(os.environ.get('VECTOR_DB_CONNECT_TIMEOUT', '5'))
+VECTOR_DB_RETRIES = int(os.environ.get('VECTOR_DB_RETRIES', '3'))
+VECTOR_DB_BACKOFF = float(os.environ.get('VECTOR_DB_BACKOFF', '0.2'))
+
+# Responses worth retrying: the upstream is restarting or overloaded
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class AsyncServiceClient:
+    """Keep-alive async HTTP client with retries and exponential backoff"""
+
+    def __init__(self, base_url, pool_size=VECTOR_DB_POOL_SIZE, timeout=VECTOR_DB_TIMEOUT,
+                 connect_timeout=VECTOR_DB_CONNECT_TIMEOUT, retries=VECTOR_DB_RETRIES,
+                 backoff=VECTOR_DB_BACKOFF, transport=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            transport=transport
+        )
+
+    async def _sleep_before_retry(self, attempt):
+        # Full jitter keeps retrying clients from synchronizing
+        await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    async def request(self, method, path, **kwargs) -> httpx.Response:
+        # Carry the caller's request ID so the hop can be traced end to end
+        kwargs["headers"] = {**propagation_headers(), **(kwargs.get("headers") or {})}
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"{method} {path} failed ({e!r}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    return response
+                logger.warning(f"{method} {path} returned {response.status_code}, retrying")
+            await self._sleep_before_retry(attempt)
+
+    async def get(self, path, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from common.corpus import CorpusReader, is_corpus
+from common.telemetry import REQUEST_ID_HEADER, stage
+from manifest import IngestManifest, INGEST_MANIFEST_PATH
+from dedup import Deduplicator, DEDUP_ENABLED, dedup_scope
+
+logger = logging.getLogger(__name__)
+
+# Ingestion tuning
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '64'))
+INGEST_BATCH_BYTES = int(os.environ.get('INGEST_BATCH_BYTES', str(2 * 1024 * 1024)))
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', '4'))
+INGEST_TIMEOUT = float(os.environ.get('INGEST_TIMEOUT', '120'))
+INGEST_RETRIES = int(os.environ.get('INGEST_RETRIES', '3'))
+
+# Document fields copied into every chunk's metadata so searches can filter on them
+METADATA_FIELDS = ('product', 'version', 'document_type')
+# Bump when the chunk metadata layout changes so existing documents are re-sent
+METADATA_VERSION = 2
+
+# Rough per-chunk JSON overhead (id, metadata, embedding, punctuation) used when sizing batches
+CHUNK_OVERHEAD_BYTES = 8 * 1024
+
+
+def iter_documents(document_dir) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (path, document) pairs one document at a time
+
+    A sharded corpus is read first, newest record per URL first, followed by
+    any legacy one-file-per-page JSON documents in the same directory.
+    """
+    if is_corpus(document_dir):
+        for shard, doc_data in CorpusReader(document_dir).latest():
+            if doc_data.get('text') and doc_data.get('url'):
+                yield os.path.join(document_dir, shard), doc_data
+
+    with os.scandir(document_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, 'r') as f:
+                    doc_data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping unreadable document {entry.path}: {e}")
+                continue
+            if not doc_data.get('text') or not doc_data.get('url'):
+                continue
+            yield entry.path, doc_data
+
+
+def content_hash(doc_data) -> str:
+    """Hash the parts of a document that end up in the index"""
+    digest = hashlib.sha256()
+    digest.update(doc_data.get('title', '').encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(doc_data['text'].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def chunk_record_id(url, index, chunk) -> str:
+    """Derive a chunk id that changes whenever the chunk text changes"""
+    chunk_hash = hashlib.sha1(chunk.encode('utf-8')).hexdigest()
+    return hashlib.md5(f"{url}_{index}_{chunk_hash}".encode()).hexdigest()
+
+
+def iter_batches(items, max_count=INGEST_BATCH_SIZE, max_bytes=INGEST_BATCH_BYTES) -> Iterator[List[Tuple[Any, Dict[str, Any]]]]:
+    """Group (owner, record) pairs into batches bounded by record count and approximate payload size"""
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        size = len(item[1]['text'].encode('utf-8')) + CHUNK_OVERHEAD_BYTES
+        if batch and (len(batch) >= max_count or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def make_session(pool_size=INGEST_CONCURRENCY) -> requests.Session:
+    """Create a keep-alive session sized for the ingestion worker pool"""
+    session = requests.Session()
+    # Upserts and deletes are idempotent, so POSTs are safe to retry
+    retry = Retry(total=INGEST_RETRIES, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                  allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class IngestJob:
+    """Progress of a single background ingestion run"""
+
+    def __init__(self, document_dir, force=False):
+        self.id = uuid.uuid4().hex
+        self.document_dir = document_dir
+        self.force = force
+        self.status = "pending"
+        self.error = None
+        self.documents = 0
+        self.skipped_documents = 0
+        self.updated_documents = 0
+        self.removed_documents = 0
+        self.chunks = 0
+        self.deleted_chunks = 0
+        self.duplicate_chunks = 0
+        self.batches = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def chunks_per_sec(self):
+        elapsed = self.elapsed
+        return self.chunks / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "document_dir": self.document_dir,
+            "force": self.force,
+            "error": self.error,
+            "processed_documents": self.documents,
+            "skipped_documents": self.skipped_documents,
+            "updated_documents": self.updated_documents,
+            "removed_documents": self.removed_documents,
+            "processed_chunks": self.chunks,
+            "deleted_chunks": self.deleted_chunks,
+            "duplicate_chunks": self.duplicate_chunks,
+            "batches": self.batches,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "chunks_per_sec": round(self.chunks_per_sec, 2)
+        }
+
+
+class PendingDocument:
+    """A changed document whose chunks are on their way to the vector DB"""
+
+    def __init__(self, source, path, content_hash, chunk_ids, remaining, title='', previous=()):
+        self.source = source
+        self.path = path
+        self.content_hash = content_hash
+        self.chunk_ids = chunk_ids
+        self.remaining = remaining
+        self.title = title
+        # Chunk ids the document used before this run
+        self.previous = set(previous)
+        # Chunks this document sends itself, as opposed to duplicates it shares
+        self.new_ids = []
+        # Set when it shares a chunk another document is still sending in this run
+        self.waits_for_others = False
+
+
+class IngestionPipeline:
+    """Stream changed documents from disk into the vector DB in concurrent batches"""
+
+    def __init__(self, vector_db_url, chunker, embedder, chunker_version,
+                 manifest_path=INGEST_MANIFEST_PATH, batch_size=INGEST_BATCH_SIZE,
+                 batch_bytes=INGEST_BATCH_BYTES, concurrency=INGEST_CONCURRENCY, embedding_store=None,
+                 dedup=DEDUP_ENABLED):
+        self.vector_db_url = vector_db_url
+        self.chunker = chunker
+        self.embedder = embedder
+        # Chunks embedded by any earlier run, even against a since-wiped vector DB, are not encoded again
+        self.embedding_store = embedding_store
+        self.model_version = embedder.model_name
+        self.dedup = dedup
+        # Chunk metadata is produced alongside the chunks, so its layout versions them too
+        self.chunker_version = f"{chunker_version}+meta{METADATA_VERSION}" + ("+dedup" if dedup else "")
+        self.manifest_path = manifest_path
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.concurrency = concurrency
+        manifest = IngestManifest(manifest_path)
+        try:
+            self.index_version = manifest.index_version()
+        finally:
+            manifest.close()
+
+    def _embed_batch(self, batch):
+        """Attach embeddings to every record of a batch with one vectorized encode"""
+        texts = [record['text'] for _, record in batch]
+        with stage("ingest_embed"):
+            if self.embedding_store is not None:
+                embeddings = self.embedding_store.encode(texts, self.embedder.encode)
+            else:
+                embeddings = self.embedder.encode(texts)
+        for (_, record), embedding in zip(batch, embeddings.tolist()):
+            record['embedding'] = embedding
+
+    def _send_batch(self, session, batch):
+        with stage("ingest_send"):
+            response = session.post(
+                f"{self.vector_db_url}/add_embeddings",
+                json={"documents": [record for _, record in batch]},
+                timeout=INGEST_TIMEOUT
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to add documents to vector DB: {response.text}")
+        return batch
+
+    def _delete_chunks(self, session, chunk_ids):
+        for start in range(0, len(chunk_ids), self.batch_size):
+            response = session.post(
+                f"{self.vector_db_url}/delete",
+                json={"ids": chunk_ids[start:start + self.batch_size]},
+                timeout=INGEST_TIMEOUT
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to delete chunks from vector DB: {response.text}")
+
+    def _update_metadata(self, session, manifest, chunk_ids):
+        """Point shared chunks at every document that uses them"""
+        sources = manifest.chunk_sources(chunk_ids)
+        updates = [{
+            "id": chunk_id,
+            "metadata": {
+                "url": documents[0][0],
+                "title": documents[0][1],
+                "sources": "\n".join(url for url, _ in documents),
+                "duplicates": len(documents) - 1
+            }
+        } for chunk_id, documents in sources.items()]
+        for start in range(0, len(updates), self.batch_size):
+            response = session.post(
+                f"{self.vector_db_url}/update_metadata",
+                json={"documents": updates[start:start + self.batch_size]},
+                timeout=INGEST_TIMEOUT
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to update chunk metadata in vector DB: {response.text}")
+
+    def _plan(self, job, manifest, seen, finalize, dedup, shared):
+        """Yield (document, record) pairs for chunks that are not indexed yet"""
+        for path, doc_data in iter_documents(job.document_dir):
+            job.documents += 1
+            source = doc_data['url']
+            if source in seen:
+                # Older copies of a page, e.g. legacy files next to the corpus
+                logger.debug(f"Skipping {path}: a newer copy of {source} was already ingested")
+                continue
+            seen.add(source)
+
+            doc_hash = content_hash(doc_data)
+            entry = manifest.get(source)
+            if not job.force and entry and entry.is_current(doc_hash, self.model_version, self.chunker_version):
+                job.skipped_documents += 1
+                continue
+
+            # Chunks already embedded with the current model and metadata can stay where they are
+            indexed = set()
+            if (not job.force and entry and entry.model_version == self.model_version
+                    and entry.chunker_version == self.chunker_version):
+                indexed = entry.chunk_ids
+
+            metadata = {
+                "url": source,
+                "title": doc_data.get('title', ''),
+                "source": "Red Hat Documentation"
+            }
+            for field in METADATA_FIELDS:
+                # Chroma metadata values cannot be null
+                metadata[field] = str(doc_data.get(field) or '')
+
+            records = []
+            chunk_ids = []
+            document = PendingDocument(source, path, doc_hash, chunk_ids, 0, metadata["title"],
+                                       entry.chunk_ids if entry else ())
+            scope = dedup_scope(metadata)
+            for i, chunk in enumerate(self.chunker(doc_data['text'])):
+                chunk_id = chunk_record_id(source, i, chunk)
+                if chunk_id in indexed:
+                    chunk_ids.append(chunk_id)
+                    continue
+                if dedup is not None:
+                    original, fingerprint = dedup.find(scope, chunk)
+                    if original is not None and original != chunk_id:
+                        # Store one vector for the text and let this document refer to it
+                        chunk_ids.append(original)
+                        shared.add(original)
+                        job.duplicate_chunks += 1
+                        document.waits_for_others |= original in dedup.pending
+                        continue
+                    dedup.add(chunk_id, scope, fingerprint)
+                chunk_ids.append(chunk_id)
+                document.new_ids.append(chunk_id)
+                records.append({
+                    "id": chunk_id,
+                    "text": chunk,
+                    "metadata": dict(metadata, chunk_id=i)
+                })
+
+            document.remaining = len(records)
+            if not records:
+                finalize(document)
+                continue
+            for record in records:
+                yield document, record
+
+    def run(self, job: IngestJob):
+        job.status = "running"
+        job.started_at = time.time()
+        session = make_session(self.concurrency)
+        # Ties the vector DB's log lines for these writes to the job
+        session.headers[REQUEST_ID_HEADER] = job.id
+        manifest = IngestManifest(self.manifest_path)
+        # Keep at most two batches per worker in flight so memory stays bounded
+        max_in_flight = self.concurrency * 2
+        pending = set()
+        seen = set()
+        stale = []
+        # A forced run may follow a wiped vector DB, so only chunks sent now are shared
+        dedup = Deduplicator(manifest, reset=job.force) if self.dedup else None
+        # Chunks used by more than one document, or by fewer than before, whose metadata needs updating
+        shared = set()
+        # Documents sharing chunks that were still being sent; recorded once everything has been sent
+        deferred = []
+
+        def finalize(document):
+            if document.waits_for_others:
+                deferred.append(document)
+                return
+            if dedup is not None:
+                dedup.commit(document.new_ids)
+            released = manifest.record(document.source, document.path, document.content_hash, self.model_version,
+                                       self.chunker_version, document.chunk_ids, document.title)
+            stale.extend(released)
+            shared.update(document.previous - set(document.chunk_ids) - set(released))
+            job.updated_documents += 1
+
+        def collect(done):
+            for future in done:
+                batch = future.result()
+                job.chunks += len(batch)
+                job.batches += 1
+                for document, _ in batch:
+                    document.remaining -= 1
+                    if document.remaining == 0:
+                        finalize(document)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                try:
+                    items = self._plan(job, manifest, seen, finalize, dedup, shared)
+                    for batch in iter_batches(items, self.batch_size, self.batch_bytes):
+                        if len(pending) >= max_in_flight:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        # Encoding here overlaps with the uploads already in flight
+                        self._embed_batch(batch)
+                        pending.add(executor.submit(self._send_batch, session, batch))
+                    done, pending = wait(pending)
+                    collect(done)
+                finally:
+                    for future in pending:
+                        future.cancel()
+            for document in deferred:
+                document.waits_for_others = False
+                finalize(document)
+
+            # Only a complete scan can tell which documents disappeared
+            for source in manifest.sources() - seen:
+                previous = manifest.get(source).chunk_ids
+                released = manifest.remove(source)
+                stale.extend(released)
+                shared.update(previous - set(released))
+                job.removed_documents += 1
+
+            if shared:
+                self._update_metadata(session, manifest, shared)
+        except Exception as e:
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.id} failed: {e}")
+        finally:
+            # The manifest has already let go of these ids, so remove them even after a failure
+            try:
+                if stale and shared:
+                    # Released by one document earlier in the run, then shared by another
+                    still_used = manifest.chunk_sources(shared.intersection(stale))
+                    stale = [chunk_id for chunk_id in stale if chunk_id not in still_used]
+                if stale:
+                    self._delete_chunks(session, stale)
+                    job.deleted_chunks = len(stale)
+            except Exception as e:
+                job.error = f"{job.error}; {e}" if job.error else str(e)
+                logger.error(f"Ingestion job {job.id} could not delete {len(stale)} orphaned chunks: {e}")
+            if job.chunks or job.deleted_chunks:
+                # Lets query-side caches drop results computed against the old index
+                self.index_version = manifest.bump_index_version()
+            manifest.close()
+            session.close()
+            # Last, so pollers and the one-job-at-a-time check only see a job that is really done
+            job.finished_at = time.time()
+            job.status = "failed" if job.error else "completed"
+        if job.status == "completed":
+            logger.info(f"Ingestion job {job.id} finished: {job.chunks} chunks from "
+                        f"{job.updated_documents} changed documents, {job.skipped_documents} unchanged, "
+                        f"{job.deleted_chunks} orphaned chunks deleted ({job.chunks_per_sec:.1f} chunks/sec)")
+
+
+class JobRegistry:
+    """Track ingestion jobs and allow only one to run at a time"""
+
+    def __init__(self):
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def running(self) -> Optional[IngestJob]:
+        for job in self._jobs.values():
+            if job.status in ("pending", "running"):
+                return job
+        return None
+
+    def start(self, pipeline: IngestionPipeline, document_dir, force=False) -> Tuple[IngestJob, bool]:
+        """Start a job in a background thread; returns (job, started)"""
+        with self._lock:
+            active = self.running()
+            if active is not None:
+                return active, False
+            job = IngestJob(document_dir, force)
+            self._jobs[job.id] = job
+        thread = threading.Thread(target=pipeline.run, args=(job,), name=f"ingest-{job.id[:8]}", daemon=True)
+        thread.start()
+        return job, True
@@ -0,0 +1,194 @@
+import os
+import time
+import sqlite3
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+
+INGEST_MANIFEST_PATH = os.environ.get('INGEST_MANIFEST_PATH', '/app/data/ingest_manifest.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    source TEXT PRIMARY KEY,
+    path TEXT,
+    content_hash TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    chunker_version TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    source TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (source, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS chunks_by_id ON chunks (chunk_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    chunk_id TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_by_text ON fingerprints (scope, text_hash);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    scope TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (scope, band, bucket, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS lsh_buckets_by_chunk ON lsh_buckets (chunk_id);
+"""
+
+
+class ManifestEntry:
+    """What was last indexed for one source document"""
+
+    def __init__(self, source, content_hash, model_version, chunker_version, chunk_ids):
+        self.source = source
+        self.content_hash = content_hash
+        self.model_version = model_version
+        self.chunker_version = chunker_version
+        self.chunk_ids = chunk_ids
+
+    def is_current(self, content_hash, model_version, chunker_version):
+        return (self.content_hash == content_hash
+                and self.model_version == model_version
+                and self.chunker_version == chunker_version)
+
+
+class IngestManifest:
+    """SQLite-backed record of indexed documents and the chunk ids they own"""
+
+    def __init__(self, path=INGEST_MANIFEST_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(documents)")}
+        if "title" not in columns:
+            # Manifests written before chunks could be shared between documents
+            self.conn.execute("ALTER TABLE documents ADD COLUMN title TEXT NOT NULL DEFAULT ''")
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, source) -> Optional[ManifestEntry]:
+        row = self.conn.execute(
+            "SELECT content_hash, model_version, chunker_version FROM documents WHERE source = ?",
+            (source,)
+        ).fetchone()
+        if row is None:
+            return None
+        chunk_ids = {r[0] for r in self.conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+        return ManifestEntry(source, row[0], row[1], row[2], chunk_ids)
+
+    def sources(self) -> Set[str]:
+        return {row[0] for row in self.conn.execute("SELECT source FROM documents")}
+
+    def _unreferenced(self, chunk_ids: Iterable[str]) -> List[str]:
+        """Filter chunk ids down to the ones no document refers to any more"""
+        orphans = []
+        for chunk_id in chunk_ids:
+            row = self.conn.execute("SELECT 1 FROM chunks WHERE chunk_id = ? LIMIT 1", (chunk_id,)).fetchone()
+            if row is None:
+                orphans.append(chunk_id)
+        # A removed chunk can no longer stand in for its duplicates
+        self.conn.executemany("DELETE FROM fingerprints WHERE chunk_id = ?", [(chunk_id,) for chunk_id in orphans])
+        self.conn.executemany("DELETE FROM lsh_buckets WHERE chunk_id = ?", [(chunk_id,) for chunk_id in orphans])
+        return orphans
+
+    def record(self, source, path, content_hash, model_version, chunker_version, chunk_ids, title='') -> List[str]:
+        """Store the indexed state of a document and return chunk ids it no longer uses"""
+        with self.conn:
+            previous = {r[0] for r in self.conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents "
+                "(source, path, content_hash, model_version, chunker_version, updated_at, title) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, path, content_hash, model_version, chunker_version, time.time(), title)
+            )
+            self.conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO chunks (source, chunk_id) VALUES (?, ?)",
+                [(source, chunk_id) for chunk_id in chunk_ids]
+            )
+            return self._unreferenced(previous - set(chunk_ids))
+
+    def remove(self, source) -> List[str]:
+        """Forget a document and return the chunk ids that became orphaned"""
+        with self.conn:
+            previous = {r[0] for r in self.conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))}
+            self.conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+            self.conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            return self._unreferenced(previous)
+
+    def chunk_sources(self, chunk_ids: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        """(url, title) of every document that uses each chunk, in the order they started using it"""
+        sources = {}
+        for chunk_id in chunk_ids:
+            rows = self.conn.execute(
+                "SELECT c.source, COALESCE(d.title, '') FROM chunks c LEFT JOIN documents d ON d.source = c.source "
+                "WHERE c.chunk_id = ? ORDER BY c.rowid",
+                (chunk_id,)
+            ).fetchall()
+            if rows:
+                sources[chunk_id] = rows
+        return sources
+
+    def fingerprint_by_text(self, scope, text_hash) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT chunk_id FROM fingerprints WHERE scope = ? AND text_hash = ? LIMIT 1",
+            (scope, text_hash)
+        ).fetchone()
+        return row[0] if row else None
+
+    def bucket_candidates(self, scope, buckets: List[int]) -> List[Tuple[str, bytes]]:
+        """(chunk id, MinHash signature) of chunks sharing at least one LSH bucket"""
+        return self.conn.execute(
+            "SELECT DISTINCT f.chunk_id, f.signature FROM lsh_buckets b JOIN fingerprints f ON f.chunk_id = b.chunk_id "
+            f"WHERE b.scope = ? AND ({' OR '.join(['(b.band = ? AND b.bucket = ?)'] * len(buckets))})",
+            [scope] + [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        ).fetchall()
+
+    def clear_fingerprints(self):
+        """Forget every fingerprint, e.g. when the chunks they describe may no longer be in the vector DB"""
+        with self.conn:
+            self.conn.execute("DELETE FROM fingerprints")
+            self.conn.execute("DELETE FROM lsh_buckets")
+
+    def add_fingerprints(self, fingerprints: Iterable[Tuple[str, str, str, bytes, List[int]]]):
+        """Store (chunk id, scope, text hash, signature, LSH buckets) of indexed chunks"""
+        with self.conn:
+            for chunk_id, scope, text_hash, signature, buckets in fingerprints:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO fingerprints (chunk_id, scope, text_hash, signature) VALUES (?, ?, ?, ?)",
+                    (chunk_id, scope, text_hash, signature)
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO lsh_buckets (scope, band, bucket, chunk_id) VALUES (?, ?, ?, ?)",
+                    [(scope, band, bucket, chunk_id) for band, bucket in enumerate(buckets)]
+                )
+
+    def index_version(self) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_index_version(self) -> int:
+        """Record that the contents of the vector DB changed"""
+        with self.conn:
+            version = self.index_version() + 1
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_version', ?)",
+                (str(version),)
+            )
+        return version
+
+    def stats(self) -> Dict[str, Any]:
+        documents = self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        chunks = self.conn.execute("SELECT COUNT(DISTINCT chunk_id) FROM chunks").fetchone()[0]
+        return {"documents": documents, "chunks": chunks}
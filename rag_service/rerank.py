@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RERANK_ENABLED = os.environ.get('RERANK_ENABLED', 'true').lower() == 'true'
+RERANK_MODEL = os.environ.get('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+# Chunks fetched from the vector DB and scored for every query
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', '50'))
+# Scoring that takes longer than this falls back to the vector DB order
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', '250'))
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', '64'))
+# Query + chunk tokens the cross-encoder reads per pair
+RERANK_MAX_LENGTH = int(os.environ.get('RERANK_MAX_LENGTH', '256'))
+RERANK_CACHE_SIZE = int(os.environ.get('RERANK_CACHE_SIZE', '50000'))
+# Scoring jobs allowed to wait for the model before new requests skip re-ranking
+RERANK_MAX_PENDING = int(os.environ.get('RERANK_MAX_PENDING', '2'))
+
+
+class Reranker:
+    """Cross-encoder re-ranking with a score cache and a per-request latency budget
+
+    All pairs of a request are scored in one batched predict on a single
+    worker thread, so concurrent requests queue for the model instead of
+    oversubscribing the CPU. When the budget runs out the request keeps the
+    vector DB order; the scoring still finishes in the background and fills
+    the cache for the next time the same query comes in.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE, max_length=RERANK_MAX_LENGTH,
+                 cache_size=RERANK_CACHE_SIZE, max_pending=RERANK_MAX_PENDING):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.cache = LRUCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.batched = 0
+        self.total_ms = 0.0
+
+    def score(self, query: str, chunk_ids: List[str], texts: List[str]) -> np.ndarray:
+        """Relevance scores for (query, chunk) pairs, running the model only for uncached pairs"""
+        return self.score_batch([query], [chunk_ids], [texts])[0]
+
+    def score_batch(self, queries: List[str], chunk_ids: List[List[str]], texts: List[List[str]]) -> List[np.ndarray]:
+        """score for several queries, with all their uncached pairs in one predict call"""
+        scores = [np.empty(len(query_texts), dtype=np.float32) for query_texts in texts]
+        missing = []
+        for q, query in enumerate(queries):
+            for i, chunk_id in enumerate(chunk_ids[q]):
+                cached = self.cache.get((query, chunk_id))
+                if cached is None:
+                    missing.append((q, i))
+                else:
+                    scores[q][i] = cached
+        if missing:
+            predicted = self.model.predict(
+                [(queries[q], texts[q][i]) for q, i in missing],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            for (q, i), value in zip(missing, predicted.tolist()):
+                scores[q][i] = value
+                self.cache.put((queries[q], chunk_ids[q][i]), value)
+        return scores
+
+    def _score_job(self, query, chunk_ids, texts):
+        try:
+            return self.score(query, chunk_ids, texts)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    async def rerank(self, query: str, chunk_ids: List[str], texts: List[str],
+                     budget_ms: float = RERANK_BUDGET_MS) -> Tuple[Optional[List[Tuple[int, float]]], float]:
+        """(position, score) pairs best first, or None to keep the original order; plus elapsed ms"""
+        started = time.perf_counter()
+        with self.lock:
+            self.requests += 1
+            if self.pending >= self.max_pending:
+                self.skipped += 1
+                return None, 0.0
+            self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._score_job, query, chunk_ids, texts)
+        try:
+            scores = await asyncio.wait_for(asyncio.shield(future), timeout=budget_ms / 1000)
+        except asyncio.TimeoutError:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.timeouts += 1
+                self.total_ms += elapsed
+            logger.warning(f"Re-ranking exceeded its {budget_ms:.0f} ms budget; keeping vector DB order")
+            return None, elapsed
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.total_ms += elapsed
+        order = np.argsort(-scores, kind='stable')
+        return [(int(i), float(scores[i])) for i in order], elapsed
+
+    async def rerank_batch(self, queries: List[str], chunk_ids: List[List[str]],
+                           texts: List[List[str]]) -> List[List[Tuple[int, float]]]:
+        """rerank for a batch of queries, without a budget: batch callers want the quality, not the latency"""
+        all_scores = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.score_batch, queries, chunk_ids, texts)
+        with self.lock:
+            self.batched += len(queries)
+        return [[(int(i), float(scores[i])) for i in np.argsort(-scores, kind='stable')] for scores in all_scores]
+
+    def stats(self) -> Dict[str, Any]:
+        scored = self.requests - self.skipped
+        return {
+            "model": self.model_name,
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "batched": self.batched,
+            "mean_ms": round(self.total_ms / scored, 2) if scored else 0.0,
+            "score_cache": self.cache.stats()
+        }
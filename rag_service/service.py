@@ -1,154 +1,537 @@
 import os
 import json
-import hashlib
-import requests
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
-from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
+import httpx
+from typing import List, Dict, Any, Optional, AsyncIterator
+from starlette.concurrency import run_in_threadpool
 import time
+import logging
+from common.chunking import make_chunker
+from common.conversation import ConversationStore
+from common.embedding_store import EmbeddingStore, open_embedding_store
+from common.startup import Startup, add_probes
+from common.telemetry import instrument_fastapi, propagation_headers, stage, watch_cache, watch_queue
+from cache import LRUCache, SemanticCache, TTLCache, normalize_query
+from embedding import Embedder, EMBEDDING_MODEL
+from http_client import AsyncServiceClient
+from ingest import IngestionPipeline, JobRegistry, METADATA_FIELDS
+from rerank import Reranker, RERANK_ENABLED, RERANK_CANDIDATES
+from generation import (LLM_BACKEND, LLM_BATCH_SIZE, LLM_MAX_CONCURRENCY, GeneratorOverloaded, build_prompt,
+                        make_generator)
 
-app = FastAPI()
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Environment variables
 VECTOR_DB_HOST = os.environ.get('VECTOR_DB_HOST', 'localhost')
 VECTOR_DB_PORT = os.environ.get('VECTOR_DB_PORT', '8000')
 VECTOR_DB_URL = f"http://{VECTOR_DB_HOST}:{VECTOR_DB_PORT}"
 MODEL_CONTEXT_PROTOCOL = os.environ.get('USE_MCP', 'false').lower() == 'true'
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '10000'))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '1000'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))
+# Answers reused for differently worded queries whose embeddings are at least this cosine-similar
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', '1000'))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', '3600'))
+# "vector", "lexical" or "hybrid" (BM25 and vector rankings fused in the vector DB)
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'hybrid')
+# Most queries accepted by one /query_batch request; keep within the vector DB's MAX_BATCH_QUERIES
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '1000'))
+# How long start-up waits for the vector DB before skipping the warm-up search
+WARMUP_VECTOR_DB_WAIT = float(os.environ.get('WARMUP_VECTOR_DB_WAIT', '60'))
 
-# Load embedding model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Pooled keep-alive client shared by all request handlers
+vector_db = AsyncServiceClient(VECTOR_DB_URL)
+
+@asynccontextmanager
+async def lifespan(app):
+    startup.start(warm_up)
+    yield
+    conversations.close()
+    await vector_db.aclose()
+    if generator:
+        await generator.aclose()
+
+app = FastAPI(lifespan=lifespan)
+startup = Startup("rag_service")
+add_probes(app, startup)
+instrument_fastapi(app)
 
 class ProcessDocumentsRequest(BaseModel):
     document_dir: str = "/app/data/documents"
+    force: bool = False
 
 class QueryRequest(BaseModel):
     query: str
     max_results: int = 5
+    # Restrict the search to one product, version or document type
+    product: Optional[str] = None
+    version: Optional[str] = None
+    document_type: Optional[str] = None
+    # Continue a conversation: earlier turns of the session go into the prompt
+    session_id: Optional[str] = None
+
+    def where(self) -> Optional[Dict[str, Any]]:
+        """Chroma metadata filter for the requested product, version and document type"""
+        clauses = [{field: getattr(self, field)} for field in METADATA_FIELDS if getattr(self, field)]
+        if len(clauses) > 1:
+            return {"$and": clauses}
+        return clauses[0] if clauses else None
 
 class RAGResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
+    # Time spent re-ranking candidates, when re-ranking ran
+    rerank_ms: Optional[float] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+
+class BatchRAGResponse(BaseModel):
+    results: List[RAGResponse]
+    # Time spent re-ranking the whole batch in one pass
+    rerank_ms: Optional[float] = None
+
+# Models and what depends on them are loaded by warm_up(); requests are refused until then
+embedder: Optional[Embedder] = None
+chunker = None
+pipeline: Optional[IngestionPipeline] = None
+# Chunk embeddings on disk, reused by every re-index with the same model
+embedding_store: Optional[EmbeddingStore] = None
+# Cross-encoder over a wider candidate set than the caller asked for
+reranker: Optional[Reranker] = None
+
+# Background ingestion
+jobs = JobRegistry()
+
+# Model server client that batches concurrent answers; None keeps the extractive answer
+generator = make_generator() if LLM_BACKEND != 'extractive' else None
+
+# Query caches: normalized query -> embedding, and (query, max_results, filter, index version) -> response
+embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+# (max_results, filter) -> answers by query embedding, for questions asked in other words
+semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL)
+
+watch_cache("query_embedding", embedding_cache.stats)
+watch_cache("result", result_cache.stats)
+watch_cache("semantic", semantic_cache.stats)
+
+# Conversation history per session_id, bounded in memory and spilled to SQLite
+conversations = ConversationStore()
+if generator:
+    watch_queue("generation", lambda: generator.waiting)
+
+def warm_vector_db(query_embedding):
+    """Wait for the vector DB, then search once so its index is loaded before the first user query"""
+    deadline = time.monotonic() + WARMUP_VECTOR_DB_WAIT
+    with httpx.Client(base_url=VECTOR_DB_URL, timeout=10) as client:
+        while True:
+            try:
+                if client.get("/ready").status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                logging.warning(f"Vector DB not ready after {WARMUP_VECTOR_DB_WAIT:.0f} s; skipping warm-up search")
+                return
+            time.sleep(1)
+        client.post("/query_embeddings", json={"query_embedding": query_embedding.tolist(), "n_results": 1})
+
+def warm_up():
+    """Load the models, then run a dummy embed, re-rank and search so first queries are not slow"""
+    global embedder, chunker, pipeline, reranker, embedding_store
+    with startup.step("embedding model"):
+        model = Embedder(EMBEDDING_MODEL)
+    # Chunks are sized in model tokens so nothing is silently truncated at embedding time
+    chunker = make_chunker(model.tokenizer, model.max_seq_length)
+    conversations.count_tokens = chunker.count_tokens
+    with startup.step("embedding store"):
+        embedding_store = open_embedding_store(model.model_name, model.dimension)
+    if embedding_store is not None:
+        watch_cache("embedding_store", embedding_store.stats)
+    with startup.step("ingest manifest"):
+        pipeline = IngestionPipeline(VECTOR_DB_URL, chunker, model, chunker.version,
+                                     embedding_store=embedding_store)
+    embedder = model
+    if RERANK_ENABLED:
+        with startup.step("re-ranking model"):
+            reranker = Reranker()
+        watch_cache("rerank_score", reranker.cache.stats)
+        watch_queue("rerank", lambda: reranker.pending)
+    with startup.step("warm-up embed"):
+        query_embedding = embedder.encode(["warm up"])[0]
+    if reranker:
+        with startup.step("warm-up re-rank"):
+            reranker.model.predict([("warm up", "warm up")], show_progress_bar=False)
+    with startup.step("warm-up search"):
+        warm_vector_db(query_embedding)
+
+async def embed_queries(normalized_queries):
+    """Return query embeddings, encoding the cache misses together in one batch"""
+    embeddings = [embedding_cache.get(query) for query in normalized_queries]
+    missing = list(dict.fromkeys(query for query, embedding in zip(normalized_queries, embeddings)
+                                 if embedding is None))
+    if missing:
+        with stage("embed"):
+            encoded = dict(zip(missing, await run_in_threadpool(embedder.encode, missing)))
+        for query, embedding in encoded.items():
+            embedding_cache.put(query, embedding)
+        embeddings = [encoded[query] if embedding is None else embedding
+                      for query, embedding in zip(normalized_queries, embeddings)]
+    return embeddings
+
+async def embed_query(normalized_query):
+    """Return the query embedding, encoding it only on a cache miss"""
+    return (await embed_queries([normalized_query]))[0]
 
-def chunk_document(text, chunk_size=1000, overlap=200):
-    """Split document into chunks with overlap"""
-    chunks = []
-    start = 0
-    text_length = len(text)
+@app.post("/process_documents", status_code=202)
+async def process_documents(request: ProcessDocumentsRequest):
+    if not os.path.isdir(request.document_dir):
+        raise HTTPException(status_code=400, detail=f"Document directory not found: {request.document_dir}")
+
+    job, started = jobs.start(pipeline, request.document_dir, request.force)
+    if not started:
+        raise HTTPException(status_code=409, detail={"error": f"Ingestion job {job.id} is already running",
+                                                     "job_id": job.id})
+
+    return job.to_dict()
+
+@app.get("/process_documents/{job_id}")
+async def process_documents_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown ingestion job: {job_id}")
+    return job.to_dict()
+
+def sse(event, data) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def search_body(request: QueryRequest, query_embedding, where) -> Dict[str, Any]:
+    """Vector DB search for a query, widened to the re-ranking candidates"""
+    return {
+        "query_embedding": query_embedding.tolist(),
+        "n_results": max(request.max_results, RERANK_CANDIDATES) if reranker else request.max_results,
+        "query_text": request.query,
+        "mode": SEARCH_MODE,
+        "where": where
+    }
+
+def build_sources(results, ranked, max_results):
+    """Contexts and source entries for the (position, rerank score) pairs kept, best first"""
+    contexts = []
+    sources = []
     
-    while start < text_length:
-        end = min(start + chunk_size, text_length)
-        if end < text_length and end - start == chunk_size:
-            # Find the last period within the last 100 chars to create cleaner chunks
-            last_period = text.rfind('.', start + chunk_size - 100, start + chunk_size)
-            if last_period != -1:
-                end = last_period + 1
+    for i, rerank_score in ranked[:max_results]:
+        doc_text = results['documents'][0][i]
+        metadata = results['metadatas'][0][i]
         
-        chunks.append(text[start:end])
-        start = end - overlap if end < text_length else text_length
+        contexts.append(doc_text)
+        url = metadata.get("url", "")
+        sources.append({
+            "title": metadata.get("title", "Untitled"),
+            "url": url,
+            "product": metadata.get("product", ""),
+            "version": metadata.get("version", ""),
+            # Other documents with the same (or nearly the same) passage, stored once
+            "also_in": [other for other in metadata.get("sources", "").split("\n") if other and other != url],
+            "relevance_score": results['distances'][0][i] if 'distances' in results else None,
+            "rerank_score": rerank_score
+        })
+    return contexts, sources
+
+async def retrieve(request: QueryRequest, normalized_query, where, query_embedding):
+    """Search the vector DB and re-rank; returns (contexts, sources, rerank_ms)"""
+    # Query the vector database
+    with stage("search"):
+        response = await vector_db.post("/query_embeddings", json=search_body(request, query_embedding, where))
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Vector DB query failed: {response.text}")
+    
+    results = response.json()
+    
+    # Candidate positions in the order they are used, with their re-rank scores
+    ranked = [(i, None) for i in range(len(results['ids'][0]))]
+    rerank_ms = None
+    if reranker and ranked:
+        with stage("rerank"):
+            reranked, rerank_ms = await reranker.rerank(normalized_query, results['ids'][0],
+                                                        results['documents'][0])
+        if reranked is not None:
+            ranked = reranked
     
-    return chunks
+    # Prepare context from retrieved documents
+    contexts, sources = build_sources(results, ranked, request.max_results)
+    return contexts, sources, (round(rerank_ms, 2) if rerank_ms is not None else None)
 
-@app.post("/process_documents")
-async def process_documents(request: ProcessDocumentsRequest):
-    document_dir = request.document_dir
+async def generate_answer(query_text, contexts, history="") -> AsyncIterator[str]:
+    """Yield the answer in pieces as they become available"""
+    # Combine contexts
+    context = "\n\n".join(contexts)
+    
+    if generator:
+        # Retrieved chunks are trimmed, best first, to fit the model's context window
+        prompt = build_prompt(query_text, contexts, chunker.count_tokens, history=history)
+        with stage("generate"):
+            async for piece in generator.stream(prompt):
+                yield piece
+    # If using Model Context Protocol server
+    elif MODEL_CONTEXT_PROTOCOL:
+        # Replace with actual MCP server call
+        yield "This would use the Model Context Protocol server with the retrieved context"
+    else:
+        # Simple extractive QA using the retrieved context
+        # In a real system, you would use an LLM here
+        yield f"Here are the most relevant sections from Red Hat documentation about '{query_text}':\n\n"
+        yield context[:500] + "..."  # Simplified for this example
+
+def session_history(request: QueryRequest) -> Optional[str]:
+    """Earlier turns for the prompt, or None when the answer does not depend on any"""
+    # The extractive answer ignores the conversation, so only a generator makes it a follow-up
+    if not (generator and request.session_id and conversations.has_messages(request.session_id)):
+        return None
+    # May be empty when even the latest message is over budget; the question still follows up on it
+    return conversations.history(request.session_id)
+
+def remember_turn(request: QueryRequest, answer):
+    if request.session_id:
+        conversations.append(request.session_id, "user", request.query)
+        conversations.append(request.session_id, "assistant", answer)
+
+@app.post("/query", response_model=RAGResponse)
+async def query(request: QueryRequest):
+    normalized_query = normalize_query(request.query)
+    # The index version changes whenever ingestion modifies the vector DB
+    where = request.where()
+    index_version = pipeline.index_version
+    history = session_history(request)
+    # An answer that depends on earlier turns is neither taken from nor put in the answer caches
+    cacheable = history is None
+    result_key = (normalized_query, request.max_results, repr(where), index_version)
+    result = result_cache.get(result_key) if cacheable else None
+    if result is not None:
+        remember_turn(request, result["answer"])
+        return result
     
     try:
-        # Process all documents in the directory
-        count = 0
-        for filename in os.listdir(document_dir):
-            if filename.endswith(".json"):
-                file_path = os.path.join(document_dir, filename)
-                with open(file_path, 'r') as f:
-                    doc_data = json.load(f)
-                
-                # Create chunks from the document
-                chunks = chunk_document(doc_data['text'])
-                
-                # Process each chunk
-                for i, chunk in enumerate(chunks):
-                    # Create a unique ID for each chunk
-                    doc_id = hashlib.md5(f"{doc_data['url']}_{i}".encode()).hexdigest()
-                    
-                    # Create metadata
-                    metadata = {
-                        "url": doc_data['url'],
-                        "title": doc_data['title'],
-                        "chunk_id": i,
-                        "source": "Red Hat Documentation"
-                    }
-                    
-                    # Add to vector database
-                    response = requests.post(
-                        f"{VECTOR_DB_URL}/add",
-                        json={"documents": [{"id": doc_id, "text": chunk, "metadata": metadata}]}
-                    )
-                    
-                    if response.status_code != 200:
-                        raise HTTPException(status_code=500, detail=f"Failed to add document to vector DB: {response.text}")
-                    
-                    count += 1
-        
-        return {"status": "success", "processed_chunks": count}
+        # Embed the query here so the vector DB only has to search
+        query_embedding = await embed_query(normalized_query)
+        scope = (request.max_results, repr(where))
+        similar = semantic_cache.get(query_embedding, scope, index_version) if cacheable else None
+        if similar is not None:
+            result_cache.put(result_key, similar[0])
+            remember_turn(request, similar[0]["answer"])
+            return similar[0]
+        contexts, sources, rerank_ms = await retrieve(request, normalized_query, where, query_embedding)
+        answer = "".join([piece async for piece in generate_answer(request.query, contexts, history or "")])
+        result = {
+            "answer": answer,
+            "sources": sources,
+            "rerank_ms": rerank_ms
+        }
+        if cacheable:
+            result_cache.put(result_key, result)
+            semantic_cache.put(query_embedding, scope, index_version, result)
+        remember_turn(request, answer)
+        return result
     
+    except HTTPException:
+        raise
+    except GeneratorOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/query", response_model=RAGResponse)
-async def query(request: QueryRequest):
+@app.post("/query_batch", response_model=BatchRAGResponse)
+async def query_batch(request: BatchQueryRequest):
+    """Answer many queries at once; results come back in request order
+
+    Cache misses are embedded in one pass, searched with one vector DB
+    /query_batch call and re-ranked in one cross-encoder pass, without the
+    interactive re-ranking budget. Answers are then generated concurrently,
+    so the generator can batch them.
+    """
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if any(item.session_id for item in request.queries):
+        raise HTTPException(status_code=400, detail="Conversations are not supported in batches; use /query")
+    results: List[Optional[Dict[str, Any]]] = [None] * len(request.queries)
+    index_version = pipeline.index_version
+    pending = []
+    for i, item in enumerate(request.queries):
+        normalized_query = normalize_query(item.query)
+        where = item.where()
+        result_key = (normalized_query, item.max_results, repr(where), index_version)
+        cached = result_cache.get(result_key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, normalized_query, where, result_key))
+    if not pending:
+        return {"results": results, "rerank_ms": None}
+    
     try:
-        # Query the vector database
-        response = requests.post(
-            f"{VECTOR_DB_URL}/query",
-            json={"query_text": request.query, "n_results": request.max_results}
-        )
-        
+        embeddings = await embed_queries([normalized_query for _, normalized_query, _, _ in pending])
+        unanswered = []
+        for (i, normalized_query, where, result_key), embedding in zip(pending, embeddings):
+            similar = semantic_cache.get(embedding, (request.queries[i].max_results, repr(where)), index_version)
+            if similar is not None:
+                results[i] = similar[0]
+                result_cache.put(result_key, similar[0])
+            else:
+                unanswered.append(((i, normalized_query, where, result_key), embedding))
+        if not unanswered:
+            return {"results": results, "rerank_ms": None}
+        pending = [item for item, _ in unanswered]
+        embeddings = [embedding for _, embedding in unanswered]
+        with stage("search"):
+            response = await vector_db.post("/query_batch", json={"queries": [
+                search_body(request.queries[i], embedding, where)
+                for (i, _, where, _), embedding in zip(pending, embeddings)
+            ]})
         if response.status_code != 200:
             raise HTTPException(status_code=500, detail=f"Vector DB query failed: {response.text}")
+        found = response.json()["results"]
         
-        results = response.json()
-        
-        # Prepare context from retrieved documents
-        contexts = []
-        sources = []
+        ranked = [[(j, None) for j in range(len(hits['ids'][0]))] for hits in found]
+        rerank_ms = None
+        if reranker:
+            started = time.perf_counter()
+            with stage("rerank"):
+                ranked = await reranker.rerank_batch([normalized_query for _, normalized_query, _, _ in pending],
+                                                     [hits['ids'][0] for hits in found],
+                                                     [hits['documents'][0] for hits in found])
+            rerank_ms = round((time.perf_counter() - started) * 1000, 2)
         
-        for i in range(len(results['ids'][0])):
-            doc_id = results['ids'][0][i]
-            doc_text = results['documents'][0][i]
-            metadata = results['metadatas'][0][i]
-            
-            contexts.append(doc_text)
-            sources.append({
-                "title": metadata.get("title", "Untitled"),
-                "url": metadata.get("url", ""),
-                "relevance_score": results['distances'][0][i] if 'distances' in results else None
-            })
+        # As many answers in flight as the generator can batch at once
+        limit = asyncio.Semaphore(LLM_BATCH_SIZE * LLM_MAX_CONCURRENCY)
         
-        # Combine contexts
-        context = "\n\n".join(contexts)
+        async def answer(position):
+            i, _, where, result_key = pending[position]
+            contexts, sources = build_sources(found[position], ranked[position], request.queries[i].max_results)
+            async with limit:
+                text = "".join([piece async for piece in generate_answer(request.queries[i].query, contexts)])
+            results[i] = {"answer": text, "sources": sources, "rerank_ms": None}
+            result_cache.put(result_key, results[i])
+            semantic_cache.put(embeddings[position], (request.queries[i].max_results, repr(where)), index_version,
+                               results[i])
         
-        # If using Model Context Protocol server
-        if MODEL_CONTEXT_PROTOCOL:
-            # Replace with actual MCP server call
-            answer = "This would use the Model Context Protocol server with the retrieved context"
-        else:
-            # Simple extractive QA using the retrieved context
-            # In a real system, you would use an LLM here
-            answer = f"Here are the most relevant sections from Red Hat documentation about '{request.query}':\n\n"
-            answer += context[:500] + "..."  # Simplified for this example
-            
-        return {
-            "answer": answer,
-            "sources": sources
-        }
-            
+        await asyncio.gather(*(answer(position) for position in range(len(pending))))
+        return {"results": results, "rerank_ms": rerank_ms}
+    
+    except HTTPException:
+        raise
+    except GeneratorOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """Answer as server-sent events: "sources" first, then "token" pieces, then "done"
+
+    Sources are sent as soon as retrieval finishes, so the client can show
+    them while the answer is still being generated.
+    """
+    normalized_query = normalize_query(request.query)
+    where = request.where()
+    index_version = pipeline.index_version
+    result_key = (normalized_query, request.max_results, repr(where), index_version)
+    scope = (request.max_results, repr(where))
+    history = session_history(request)
+    cacheable = history is None
+    
+    async def events():
+        started = time.perf_counter()
+        try:
+            cached = result_cache.get(result_key) if cacheable else None
+            query_embedding = None
+            if cached is None:
+                query_embedding = await embed_query(normalized_query)
+                similar = semantic_cache.get(query_embedding, scope, index_version) if cacheable else None
+                cached = similar[0] if similar is not None else None
+            if cached is not None:
+                remember_turn(request, cached["answer"])
+                yield sse("sources", {"sources": cached["sources"], "rerank_ms": cached["rerank_ms"]})
+                yield sse("token", {"text": cached["answer"]})
+                elapsed = round((time.perf_counter() - started) * 1000, 2)
+                yield sse("done", {"cached": True, "first_token_ms": elapsed, "elapsed_ms": elapsed})
+                return
+            contexts, sources, rerank_ms = await retrieve(request, normalized_query, where, query_embedding)
+            yield sse("sources", {"sources": sources, "rerank_ms": rerank_ms})
+            pieces = []
+            first_token_ms = None
+            async for piece in generate_answer(request.query, contexts, history or ""):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                pieces.append(piece)
+                yield sse("token", {"text": piece})
+            result = {"answer": "".join(pieces), "sources": sources, "rerank_ms": rerank_ms}
+            if cacheable:
+                result_cache.put(result_key, result)
+                semantic_cache.put(query_embedding, scope, index_version, result)
+            remember_turn(request, result["answer"])
+            yield sse("done", {
+                "cached": False,
+                "first_token_ms": first_token_ms,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+            })
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logging.error(f"Streaming query failed: {detail}")
+            yield sse("error", {"error": detail})
+    
+    # Disable proxy buffering so every event reaches the client as it is produced
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """Messages of a conversation, oldest first"""
+    return {"session_id": session_id, "messages": conversations.messages(session_id)}
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    conversations.clear(session_id)
+    return {"status": "deleted", "session_id": session_id}
+
+@app.get("/stats")
+def stats():
+    return {
+        "index_version": pipeline.index_version,
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "conversations": conversations.stats(),
+        "embedding_store": embedding_store.stats() if embedding_store is not None else None,
+        "reranker": reranker.stats() if reranker else None,
+        "generator": generator.stats() if generator else None
+    }
+
 @app.get("/health")
-def health_check():
-    return {"status": "healthy"}
+async def health_check():
+    """Healthy when the vector DB answers its own health check"""
+    try:
+        # No retries: a probe should report a down dependency, not wait it out
+        response = await vector_db.client.get("/health", headers=propagation_headers(), timeout=5)
+    except httpx.HTTPError as e:
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "error": f"Vector DB unreachable: {e!r}"})
+    if response.status_code != 200:
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "error": f"Vector DB: {response.text}"})
+    return {
+        "status": "healthy",
+        "index_version": pipeline.index_version,
+        "vector_db": response.json(),
+        "generation_waiting": generator.waiting if generator else None
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,196 @@
+"""Stand-in model server for load-testing generation without a GPU
+
+Serves the Ollama /api/generate and OpenAI-compatible /v1/completions
+endpoints the generation backends use. Output is made-up text, but timing
+behaves like a continuous-batching inference server: every decoding step
+takes STUB_TOKEN_MS and advances up to STUB_MAX_BATCH sequences by one
+token, newly admitted sequences add STUB_PREFILL_MS to their first step,
+and sequences beyond the batch wait their turn. Throughput therefore grows
+with batch size up to the limit and queueing shows up beyond it.
+
+    python stub_llm.py            # listens on STUB_PORT (11434)
+    LLM_BACKEND=ollama LLM_URL=http://localhost:11434 python service.py
+"""
+import os
+import json
+import time
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import uvicorn
+
+STUB_PORT = int(os.environ.get('STUB_PORT', '11434'))
+STUB_TOKEN_MS = float(os.environ.get('STUB_TOKEN_MS', '20'))
+STUB_PREFILL_MS = float(os.environ.get('STUB_PREFILL_MS', '50'))
+STUB_MAX_BATCH = int(os.environ.get('STUB_MAX_BATCH', '16'))
+# Tokens generated when the request does not ask for fewer
+STUB_ANSWER_TOKENS = int(os.environ.get('STUB_ANSWER_TOKENS', '64'))
+
+
+class Sequence:
+    def __init__(self, prompt, max_tokens):
+        words = prompt.split()[-20:] or ["stub"]
+        self.tokens = itertools.islice(itertools.cycle(words), min(max_tokens, STUB_ANSWER_TOKENS))
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.submitted = time.perf_counter()
+
+
+class Engine:
+    """Continuous batching: one decoding step advances every active sequence by a token"""
+
+    def __init__(self, max_batch=STUB_MAX_BATCH, token_ms=STUB_TOKEN_MS, prefill_ms=STUB_PREFILL_MS):
+        self.max_batch = max_batch
+        self.token_seconds = token_ms / 1000
+        self.prefill_seconds = prefill_ms / 1000
+        self.waiting: deque = deque()
+        self.active: List[Sequence] = []
+        self.wakeup = asyncio.Event()
+        self.steps = 0
+        self.tokens = 0
+        self.completed = 0
+        self.max_active = 0
+        self.max_waiting = 0
+
+    def submit(self, prompt, max_tokens) -> Sequence:
+        sequence = Sequence(prompt, max_tokens)
+        self.waiting.append(sequence)
+        self.max_waiting = max(self.max_waiting, len(self.waiting))
+        self.wakeup.set()
+        return sequence
+
+    async def run(self):
+        while True:
+            if not self.active and not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            admitted = False
+            while self.waiting and len(self.active) < self.max_batch:
+                self.active.append(self.waiting.popleft())
+                admitted = True
+            self.max_active = max(self.max_active, len(self.active))
+            await asyncio.sleep(self.token_seconds + (self.prefill_seconds if admitted else 0))
+            self.steps += 1
+            still_active = []
+            for sequence in self.active:
+                token = next(sequence.tokens, None)
+                if token is None:
+                    sequence.queue.put_nowait(None)
+                    self.completed += 1
+                    continue
+                self.tokens += 1
+                sequence.queue.put_nowait(token + " ")
+                still_active.append(sequence)
+            self.active = still_active
+
+    def stats(self):
+        return {
+            "steps": self.steps,
+            "tokens": self.tokens,
+            "completed": self.completed,
+            "active": len(self.active),
+            "waiting": len(self.waiting),
+            "max_active": self.max_active,
+            "max_waiting": self.max_waiting,
+            "mean_batch": round(self.tokens / self.steps, 2) if self.steps else 0.0
+        }
+
+
+engine: Optional[Engine] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global engine
+    engine = Engine()
+    task = asyncio.create_task(engine.run())
+    yield
+    task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+
+class OllamaGenerateRequest(BaseModel):
+    model: str = "stub"
+    prompt: str
+    stream: bool = True
+    options: dict = {}
+
+
+class CompletionRequest(BaseModel):
+    model: str = "stub"
+    prompt: Union[str, List[str]]
+    max_tokens: int = 16
+    stream: bool = False
+
+
+async def tokens(sequence: Sequence):
+    while True:
+        token = await sequence.queue.get()
+        if token is None:
+            return
+        yield token
+
+
+@app.post("/api/generate")
+async def ollama_generate(request: OllamaGenerateRequest):
+    sequence = engine.submit(request.prompt, request.options.get("num_predict", STUB_ANSWER_TOKENS))
+    if not request.stream:
+        text = "".join([token async for token in tokens(sequence)])
+        return {"model": request.model, "response": text, "done": True}
+
+    async def lines():
+        count = 0
+        async for token in tokens(sequence):
+            count += 1
+            yield json.dumps({"model": request.model, "response": token, "done": False}) + "\n"
+        yield json.dumps({"model": request.model, "response": "", "done": True, "eval_count": count}) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/v1/completions")
+async def completions(request: CompletionRequest):
+    prompts = [request.prompt] if isinstance(request.prompt, str) else request.prompt
+    sequences = [engine.submit(prompt, request.max_tokens) for prompt in prompts]
+    if not request.stream:
+        texts = ["".join([token async for token in tokens(sequence)]) for sequence in sequences]
+        return {
+            "object": "text_completion",
+            "model": request.model,
+            "choices": [{"index": i, "text": text, "finish_reason": "length"} for i, text in enumerate(texts)]
+        }
+
+    async def events():
+        # Interleave the choices as their tokens arrive, like a batching server does
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def forward(index, sequence):
+            async for token in tokens(sequence):
+                queue.put_nowait({"index": index, "text": token, "finish_reason": None})
+            queue.put_nowait({"index": index, "text": "", "finish_reason": "length"})
+
+        forwarders = [asyncio.create_task(forward(i, s)) for i, s in enumerate(sequences)]
+        finished = 0
+        try:
+            while finished < len(sequences):
+                choice = await queue.get()
+                finished += choice["finish_reason"] is not None
+                yield f"data: {json.dumps({'object': 'text_completion', 'choices': [choice]})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            for forwarder in forwarders:
+                forwarder.cancel()
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+def stats():
+    return engine.stats()
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=STUB_PORT)
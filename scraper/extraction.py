@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import trafilatura
+
+logger = logging.getLogger(__name__)
+
+# Number of extractor processes; HTML parsing is CPU-bound so default to all cores
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# Downloaded pages waiting for an extractor; fetchers block when it is full
+EXTRACT_QUEUE_SIZE = int(os.environ.get('EXTRACT_QUEUE_SIZE', '64'))
+# Seconds between pipeline statistics log lines
+PIPELINE_STATS_INTERVAL = float(os.environ.get('PIPELINE_STATS_INTERVAL', '30'))
+
+
+def extract_product_from_url(url):
+    """Extract product name from URL"""
+    match = re.search(r'/documentation/en-us/([^/]+)', url)
+    if match:
+        return match.group(1).replace('_', ' ').title()
+    return "Unknown Product"
+
+
+def extract_version_from_url(url):
+    """Extract version from URL"""
+    match = re.search(r'/(\d+(\.\d+)*)/', url)
+    if match:
+        return match.group(1)
+    return "Unknown Version"
+
+
+def extract_document_type_from_url(url):
+    """Extract document type from URL"""
+    if '/html-single/' in url:
+        return "Single Page HTML"
+    elif '/html/' in url:
+        return "HTML"
+    elif '/pdf/' in url:
+        return "PDF"
+    elif '/epub/' in url:
+        return "EPUB"
+    return "Unknown Type"
+
+
+def extract_document(url, downloaded):
+    """Extract text and metadata from raw HTML
+
+    Runs in extractor processes, so it must stay a picklable module-level function.
+    """
+    content = trafilatura.extract(downloaded, include_comments=False, 
+                                 include_tables=True, output_format='json')
+    if content:
+        data = json.loads(content)
+        # Add additional metadata for better organization
+        metadata = {
+            'url': url,
+            'title': data.get('title', ''),
+            'text': data.get('text', ''),
+            'timestamp': time.time(),
+            'product': extract_product_from_url(url),
+            'version': extract_version_from_url(url),
+            'document_type': extract_document_type_from_url(url)
+        }
+        return metadata
+    else:
+        logger.error(f"Failed to extract content from {url}")
+    return None
+
+
+class ExtractionStage:
+    """Turn downloaded pages into documents in a process pool
+
+    Fetch threads hand raw HTML to `put`, which blocks while the bounded
+    queue is full. A dispatcher thread feeds the process pool and
+    `on_result(index, url, doc_data)` is called for every finished page.
+    """
+
+    def __init__(self, on_result, workers=EXTRACT_WORKERS, queue_size=EXTRACT_QUEUE_SIZE,
+                 stats_interval=PIPELINE_STATS_INTERVAL):
+        self.on_result = on_result
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.executor = self._new_pool()
+        # Pages submitted to the pool but not yet finished
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.in_flight = 0
+        self.fetched = 0
+        self.extracted = 0
+        self.failed = 0
+        self.pool_restarts = 0
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.stats_interval = stats_interval
+        self.stopped = threading.Event()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="extract-dispatch", daemon=True)
+        self.monitor = threading.Thread(target=self._monitor, name="extract-stats", daemon=True)
+        self.dispatcher.start()
+        self.monitor.start()
+
+    def _new_pool(self):
+        # Fetch threads are already running; forking a threaded process can deadlock in the child
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _submit(self, url, downloaded):
+        try:
+            return self.executor.submit(extract_document, url, downloaded)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); its pages have failed, start a fresh pool for the rest
+            logger.error("Extraction pool broke; starting a new one")
+            self.executor.shutdown(wait=False)
+            self.executor = self._new_pool()
+            with self.lock:
+                self.pool_restarts += 1
+            return self.executor.submit(extract_document, url, downloaded)
+
+    def put(self, index, url, downloaded):
+        self.queue.put((index, url, downloaded))
+        with self.lock:
+            self.fetched += 1
+
+    def _dispatch(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            index, url, downloaded = item
+            self.slots.acquire()
+            with self.lock:
+                self.in_flight += 1
+            try:
+                future = self._submit(url, downloaded)
+            except Exception as e:
+                # Fail the page rather than the dispatcher, or fetchers would block on the full queue forever
+                logger.error(f"Could not submit {url} for extraction: {e}")
+                self._finished(index, url, None)
+                continue
+            future.add_done_callback(lambda f, index=index, url=url: self._finished(index, url, f))
+
+    def _finished(self, index, url, future):
+        try:
+            try:
+                doc_data = future.result() if future is not None else None
+            except Exception as e:
+                logger.error(f"Error extracting {url}: {e}")
+                doc_data = None
+            with self.lock:
+                if doc_data:
+                    self.extracted += 1
+                else:
+                    self.failed += 1
+            self.on_result(index, url, doc_data)
+        except Exception as e:
+            logger.error(f"Error handling extracted page {url}: {e}")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        with self.lock:
+            return {
+                "fetch_queue": self.queue.qsize(),
+                "extracting": self.in_flight,
+                "fetched": self.fetched,
+                "extracted": self.extracted,
+                "failed": self.failed,
+                "pool_restarts": self.pool_restarts,
+                "fetched_per_sec": round(self.fetched / elapsed, 2),
+                "extracted_per_sec": round(self.extracted / elapsed, 2)
+            }
+
+    def _monitor(self):
+        while not self.stopped.wait(self.stats_interval):
+            logger.info(f"Extraction pipeline: {self.stats()}")
+
+    def close(self):
+        """Wait for queued pages to be extracted and shut the pool down"""
+        self.queue.put(None)
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True)
+        self.stopped.set()
+        logger.info(f"Extraction pipeline finished: {self.stats()}")
@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Kinds of URLs in the crawl, in the order they are processed
+PRODUCT = 'product'
+VERSION = 'version'
+PAGE = 'page'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    added_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS frontier_by_state ON frontier (kind, state);
+"""
+
+
+class CrawlFrontier:
+    """Persistent crawl queue and visited set backed by SQLite
+
+    Every URL ever discovered in the current crawl is stored once, so a
+    restarted scraper resumes with the pending URLs instead of starting over.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def start_crawl(self):
+        """Resume an unfinished crawl, or clear a finished one so it runs again
+
+        Returns True when resuming.
+        """
+        with self.lock, self.conn:
+            # Anything in progress when the previous run died has to be redone
+            self.conn.execute("UPDATE frontier SET state = 'pending' WHERE state = 'in_progress'")
+            unfinished = self.conn.execute(
+                "SELECT COUNT(*) FROM frontier WHERE state = 'pending'"
+            ).fetchone()[0]
+            if unfinished:
+                return True
+            self.conn.execute("DELETE FROM frontier")
+            return False
+
+    def add(self, urls, kind):
+        """Queue URLs that have not been seen in this crawl; returns how many were new"""
+        now = time.time()
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO frontier (url, kind, added_at) VALUES (?, ?, ?)",
+                [(url, kind, now) for url in urls]
+            )
+            return self.conn.total_changes - before
+
+    def claim(self, kind, limit):
+        """Take up to `limit` pending URLs of a kind; returns (id, url) pairs"""
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT id, url FROM frontier WHERE kind = ? AND state = 'pending' ORDER BY id LIMIT ?",
+                (kind, limit)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE frontier SET state = 'in_progress' WHERE id = ?",
+                [(row[0],) for row in rows]
+            )
+            return rows
+
+    def finish(self, url, succeeded=True):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE frontier SET state = ?, finished_at = ? WHERE url = ?",
+                ('done' if succeeded else 'failed', time.time(), url)
+            )
+
+    def pending(self, kind):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM frontier WHERE kind = ? AND state IN ('pending', 'in_progress')",
+                (kind,)
+            ).fetchone()[0]
+
+    def counts(self):
+        """Number of URLs per (kind, state)"""
+        with self.lock:
+            rows = self.conn.execute("SELECT kind, state, COUNT(*) FROM frontier GROUP BY kind, state").fetchall()
+        return {f"{kind}_{state}": count for kind, state, count in rows}
@@ -0,0 +1,96 @@
+import os
+import gzip
+import time
+import hashlib
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL UNIQUE,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+class PageCache:
+    """Gzip-compressed raw HTML on disk, keyed by URL, with HTTP validators
+
+    Pages live under <directory>/<xx>/<sha1>.html.gz so no single directory
+    grows too large; URLs, ETags and Last-Modified values are kept in SQLite.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.html.gz")
+
+    def validators(self, url):
+        """Headers for a conditional request, or {} if the page is not cached"""
+        with self.lock:
+            row = self.conn.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self._path(url)):
+            return {}
+        headers = {}
+        if row[0]:
+            headers['If-None-Match'] = row[0]
+        if row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def load(self, url):
+        """Return the cached raw HTML bytes for a URL, or None"""
+        try:
+            with gzip.open(self._path(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, content):
+        """Cache a page body; its validators are only recorded by `validate` once its document is saved"""
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a crash never leaves a truncated page behind
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock, self.conn:
+            # Clearing the old validators means a crash before the save re-downloads the page instead of a 304
+            self.conn.execute(
+                "INSERT INTO pages (url, etag, last_modified, size, fetched_at, checked_at) VALUES (?, NULL, NULL, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET etag = NULL, last_modified = NULL, "
+                "size = excluded.size, fetched_at = excluded.fetched_at, checked_at = excluded.checked_at",
+                (url, len(content), now, now)
+            )
+
+    def validate(self, url, etag=None, last_modified=None):
+        """Record the validators of a cached page whose document is now saved, enabling conditional requests"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE pages SET etag = ?, last_modified = ? WHERE url = ?", (etag, last_modified, url))
+
+    def touch(self, url):
+        """Record that the cached copy was confirmed fresh by the server"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE pages SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+    def entries(self):
+        """All cached (id, url) pairs, oldest first"""
+        with self.lock:
+            return self.conn.execute("SELECT id, url FROM pages ORDER BY id").fetchall()
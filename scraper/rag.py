@@ -3,125 +3,277 @@
 import pysqlite3
 import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
-from langchain_community.document_loaders import (
-    DirectoryLoader,
-    PyPDFLoader,
-    TextLoader,
-    UnstructuredHTMLLoader,  # For HTML
-    UnstructuredMarkdownLoader, # For Markdown
-    # Add more loaders as needed (e.g., CSVLoader, etc.)
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-import ollama
-import sentence_transformers
 import os
+import time
+import shutil
 import logging
-import re  # For regular expressions
-from bs4 import BeautifulSoup # For HTML parsing
-import magic  # For detecting file types more accurately
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from common.chunking import make_chunker
+from common.conversation import ConversationStore
+from common.embedding_store import EmbeddingStore
+# langchain, sentence_transformers, ollama and magic are imported where they are
+# used: together they take seconds to import, and the CLI should start at once
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Worker processes loading and parsing files when a new DB is built
+LOAD_WORKERS = int(os.environ.get('LOAD_WORKERS', str(os.cpu_count() or 1)))
+# Chunks embedded and inserted into the DB at a time
+LOAD_BATCH_SIZE = int(os.environ.get('LOAD_BATCH_SIZE', '256'))
+# Progress is logged after every this many files
+LOAD_PROGRESS_EVERY = int(os.environ.get('LOAD_PROGRESS_EVERY', '100'))
+
+# Loader by file extension; files with other extensions are identified with libmagic
+LOADERS_BY_EXTENSION = {
+    '.pdf': 'pdf',
+    '.txt': 'text',
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+    '.html': 'html',
+    '.htm': 'html',
+}
+LOADERS_BY_MIME = (
+    ('application/pdf', 'pdf'),
+    ('text/plain', 'text'),
+    ('text/markdown', 'markdown'),
+    ('text/html', 'html'),
+)
+
+def iter_files(directory_path):
+    """Every file below a directory, recursively"""
+    for parent, _, names in os.walk(directory_path):
+        for name in sorted(names):
+            yield os.path.join(parent, name)
+
+def load_file(file_path):
+    """Load one file into Documents; runs in a worker process. Returns (path, documents, problem)"""
+    try:
+        kind = LOADERS_BY_EXTENSION.get(os.path.splitext(file_path)[1].lower())
+        if kind is None:
+            import magic  # Only for files whose extension does not say what they are
+            file_type = magic.from_file(file_path, mime=True)
+            kind = next((loader for mime, loader in LOADERS_BY_MIME if mime in file_type), None)
+            if kind is None:
+                return file_path, [], f"unsupported file type {file_type}"
+        from langchain_community.document_loaders import (
+            PyPDFLoader,
+            TextLoader,
+            UnstructuredHTMLLoader,  # For HTML
+            UnstructuredMarkdownLoader, # For Markdown
+            # Add more loaders as needed (e.g., CSVLoader, etc.)
+        )
+        loader = {
+            'pdf': PyPDFLoader,
+            'text': TextLoader,
+            'markdown': UnstructuredMarkdownLoader,
+            'html': UnstructuredHTMLLoader,
+        }[kind](file_path)
+        return file_path, loader.load(), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+class StoredEmbeddings:
+    """LangChain embeddings that look chunks up in an embedding store before encoding them"""
+
+    def __init__(self, embeddings, store):
+        self.embeddings = embeddings
+        self.store = store
+
+    @property
+    def client(self):
+        return self.embeddings.client
+
+    def embed_documents(self, texts):
+        return self.store.encode(texts, self.embeddings.embed_documents).tolist()
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
 class ConversationalRAG:
-    def __init__(self, chroma_db_path="./chroma_db"):
+    def __init__(self, chroma_db_path="./chroma_db", embedding_store_path="./embedding_store",
+                 conversation_db_path="./conversations.db"):
         self.db = None
         self.embeddings = None
-        self.conversation_history = []
+        self._chunker = None
+        # Bounded history per session; idle sessions are kept in SQLite rather than in memory
+        self.conversations = ConversationStore(conversation_db_path)
         self.chroma_db_path = chroma_db_path  # Store the path
+        # Chunk embeddings kept across rebuilds of the Chroma DB; None re-encodes every time
+        self.embedding_store_path = embedding_store_path
         self.embedding_model_name = "BAAI/bge-base-en-v1.5" # Default embedding model
 
-    def initialize_system(self, directory_path='/home/dots-pa/docs-rag-main/docs'):
+    @property
+    def conversation_history(self):
+        """Messages of the default session, oldest first"""
+        return self.conversations.messages("default")
+
+    def initialize_system(self, directory_path='/home/dots-pa/docs-rag-main/docs', model="llama3.2"):
         """Initialize the RAG system by loading and processing documents."""
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+            started = time.perf_counter()
+            # Ollama loads the model while the embeddings and database load here
+            llm_warm_up = self._warm_up_llm(model)
+            self.embeddings = self._load_embeddings()
+            embeddings_loaded = time.perf_counter()
             self.db = self._load_or_create_db(directory_path)
+            db_loaded = time.perf_counter()
+            # The first search pays for loading the index and encoding with a cold model
+            self.db.similarity_search("warm up", k=1)
+            llm_warm_up.join()
+            logging.info(f"Ready in {time.perf_counter() - started:.2f} s (embeddings {embeddings_loaded - started:.2f} s, "
+                         f"database {db_loaded - embeddings_loaded:.2f} s, warm-up {time.perf_counter() - db_loaded:.2f} s)")
             return "System initialized! You can start asking questions about the documentation."
         except Exception as e:
             logging.error(f"Error initializing system: {e}", exc_info=True)
             return f"Error initializing system: {e}"
 
+    def _load_embeddings(self):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+        if not self.embedding_store_path:
+            return embeddings
+        store = EmbeddingStore(self.embedding_store_path, self.embedding_model_name,
+                               embeddings.client.get_sentence_embedding_dimension())
+        return StoredEmbeddings(embeddings, store)
+
+    def _warm_up_llm(self, model):
+        """Load the model into Ollama's memory in the background; an empty prompt only loads it"""
+        def load():
+            import ollama
+            started = time.perf_counter()
+            try:
+                ollama.generate(model=model, prompt="")
+                logging.info(f"Loaded {model} in {time.perf_counter() - started:.2f} s")
+            except Exception as e:
+                logging.warning(f"Could not warm up {model}: {e}")
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
     def _load_or_create_db(self, directory_path):
         """Loads an existing Chroma DB or creates a new one if it doesn't exist."""
+        from langchain_community.vectorstores import Chroma
         try:
             if os.path.exists(self.chroma_db_path):
                 logging.info(f"Loading existing Chroma DB from {self.chroma_db_path}")
                 return Chroma(persist_directory=self.chroma_db_path, embedding_function=self.embeddings)
             else:
                 logging.info(f"Creating new Chroma DB at {self.chroma_db_path}")
-                docs = self._load_documents(directory_path)
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-                texts = text_splitter.split_documents(docs)
-                db = Chroma.from_documents(documents=texts, embedding=self.embeddings, persist_directory=self.chroma_db_path)
-                db.persist() # Persist the database to disk
+                db = Chroma(persist_directory=self.chroma_db_path, embedding_function=self.embeddings)
+                try:
+                    self._add_documents(db, directory_path)
+                except BaseException:
+                    # A half-built DB would be loaded as if complete next time
+                    shutil.rmtree(self.chroma_db_path, ignore_errors=True)
+                    raise
                 return db
         except Exception as e:
             logging.error(f"Error loading or creating Chroma DB: {e}", exc_info=True)
             raise  # Re-raise the exception to be handled by initialize_system
 
+    def _add_documents(self, db, directory_path):
+        """Load, split and insert every file below a directory, a batch of chunks at a time
+
+        Files are parsed in worker processes while this process splits,
+        embeds and inserts, so at most a few files per worker and one batch
+        of chunks are held in memory at once.
+        """
+        started = time.perf_counter()
+        files = chunks = 0
+        batch = []
+        for file_path, docs, problem in self._load_documents(directory_path):
+            files += 1
+            if problem:
+                logging.warning(f"Skipping {file_path}: {problem}")
+            batch.extend(self._split_documents(docs))
+            while len(batch) >= LOAD_BATCH_SIZE:
+                db.add_documents(batch[:LOAD_BATCH_SIZE])
+                chunks += LOAD_BATCH_SIZE
+                batch = batch[LOAD_BATCH_SIZE:]
+            if files % LOAD_PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - started
+                logging.info(f"Loaded {files} files, {chunks} chunks in {elapsed:.0f} s "
+                             f"({files / elapsed:.1f} files/s, {chunks / elapsed:.1f} chunks/s)")
+        if batch:
+            db.add_documents(batch)
+            chunks += len(batch)
+        logging.info(f"Built the DB from {files} files, {chunks} chunks in {time.perf_counter() - started:.1f} s")
+
+    def _split_documents(self, docs):
+        """Split documents with the same token-aware chunker rag_service uses"""
+        from langchain_core.documents import Document
+        if self._chunker is None:
+            model = self.embeddings.client  # The underlying SentenceTransformer
+            self._chunker = make_chunker(model.tokenizer, model.max_seq_length)
+        texts = []
+        for doc in docs:
+            text = doc.page_content
+            for start, end in self._chunker.spans(text):
+                texts.append(Document(page_content=text[start:end], metadata={**doc.metadata, "start_index": start}))
+        return texts
 
     def _load_documents(self, directory_path):
-        """Loads documents from the specified directory, handling different file types."""
-        documents = []
-        for filename in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, filename)
+        """Yield (path, documents, problem) for every file below a directory, loaded in worker processes"""
+        # Spawned rather than forked: this process already runs the embedding model's threads
+        context = multiprocessing.get_context("spawn")
+        max_in_flight = LOAD_WORKERS * 2
+        pending = set()
+        with ProcessPoolExecutor(max_workers=LOAD_WORKERS, mp_context=context) as executor:
             try:
-                if os.path.isfile(file_path):
-                    file_type = magic.from_file(file_path, mime=True) # Accurately detect file type
-                    logging.info(f"Loading file: {filename} with type: {file_type}")
-
-                    if 'application/pdf' in file_type:
-                        loader = PyPDFLoader(file_path)
-                    elif 'text/plain' in file_type or filename.endswith('.txt'):
-                        loader = TextLoader(file_path)
-                    elif 'text/markdown' in file_type or filename.endswith('.md'):
-                        loader = UnstructuredMarkdownLoader(file_path)
-                    elif 'text/html' in file_type or filename.endswith('.html'):
-                        loader = UnstructuredHTMLLoader(file_path)
-                    else:
-                        logging.warning(f"Unsupported file type for {filename}: {file_type}. Skipping.")
-                        continue  # Skip to the next file
-
-                    documents.extend(loader.load())
-            except Exception as e:
-                logging.error(f"Error loading file {filename}: {e}", exc_info=True)
-        return documents
-
-
-
-    def query_system(self, user_input, k=4, model="llama3.2"):
-        """Process a user query while maintaining conversation context."""
+                for file_path in iter_files(directory_path):
+                    if len(pending) >= max_in_flight:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+                    pending.add(executor.submit(load_file, file_path))
+                for future in wait(pending)[0]:
+                    yield future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+
+    def stream_query(self, user_input, k=4, model="llama3.2", session_id="default"):
+        """Yield the answer to a user query piece by piece as the model generates it."""
         if self.db is None:
-            return "Error: System not initialized. Please run initialize_system() first."
+            yield "Error: System not initialized. Please run initialize_system() first."
+            return
 
-        self.conversation_history.append({"role": "user", "content": user_input})
+        # Earlier turns only; the question itself is in the prompt already
+        history = self.conversations.history(session_id)
+        self.conversations.append(session_id, "user", user_input)
 
         try:
+            import ollama
             results = self.db.similarity_search(user_input, k=k)
             relevant_text = "\n".join(doc.page_content for doc in results)
 
             # Construct a more informative prompt
-            prompt = self._create_prompt(user_input, relevant_text)
+            prompt = self._create_prompt(user_input, relevant_text, history)
 
-            output = ollama.generate(model=model, prompt=prompt, stream=False) # Disable streaming for simplicity
-            response = output['response']
+            pieces = []
+            for part in ollama.generate(model=model, prompt=prompt, stream=True):
+                if part['response']:
+                    pieces.append(part['response'])
+                    yield part['response']
 
-            self.conversation_history.append({"role": "assistant", "content": response})
-            return response
+            self.conversations.append(session_id, "assistant", "".join(pieces))
 
         except Exception as e:
             logging.error(f"Error processing query: {e}", exc_info=True)
-            return f"An error occurred while processing your query: {e}"
+            yield f"An error occurred while processing your query: {e}"
 
-    def _create_prompt(self, user_input, relevant_text):
-        """Creates a prompt with more context and instructions."""
-        conversation_context = "\n".join([
-            f"{'Assistant: ' if msg['role'] == 'assistant' else 'Human: '}{msg['content']}"
-            for msg in self.conversation_history[-4:]  # Include last 4 messages for context
-        ])
+    def query_system(self, user_input, k=4, model="llama3.2", session_id="default"):
+        """Process a user query while maintaining conversation context."""
+        return "".join(self.stream_query(user_input, k=k, model=model, session_id=session_id))
 
+    def _create_prompt(self, user_input, relevant_text, conversation_context):
+        """Creates a prompt with more context and instructions."""
         prompt = f"""You are a helpful system administration assistant. Use the provided documentation to answer the user's question as accurately and concisely as possible.
 
         Reference Documentation:
@@ -151,15 +303,19 @@ class ConversationalRAG:
 
             if user_input.lower() in ['exit', 'quit', 'bye']:
                 print("Goodbye! Thank you for the conversation.")
+                self.conversations.close()
                 break
 
-            response = self.query_system(user_input)
-            print("\nAssistant:", response)
+            print("\nAssistant: ", end="", flush=True)
+            for piece in self.stream_query(user_input):
+                print(piece, end="", flush=True)
+            print()
 
     def load_existing_db(self, persist_directory="./chroma_db"):
         """Load an existing Chroma database"""
+        from langchain_community.vectorstores import Chroma
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+            self.embeddings = self._load_embeddings()
             self.db = Chroma(
                 persist_directory=persist_directory,
                 embedding_function=self.embeddings
@@ -1,14 +1,21 @@
 import os
+import sys
 import requests
 from bs4 import BeautifulSoup
-import trafilatura
 from tqdm import tqdm
 import json
-import time
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
 import magic  # For file type detection
+from frontier import CrawlFrontier, PRODUCT, VERSION, PAGE
+from page_cache import PageCache
+from extraction import ExtractionStage
+from ratelimit import HostRateLimiter
+from common.corpus import CorpusWriter, CorpusReader, is_corpus, CORPUS_COMPACT_THRESHOLD
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,6 +23,20 @@ logger = logging.getLogger(__name__)
 
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/app/data/documents')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 'corpus' appends to compressed JSONL shards; 'json' writes one legacy file per page
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'corpus')
+
+# Crawl state lives next to the documents so restarts resume from it
+FRONTIER_PATH = os.environ.get('FRONTIER_PATH', os.path.join(os.path.dirname(OUTPUT_DIR.rstrip('/')), 'crawl_frontier.db'))
+# Number of pages fetched in parallel
+SCRAPER_CONCURRENCY = int(os.environ.get('SCRAPER_CONCURRENCY', '8'))
+# Politeness limit: requests per second and burst size, per host
+SCRAPER_RATE_PER_HOST = float(os.environ.get('SCRAPER_RATE_PER_HOST', '2'))
+SCRAPER_BURST = int(os.environ.get('SCRAPER_BURST', '2'))
+# Compressed raw HTML plus ETag/Last-Modified for conditional requests
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', os.path.join(os.path.dirname(OUTPUT_DIR.rstrip('/')), 'page_cache'))
+# Re-extract from the page cache only, without network access
+SCRAPER_OFFLINE = os.environ.get('SCRAPER_OFFLINE', 'false').lower() == 'true'
 
 # Comprehensive list of Red Hat documentation bases
 BASE_URLS = [
@@ -39,17 +60,38 @@ HEADERS = {
 }
 
 class RedHatDocScraper:
-    def __init__(self, output_dir=OUTPUT_DIR, base_urls=BASE_URLS):
+    def __init__(self, output_dir=OUTPUT_DIR, base_urls=BASE_URLS, frontier_path=FRONTIER_PATH, page_cache_dir=PAGE_CACHE_DIR,
+                 concurrency=SCRAPER_CONCURRENCY, rate_per_host=SCRAPER_RATE_PER_HOST, burst=SCRAPER_BURST,
+                 output_format=OUTPUT_FORMAT):
         self.output_dir = output_dir
+        self.corpus = CorpusWriter(output_dir) if output_format == 'corpus' else None
         self.base_urls = base_urls
-        self.all_doc_urls = []
+        self.frontier = CrawlFrontier(frontier_path)
+        self.concurrency = concurrency
+        self.rate_limiter = HostRateLimiter(rate_per_host, burst)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=len(base_urls), pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.page_cache = PageCache(page_cache_dir)
+        self.extraction = None
         self.processed_count = 0
+        self.unchanged_count = 0
+        self.count_lock = threading.Lock()
+        # (ETag, Last-Modified) of downloaded pages whose documents are not saved yet
+        self.unsaved_validators = {}
+
+    def _get(self, url):
+        """Rate-limited GET through the shared session"""
+        self.rate_limiter.acquire(url)
+        return self.session.get(url, timeout=10)
         
     def get_product_versions(self, base_url):
         """Get all product versions from a base product URL"""
         versions = []
         try:
-            response = requests.get(base_url, headers=HEADERS, timeout=10)
+            response = self._get(base_url)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
                 # Look for version links
@@ -73,7 +115,7 @@ class RedHatDocScraper:
         # First try the documentation landing page
         try:
             logger.info(f"Fetching documentation from: {version_url}")
-            response = requests.get(version_url, headers=HEADERS, timeout=10)
+            response = self._get(version_url)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
                 
@@ -91,7 +133,7 @@ class RedHatDocScraper:
         single_page_url = f"{version_url}/html-single/index/"
         try:
             logger.info(f"Fetching single-page index from: {single_page_url}")
-            response = requests.get(single_page_url, headers=HEADERS, timeout=10)
+            response = self._get(single_page_url)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
                 
@@ -109,7 +151,7 @@ class RedHatDocScraper:
         sitemap_url = f"{version_url}/sitemap"
         try:
             logger.info(f"Fetching sitemap from: {sitemap_url}")
-            response = requests.get(sitemap_url, headers=HEADERS, timeout=10)
+            response = self._get(sitemap_url)
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
                 
@@ -127,116 +169,194 @@ class RedHatDocScraper:
         logger.info(f"Found {len(doc_urls)} documentation pages for {version_url}")
         return doc_urls
 
-    def download_and_extract_content(self, url):
-        """Download and extract content from a documentation URL"""
-        try:
-            logger.info(f"Downloading content from: {url}")
-            downloaded = trafilatura.fetch_url(url, headers=HEADERS)
-            if not downloaded:
-                logger.error(f"Failed to download content from {url}")
-                return None
-                
-            content = trafilatura.extract(downloaded, include_comments=False, 
-                                         include_tables=True, output_format='json')
-            if content:
-                data = json.loads(content)
-                # Add additional metadata for better organization
-                metadata = {
-                    'url': url,
-                    'title': data.get('title', ''),
-                    'text': data.get('text', ''),
-                    'timestamp': time.time(),
-                    'product': self._extract_product_from_url(url),
-                    'version': self._extract_version_from_url(url),
-                    'document_type': self._extract_document_type_from_url(url)
-                }
-                return metadata
-            else:
-                logger.error(f"Failed to extract content from {url}")
-        except Exception as e:
-            logger.error(f"Error processing {url}: {e}")
-        return None
+    def fetch_page(self, url):
+        """Fetch raw HTML, revalidating any cached copy; returns (content, modified)"""
+        headers = self.page_cache.validators(url)
+        self.rate_limiter.acquire(url)
+        response = self.session.get(url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            self.page_cache.touch(url)
+            return None, False
+        if response.status_code != 200 or not response.content:
+            logger.error(f"Failed to download content from {url}: HTTP {response.status_code}")
+            return None, True
+        self.page_cache.store(url, response.content)
+        with self.count_lock:
+            self.unsaved_validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content, True
 
-    def _extract_product_from_url(self, url):
-        """Extract product name from URL"""
-        match = re.search(r'/documentation/en-us/([^/]+)', url)
-        if match:
-            return match.group(1).replace('_', ' ').title()
-        return "Unknown Product"
-
-    def _extract_version_from_url(self, url):
-        """Extract version from URL"""
-        match = re.search(r'/(\d+(\.\d+)*)/', url)
-        if match:
-            return match.group(1)
-        return "Unknown Version"
-
-    def _extract_document_type_from_url(self, url):
-        """Extract document type from URL"""
-        if '/html-single/' in url:
-            return "Single Page HTML"
-        elif '/html/' in url:
-            return "HTML"
-        elif '/pdf/' in url:
-            return "PDF"
-        elif '/epub/' in url:
-            return "EPUB"
-        return "Unknown Type"
-
-    def save_document(self, doc_data, index):
-        """Save document to file with proper error handling"""
+    def save_document(self, doc_data, index, on_saved=None):
+        """Save document with proper error handling
+
+        `on_saved` is called once the document is durably on disk, which for
+        the corpus format is when its block is flushed.
+        """
         if not doc_data or not doc_data.get('text') or len(doc_data['text']) < 100:
             return False
             
         try:
-            # Create a more descriptive filename
-            product = re.sub(r'[^a-zA-Z0-9]', '_', doc_data['product'])
-            version = re.sub(r'[^a-zA-Z0-9]', '_', doc_data['version'])
-            doc_type = re.sub(r'[^a-zA-Z0-9]', '_', doc_data.get('document_type', 'unknown'))
-            
-            filename = f"{self.output_dir}/{product}_{version}_{doc_type}_{index}.json"
-            
-            with open(filename, 'w') as f:
-                json.dump(doc_data, f, indent=2)
+            if self.corpus is not None:
+                self.corpus.write(doc_data, on_saved)
+            else:
+                # Create a more descriptive filename
+                product = re.sub(r'[^a-zA-Z0-9]', '_', doc_data['product'])
+                version = re.sub(r'[^a-zA-Z0-9]', '_', doc_data['version'])
+                doc_type = re.sub(r'[^a-zA-Z0-9]', '_', doc_data.get('document_type', 'unknown'))
+                
+                filename = f"{self.output_dir}/{product}_{version}_{doc_type}_{index}.json"
+                
+                with open(filename, 'w') as f:
+                    json.dump(doc_data, f, indent=2)
+                if on_saved is not None:
+                    on_saved()
             logger.info(f"Saved document {index}: {doc_data['title']} ({len(doc_data['text'])} chars)")
-            self.processed_count += 1
+            with self.count_lock:
+                self.processed_count += 1
             return True
         except Exception as e:
             logger.error(f"Error saving document {index}: {e}")
             return False
 
+    def _fetch_page(self, index, url):
+        logger.info(f"Downloading content from: {url}")
+        downloaded, modified = self.fetch_page(url)
+        if not modified:
+            # Unchanged since the last crawl, so the saved document is still current
+            with self.count_lock:
+                self.unchanged_count += 1
+            return True
+        if not downloaded:
+            return False
+        self.extraction.put(index, url, downloaded)
+        # The extraction stage marks the page finished once it is saved
+        return None
+
+    def _save_extracted(self, index, url, doc_data):
+        with self.count_lock:
+            etag, last_modified = self.unsaved_validators.pop(url, (None, None))
+
+        def saved():
+            # Only once the document can no longer be lost may a 304 count as unchanged
+            self.page_cache.validate(url, etag, last_modified)
+            self.frontier.finish(url, True)
+
+        if not self.save_document(doc_data, index, saved):
+            self.frontier.finish(url, False)
+
+    def _load_cached(self, index, url):
+        downloaded = self.page_cache.load(url)
+        if downloaded:
+            self.extraction.put(index, url, downloaded)
+
+    def _discover_versions(self, index, url):
+        self.frontier.add(self.get_product_versions(url), VERSION)
+        return True
+
+    def _discover_pages(self, index, url):
+        self.frontier.add(self.get_documentation_urls(url), PAGE)
+        return True
+
+    def _drain(self, kind, handler, progress=None):
+        """Process pending frontier URLs of one kind with a bounded worker pool"""
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                # Keep every worker busy with one URL queued behind it
+                free_slots = self.concurrency * 2 - len(in_flight)
+                if free_slots > 0:
+                    for index, url in self.frontier.claim(kind, free_slots):
+                        in_flight[executor.submit(handler, index, url)] = url
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing {url}: {e}")
+                        succeeded = False
+                    # None means a later stage will finish the URL
+                    if succeeded is not None:
+                        self.frontier.finish(url, succeeded)
+                    if progress is not None:
+                        progress.update(1)
+
     def run(self):
         """Run the scraper to collect all Red Hat documentation"""
-        logger.info("Starting Red Hat documentation scraper")
-        
-        # Get all product versions
-        all_versions = []
-        for base_url in self.base_urls:
-            versions = self.get_product_versions(base_url)
-            all_versions.extend(versions)
+        if self.frontier.start_crawl():
+            logger.info(f"Resuming crawl from {self.frontier.path}: {self.frontier.counts()}")
+        else:
+            logger.info("Starting Red Hat documentation scraper")
         
-        logger.info(f"Found {len(all_versions)} product versions")
+        # Discovery stages; URLs already seen in this crawl are not queued twice
+        self.frontier.add(self.base_urls, PRODUCT)
+        self._drain(PRODUCT, self._discover_versions)
+        logger.info(f"Found {self.frontier.pending(VERSION)} product versions to scan")
         
-        # Get all documentation URLs for each version
-        for version_url in all_versions:
-            doc_urls = self.get_documentation_urls(version_url)
-            self.all_doc_urls.extend(doc_urls)
+        self._drain(VERSION, self._discover_pages)
+        logger.info(f"Found total of {self.frontier.pending(PAGE)} unique documentation pages to fetch")
         
-        # Deduplicate URLs
-        self.all_doc_urls = list(set(self.all_doc_urls))
-        logger.info(f"Found total of {len(self.all_doc_urls)} unique documentation pages")
-        
-        # Process each URL
-        for i, url in enumerate(tqdm(self.all_doc_urls)):
-            doc_data = self.download_and_extract_content(url)
-            if doc_data:
-                self.save_document(doc_data, i)
-            
-            # Be respectful with rate limiting
-            time.sleep(1)
+        # Fetch pages concurrently; the per-host rate limiter keeps us polite
+        # and extraction runs on every core in a separate process pool
+        self.extraction = ExtractionStage(self._save_extracted)
+        try:
+            with tqdm(total=self.frontier.pending(PAGE)) as progress:
+                self._drain(PAGE, self._fetch_page, progress)
+        finally:
+            self.extraction.close()
+            self.flush()
         
-        logger.info(f"Scraping complete. Successfully processed {self.processed_count} documents.")
+        logger.info(f"Scraping complete. Successfully processed {self.processed_count} documents, "
+                    f"{self.unchanged_count} unchanged. Crawl state: {self.frontier.counts()}")
+
+    def run_offline(self):
+        """Re-extract every cached page without touching the network"""
+        entries = self.page_cache.entries()
+        logger.info(f"Re-extracting {len(entries)} cached pages from {self.page_cache.directory}")
+        self.extraction = ExtractionStage(lambda index, url, doc_data: self.save_document(doc_data, index))
+        try:
+            for index, url in tqdm(entries):
+                self._load_cached(index, url)
+        finally:
+            self.extraction.close()
+            self.flush()
+        logger.info(f"Offline extraction complete. Successfully processed {self.processed_count} documents.")
+
+    def flush(self):
+        """Write out documents still buffered in the current corpus block"""
+        if self.corpus is not None:
+            self.corpus.flush()
+
+    def close(self):
+        if self.corpus is not None:
+            self.corpus.close()
+        self.page_cache.close()
+        self.frontier.close()
+
+def compact_corpus(directory=OUTPUT_DIR, threshold=CORPUS_COMPACT_THRESHOLD):
+    """Rewrite the corpus without superseded records once they make up `threshold` of it"""
+    if not is_corpus(directory):
+        return
+    reader = CorpusReader(directory)
+    stored, superseded = reader.superseded()
+    if not superseded or superseded < threshold * stored:
+        logger.info(f"Corpus in {directory}: {superseded} of {stored} records superseded, not compacting")
+        return
+    logger.info(f"Compacting corpus in {directory}: dropping {superseded} of {stored} superseded records")
+    reader.compact()
 
 if __name__ == "__main__":
+    if '--compact' in sys.argv[1:]:
+        compact_corpus(threshold=0)
+        sys.exit(0)
     scraper = RedHatDocScraper()
-    scraper.run()
+    try:
+        if SCRAPER_OFFLINE or '--offline' in sys.argv[1:]:
+            scraper.run_offline()
+        else:
+            scraper.run()
+    finally:
+        scraper.close()
+    # Only after a finished run, with the corpus writer closed
+    compact_corpus(scraper.output_dir)
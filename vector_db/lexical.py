@@ -0,0 +1,289 @@
+import os
+import re
+import math
+import pickle
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Compound tokens such as "subscription-manager", "ipv4.addresses" or "/etc/hosts"
+# are indexed whole and also split into their alphanumeric parts
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._\-/:+@][a-z0-9]+)*")
+PART_RE = re.compile(r"[a-z0-9]+")
+
+FORMAT_VERSION = 2
+
+# Comparison operators a facet filter understands, as in Chroma's `where`
+FILTER_OPERATORS = ("$eq", "$ne", "$in", "$nin")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(PART_RE.findall(token))
+    return tokens
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index with tombstone deletes and pickle persistence
+
+    Postings are append-only array('I') doc numbers with array('H') term
+    frequencies; searches view them as NumPy arrays without copying and
+    score every matching document in one vectorized pass per query term.
+    Deleted or replaced documents are tombstoned and dropped when the
+    index is compacted on save. Metadata fields listed in `facet_fields`
+    get doc-number postings of their own so searches can be restricted
+    with a Chroma-style `where` filter.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75, facet_fields=()):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.facet_fields = tuple(facet_fields)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._reset()
+
+    def _reset(self):
+        self.ids: List[str] = []            # doc number -> external id
+        self.docnos: Dict[str, int] = {}    # external id -> live doc number
+        self.lengths = array('I')
+        self.alive = bytearray()
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.facets: Dict[Tuple[str, str], array] = {}  # (field, value) -> doc numbers
+        self.live_count = 0
+        self.total_length = 0
+
+    def __len__(self):
+        return self.live_count
+
+    def _remove(self, doc_id):
+        docno = self.docnos.pop(doc_id, None)
+        if docno is None:
+            return
+        self.alive[docno] = 0
+        self.live_count -= 1
+        self.total_length -= self.lengths[docno]
+
+    def _add(self, doc_id, text, metadata):
+        self._remove(doc_id)
+        counts: Dict[str, int] = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        docno = len(self.ids)
+        self.ids.append(doc_id)
+        self.docnos[doc_id] = docno
+        self.lengths.append(len(tokens))
+        self.alive.append(1)
+        self.live_count += 1
+        self.total_length += len(tokens)
+        for token, count in counts.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array('I'), array('H'))
+            posting[0].append(docno)
+            posting[1].append(min(count, 65535))
+        for field in self.facet_fields:
+            value = (metadata or {}).get(field)
+            if value is not None:
+                self.facets.setdefault((field, str(value)), array('I')).append(docno)
+
+    def add(self, documents: Iterable[Tuple[str, str, Optional[dict]]]):
+        """Index (id, text, metadata) triples, replacing documents that already exist"""
+        with self.lock:
+            for doc_id, text, metadata in documents:
+                self._add(doc_id, text, metadata)
+            self.dirty = True
+
+    def delete(self, doc_ids: Iterable[str]):
+        with self.lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+            self.dirty = True
+
+    def _facet_mask(self, field, value):
+        mask = np.zeros(len(self.ids), dtype=bool)
+        docs = self.facets.get((field, str(value)))
+        if docs is not None:
+            mask[np.frombuffer(docs, dtype=np.uint32)] = True
+        return mask
+
+    def _where_mask(self, where: dict):
+        """Boolean mask over doc numbers for a Chroma-style metadata filter"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                masks = [self._where_mask(clause) for clause in condition]
+                if masks:
+                    mask &= np.logical_and.reduce(masks) if key == "$and" else np.logical_or.reduce(masks)
+                continue
+            if key not in self.facet_fields:
+                raise ValueError(f"Lexical search can only filter on {', '.join(self.facet_fields) or 'no fields'}, not {key}")
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator not in FILTER_OPERATORS:
+                    raise ValueError(f"Unsupported filter operator for lexical search: {operator}")
+                values = operand if operator in ("$in", "$nin") else [operand]
+                matched = np.zeros(len(self.ids), dtype=bool)
+                for value in values:
+                    matched |= self._facet_mask(key, value)
+                mask &= matched if operator in ("$eq", "$in") else ~matched
+        return mask
+
+    def matching_ids(self, where: dict) -> List[str]:
+        """Ids of the live documents a metadata filter selects"""
+        with self.lock:
+            mask = self._where_mask(where)
+            mask &= np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+            return [self.ids[docno] for docno in np.flatnonzero(mask)]
+
+    def search(self, query: str, k: int, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """Top-k (id, BM25 score) pairs for a query, optionally restricted by a metadata filter"""
+        terms = set(tokenize(query))
+        with self.lock:
+            if not terms or not self.live_count:
+                return []
+            # _score's views over the postings are gone once it returns, before the lock is released;
+            # a live view would make a concurrent add fail to grow the arrays
+            return self._score(terms, k, where)
+
+    def _score(self, terms, k, where) -> List[Tuple[str, float]]:
+        mask = self._where_mask(where) if where else None
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        alive = np.frombuffer(self.alive, dtype=np.uint8)
+        average_length = self.total_length / self.live_count
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs = np.frombuffer(posting[0], dtype=np.uint32)
+            tfs = np.frombuffer(posting[1], dtype=np.uint16).astype(np.float32)
+            live = alive[docs].astype(bool)
+            document_frequency = int(live.sum())
+            if not document_frequency:
+                continue
+            docs = docs[live]
+            tfs = tfs[live]
+            idf = math.log(1 + (self.live_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        if mask is not None:
+            scores[~mask] = 0
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(self.ids[docno], float(scores[docno])) for docno in matched]
+
+    def _compact(self):
+        """Rebuild postings without tombstoned documents"""
+        alive = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+        remap = np.full(len(self.ids), -1, dtype=np.int64)
+        remap[alive] = np.arange(int(alive.sum()))
+        lengths = array('I')
+        lengths.frombytes(np.frombuffer(self.lengths, dtype=np.uint32)[alive].tobytes())
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            mapped = remap[np.frombuffer(docs, dtype=np.uint32)]
+            keep = mapped >= 0
+            if not keep.any():
+                continue
+            new_docs, new_tfs = array('I'), array('H')
+            new_docs.frombytes(mapped[keep].astype(np.uint32).tobytes())
+            new_tfs.frombytes(np.frombuffer(tfs, dtype=np.uint16)[keep].tobytes())
+            postings[term] = (new_docs, new_tfs)
+        facets = {}
+        for key, docs in self.facets.items():
+            mapped = remap[np.frombuffer(docs, dtype=np.uint32)]
+            mapped = mapped[mapped >= 0]
+            if len(mapped):
+                facets[key] = array('I')
+                facets[key].frombytes(mapped.astype(np.uint32).tobytes())
+        del alive
+        self.ids = [doc_id for docno, doc_id in enumerate(self.ids) if self.alive[docno]]
+        self.docnos = {doc_id: docno for docno, doc_id in enumerate(self.ids)}
+        self.lengths = lengths
+        self.alive = bytearray(b'\x01') * len(self.ids)
+        self.postings = postings
+        self.facets = facets
+
+    def save(self):
+        """Persist the index atomically if it changed since the last save"""
+        with self.lock:
+            if not self.dirty:
+                return
+            # Compact once a quarter of the stored documents are tombstones
+            if len(self.ids) - self.live_count > len(self.ids) // 4:
+                self._compact()
+            state = {
+                "version": FORMAT_VERSION,
+                "ids": self.ids,
+                "lengths": self.lengths.tobytes(),
+                "alive": bytes(self.alive),
+                "postings": {term: (docs.tobytes(), tfs.tobytes()) for term, (docs, tfs) in self.postings.items()},
+                "facet_fields": self.facet_fields,
+                "facets": {key: docs.tobytes() for key, docs in self.facets.items()},
+                "total_length": self.total_length
+            }
+            self.dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """Load a saved index; returns False if there is none"""
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        if state.get("version") != FORMAT_VERSION:
+            logger.warning(f"Ignoring lexical index {self.path} with unknown format {state.get('version')}")
+            return False
+        if tuple(state["facet_fields"]) != self.facet_fields:
+            logger.warning(f"Ignoring lexical index {self.path} built for facets {state['facet_fields']}")
+            return False
+        with self.lock:
+            self._reset()
+            self.ids = state["ids"]
+            self.lengths.frombytes(state["lengths"])
+            self.alive = bytearray(state["alive"])
+            self.docnos = {doc_id: docno for docno, doc_id in enumerate(self.ids) if self.alive[docno]}
+            self.live_count = len(self.docnos)
+            self.total_length = state["total_length"]
+            for term, (docs, tfs) in state["postings"].items():
+                docs_array, tfs_array = array('I'), array('H')
+                docs_array.frombytes(docs)
+                tfs_array.frombytes(tfs)
+                self.postings[term] = (docs_array, tfs_array)
+            for key, docs in state["facets"].items():
+                self.facets[key] = array('I')
+                self.facets[key].frombytes(docs)
+            self.dirty = False
+        return True
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists: score(d) = sum over lists of 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
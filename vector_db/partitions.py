@@ -0,0 +1,206 @@
+import re
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "redhat_docs"
+# Chroma collection names allow 3-63 characters
+MAX_COLLECTION_NAME = 63
+RESULT_FIELDS = ("ids", "documents", "metadatas", "distances")
+
+
+def partition_slug(value) -> str:
+    slug = re.sub(r'[^a-z0-9]+', '_', str(value).lower()).strip('_')
+    return slug[:MAX_COLLECTION_NAME - len(COLLECTION_NAME) - 2] or 'unknown'
+
+
+def pinned_values(where: Optional[dict], field) -> Optional[Set[str]]:
+    """Values a filter restricts `field` to, or None if it allows any value"""
+    if not where:
+        return None
+    pinned = None
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                values = pinned_values(clause, field)
+                if values is not None:
+                    pinned = values if pinned is None else pinned & values
+        elif key == field:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if "$eq" in condition:
+                values = {str(condition["$eq"])}
+            elif "$in" in condition:
+                values = {str(value) for value in condition["$in"]}
+            else:
+                continue
+            pinned = values if pinned is None else pinned & values
+    return pinned
+
+
+def without_field(where: Optional[dict], field) -> Optional[dict]:
+    """Drop top-level conditions on `field` from a filter
+
+    Used once partitions have been picked by `field`: every chunk in them
+    already satisfies those conditions, and leaving them in would make
+    Chroma filter metadata instead of searching the whole partition.
+    """
+    if not where:
+        return None
+    clauses = []
+    for key, condition in where.items():
+        if key == "$and":
+            clauses.extend(clause for clause in condition if without_field(clause, field) == clause)
+        elif key != field:
+            clauses.append({key: condition})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class PartitionedCollection:
+    """One Chroma collection per value of a metadata field, used like a single collection
+
+    With no partition field everything lives in the `redhat_docs` collection,
+    as before. With one (e.g. "product"), each chunk is stored in
+    `redhat_docs__<slug>` for its value, and queries whose `where` pins the
+    field only search the matching collections; other queries fan out to
+    every partition and merge the hits by distance. Chunks without the field
+    stay in `redhat_docs`.
+    """
+
+    def __init__(self, client, partition_by=None, metadata=None, search_ef=None):
+        self.client = client
+        self.partition_by = partition_by or None
+        # Index settings for new collections, e.g. {"hnsw:space": "cosine", "hnsw:M": 32}
+        self.metadata = metadata or None
+        self.search_ef = search_ef
+        self.lock = threading.Lock()
+        self.collections = {}
+        self._collection(COLLECTION_NAME)
+        if self.partition_by:
+            for collection in client.list_collections():
+                name = collection if isinstance(collection, str) else collection.name
+                if name.startswith(f"{COLLECTION_NAME}__"):
+                    self._collection(name)
+
+    def _collection(self, name):
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                try:
+                    collection = self.client.get_collection(name)
+                    self._check_settings(collection)
+                except Exception:
+                    collection = self.client.create_collection(name, metadata=self.metadata)
+                self.collections[name] = collection
+            return collection
+
+    def _check_settings(self, collection):
+        """Warn about index settings an existing collection cannot take, and apply ef_search"""
+        existing = collection.metadata or {}
+        for key, value in (self.metadata or {}).items():
+            if key != "hnsw:search_ef" and key in existing and existing[key] != value:
+                logger.warning(f"Collection {collection.name} keeps {key}={existing[key]}; "
+                               f"{value} only applies to new collections")
+        configured = ((collection.configuration or {}).get("hnsw") or {}).get("ef_search")
+        if self.search_ef and configured != self.search_ef:
+            try:
+                # ef_search is a query-time setting; it takes effect when the index is next loaded
+                collection.modify(configuration={"hnsw": {"ef_search": self.search_ef}})
+            except Exception as e:
+                logger.warning(f"Could not set ef_search on {collection.name}: {e}")
+
+    def _name(self, value) -> str:
+        if not self.partition_by or value in (None, ""):
+            return COLLECTION_NAME
+        return f"{COLLECTION_NAME}__{partition_slug(value)}"
+
+    def _targets(self, where) -> Tuple[List[Any], Optional[dict]]:
+        """Collections a filtered query has to search, and the filter left to apply in them"""
+        values = pinned_values(where, self.partition_by) if self.partition_by else None
+        if values is None:
+            return list(self.collections.values()), where
+        names = {self._name(value) for value in values}
+        targets = [collection for name, collection in self.collections.items() if name in names]
+        return targets, without_field(where, self.partition_by)
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            value = (metadata or {}).get(self.partition_by) if self.partition_by else None
+            groups.setdefault(self._name(value), []).append(i)
+        for name, rows in groups.items():
+            kwargs = {
+                "ids": [ids[i] for i in rows],
+                "documents": [documents[i] for i in rows],
+                "metadatas": [metadatas[i] for i in rows]
+            }
+            if embeddings is not None:
+                kwargs["embeddings"] = embeddings[rows] if len(rows) < len(ids) else embeddings
+            self._collection(name).upsert(**kwargs)
+
+    def delete(self, ids):
+        for collection in list(self.collections.values()):
+            collection.delete(ids=ids)
+
+    def update_metadata(self, ids, metadatas):
+        """Merge metadata fields into stored chunks, in whichever partitions hold them"""
+        rows = dict(zip(ids, metadatas))
+        for collection in list(self.collections.values()):
+            found = collection.get(ids=list(rows), include=[])["ids"]
+            if found:
+                collection.update(ids=found, metadatas=[rows.pop(chunk_id) for chunk_id in found])
+            if not rows:
+                break
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in list(self.collections.values()))
+
+    def get(self, ids, include) -> Dict[str, list]:
+        """Stored rows for ids, from whichever partitions hold them"""
+        merged = {"ids": []}
+        merged.update({field: [] for field in include})
+        for collection in list(self.collections.values()):
+            found = collection.get(ids=ids, include=include)
+            merged["ids"].extend(found["ids"])
+            for field in include:
+                merged[field].extend(found[field])
+            if len(merged["ids"]) == len(ids):
+                break
+        return merged
+
+    def iter_pages(self, page_size, include) -> Iterator[Dict[str, list]]:
+        for collection in list(self.collections.values()):
+            offset = 0
+            while True:
+                page = collection.get(limit=page_size, offset=offset, include=include)
+                if not page["ids"]:
+                    break
+                yield page
+                offset += len(page["ids"])
+
+    def query(self, n_results, where=None, query_embeddings=None, query_texts=None) -> Dict[str, list]:
+        """collection.query over the partitions a filter selects, merged by distance per query"""
+        targets, where = self._targets(where)
+        targets = [collection for collection in targets if collection.count()]
+        kwargs = {"n_results": n_results, "where": where or None}
+        if query_embeddings is not None:
+            kwargs["query_embeddings"] = query_embeddings
+        else:
+            kwargs["query_texts"] = query_texts
+        if len(targets) == 1:
+            return targets[0].query(**kwargs)
+        partials = [collection.query(**kwargs) for collection in targets]
+        merged = {field: [] for field in RESULT_FIELDS}
+        for row in range(len(query_embeddings if query_embeddings is not None else query_texts)):
+            hits = []
+            for results in partials:
+                hits.extend(zip(*(results[field][row] for field in RESULT_FIELDS)))
+            hits.sort(key=lambda hit: hit[3])
+            hits = hits[:n_results]
+            for i, field in enumerate(RESULT_FIELDS):
+                merged[field].append([hit[i] for hit in hits])
+        return merged
@@ -0,0 +1,246 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_FORMATS = ("int8", "float16")
+# Rows converted to float32 at a time while scanning codes
+SCAN_BLOCK_ROWS = 65536
+# Queries scored together in one pass over the codes; bounds the score matrix
+QUERY_BLOCK = 16
+
+
+class QuantizedIndex:
+    """Compressed in-memory embeddings for candidate generation, re-scored exactly from disk
+
+    Every vector is kept twice: as int8 codes with a per-vector scale (or as
+    float16) in memory, and as float32 in an append-only file that is only
+    memory-mapped. A search scans the codes in blocks to pick candidates and
+    computes exact distances for those candidates alone, so resident memory
+    is about a quarter (int8) or half (float16) of the float32 vectors.
+    Replaced and deleted vectors are tombstoned until the next compaction.
+    """
+
+    def __init__(self, directory, dtype="int8", space="l2"):
+        if dtype not in QUANTIZED_FORMATS:
+            raise ValueError(f"Unknown quantized format {dtype!r}; expected one of {', '.join(QUANTIZED_FORMATS)}")
+        self.directory = directory
+        self.dtype = dtype
+        self.space = space
+        self.lock = threading.Lock()
+        self.dirty = False
+        self._reset(0)
+
+    def _reset(self, dimension):
+        self.dimension = dimension
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.size = 0
+        self.codes = np.empty((0, dimension), dtype=np.int8 if self.dtype == "int8" else np.float16)
+        self.scales = np.empty(0, dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)  # squared float32 norms
+        self.alive = np.empty(0, dtype=bool)
+        self._vectors = None
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.directory, "vectors.f32")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def memory_bytes(self) -> int:
+        """Resident bytes of the search structures (the float32 copy stays on disk)"""
+        return int(self.codes[:self.size].nbytes + self.scales[:self.size].nbytes
+                   + self.norms[:self.size].nbytes + self.alive[:self.size].nbytes)
+
+    def _grow(self, needed):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in ("codes", "scales", "norms", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _encode(self, vectors):
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        peak = np.abs(vectors).max(axis=1)
+        peak[peak == 0] = 1.0
+        scales = (peak / 127).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+
+    def _vector_map(self):
+        if self._vectors is None or len(self._vectors) < self.size:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                      shape=(self.size, self.dimension))
+        return self._vectors
+
+    def add(self, ids: List[str], embeddings):
+        """Index vectors, replacing ids that are already present"""
+        if not len(ids):
+            return
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self.lock:
+            if self.dimension == 0:
+                self._reset(vectors.shape[1])
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dimensional embeddings, got {vectors.shape[1]}")
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.vectors_path, "ab") as f:
+                f.seek(self.size * self.dimension * 4)
+                f.truncate()
+                f.write(vectors.tobytes())
+            codes, scales = self._encode(vectors)
+            start = self.size
+            self._grow(start + len(vectors))
+            end = start + len(vectors)
+            self.codes[start:end] = codes
+            self.scales[start:end] = scales
+            self.norms[start:end] = np.einsum("ij,ij->i", vectors, vectors)
+            self.alive[start:end] = True
+            for offset, doc_id in enumerate(ids):
+                previous = self.rows.get(doc_id)
+                if previous is not None:
+                    self.alive[previous] = False
+                self.rows[doc_id] = start + offset
+                self.ids.append(doc_id)
+            self.size = end
+            self.dirty = True
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for doc_id in ids:
+                row = self.rows.pop(doc_id, None)
+                if row is not None:
+                    self.alive[row] = False
+            self.dirty = True
+
+    def _approximate(self, queries, allowed=None):
+        """(rows, queries) scores from the codes; higher means closer"""
+        scores = np.empty((self.size, len(queries)), dtype=np.float32)
+        for start in range(0, self.size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self.size)
+            block = self.codes[start:end].astype(np.float32) @ queries.T
+            if self.dtype == "int8":
+                block *= self.scales[start:end, None]
+            scores[start:end] = block
+        if self.space == "l2":
+            # argmin |q - x|^2 = argmax q.x - |x|^2 / 2
+            scores -= 0.5 * self.norms[:self.size, None]
+        elif self.space == "cosine":
+            scores /= np.sqrt(np.maximum(self.norms[:self.size], 1e-12))[:, None]
+        scores[~(self.alive[:self.size] if allowed is None else allowed)] = -np.inf
+        return scores
+
+    def _distances(self, vectors, query):
+        dots = vectors @ query
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+            return 1.0 - dots / np.maximum(norms, 1e-12)
+        return np.einsum("ij,ij->i", vectors, vectors) + float(query @ query) - 2 * dots
+
+    def search(self, queries, k: int, candidates: int,
+               ids: Optional[List[str]] = None) -> List[Tuple[List[str], List[float]]]:
+        """Top-k (ids, distances) per query: `candidates` picked from the codes, re-scored in float32
+
+        With `ids`, only those vectors are searched, e.g. the chunks a metadata filter selects.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self.lock:
+            allowed = None
+            live = len(self.rows)
+            if ids is not None:
+                rows = np.fromiter((self.rows.get(doc_id, -1) for doc_id in ids), dtype=np.int64, count=len(ids))
+                allowed = np.zeros(self.size, dtype=bool)
+                allowed[rows[rows >= 0]] = True
+                live = int(allowed.sum())
+            if not live:
+                return [([], []) for _ in queries]
+            candidates = min(max(candidates, k), live)
+            vectors = self._vector_map()
+            results = []
+            for first in range(0, len(queries), QUERY_BLOCK):
+                group = queries[first:first + QUERY_BLOCK]
+                scores = self._approximate(group, allowed)
+                for column, query in enumerate(group):
+                    rows = np.argpartition(-scores[:, column], candidates - 1)[:candidates]
+                    rows = np.sort(rows)  # sequential reads from the memory map
+                    distances = self._distances(np.asarray(vectors[rows]), query)
+                    order = np.argsort(distances, kind="stable")[:k]
+                    results.append(([self.ids[rows[i]] for i in order], [float(distances[i]) for i in order]))
+            return results
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        tmp_path = f"{self.vectors_path}.tmp"
+        vectors = self._vector_map()
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(keep), SCAN_BLOCK_ROWS):
+                f.write(np.asarray(vectors[keep[start:start + SCAN_BLOCK_ROWS]]).tobytes())
+        self._vectors = None
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+        self.codes = self.codes[keep]
+        self.scales = self.scales[keep]
+        self.norms = self.norms[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.ids = [self.ids[row] for row in keep]
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.size = len(keep)
+
+    def save(self):
+        """Persist the codes and row table atomically if they changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            if self.size - len(self.rows) > self.size // 4:
+                self._compact()
+            os.makedirs(self.directory, exist_ok=True)
+            arrays = {"codes": self.codes, "scales": self.scales, "norms": self.norms, "alive": self.alive}
+            for name, array in arrays.items():
+                tmp_path = os.path.join(self.directory, f"{name}.tmp.npy")
+                np.save(tmp_path, array[:self.size])
+                os.replace(tmp_path, os.path.join(self.directory, f"{name}.npy"))
+            state = {"dtype": self.dtype, "space": self.space, "dimension": self.dimension, "ids": self.ids}
+            tmp_path = os.path.join(self.directory, "state.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(self.directory, "state.json"))
+            self.dirty = False
+
+    def load(self) -> bool:
+        """Load a saved index; returns False if there is none or it does not match the settings"""
+        try:
+            with open(os.path.join(self.directory, "state.json")) as f:
+                state = json.load(f)
+            arrays = {name: np.load(os.path.join(self.directory, f"{name}.npy"))
+                      for name in ("codes", "scales", "norms", "alive")}
+        except FileNotFoundError:
+            return False
+        if state["dtype"] != self.dtype or state["space"] != self.space:
+            logger.warning(f"Ignoring quantized index in {self.directory} built as {state['dtype']}/{state['space']}")
+            return False
+        size = len(state["ids"])
+        if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) < size * state["dimension"] * 4:
+            logger.warning(f"Ignoring quantized index in {self.directory}: float32 vectors are incomplete")
+            return False
+        with self.lock:
+            self._reset(state["dimension"])
+            self.codes, self.scales, self.norms, self.alive = (
+                arrays["codes"], arrays["scales"], arrays["norms"], arrays["alive"])
+            self.ids = state["ids"]
+            self.size = size
+            self.rows = {doc_id: row for row, doc_id in enumerate(self.ids) if self.alive[row]}
+            self.dirty = False
+        return True
@@ -1,59 +1,450 @@
 import os
-import chromadb
-from chromadb.config import Settings
-from fastapi import FastAPI
+import logging
+import threading
+from contextlib import asynccontextmanager
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 import uvicorn
 from pydantic import BaseModel
-from typing import List
+from prometheus_client import Gauge
+from typing import Any, Dict, List, Literal, Optional
 
-app = FastAPI()
+from common.startup import Startup, add_probes
+from common.telemetry import instrument_fastapi, stage
+from lexical import LexicalIndex, reciprocal_rank_fusion
+from partitions import PartitionedCollection, RESULT_FIELDS
+from quantized import QuantizedIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
-# Initialize ChromaDB
 CHROMA_DB_DIR = os.environ.get('CHROMA_DB_DIR', '/app/data/chroma')
-client = chromadb.PersistentClient(path=CHROMA_DB_DIR, settings=Settings(anonymized_telemetry=False))
+LEXICAL_INDEX_PATH = os.environ.get('LEXICAL_INDEX_PATH',
+                                    os.path.join(os.path.dirname(CHROMA_DB_DIR.rstrip('/')), 'lexical_index.pkl'))
+# Seconds between background saves of the lexical and quantized indexes
+LEXICAL_FLUSH_INTERVAL = float(os.environ.get('LEXICAL_FLUSH_INTERVAL', '30'))
+# Candidates taken from each ranking before reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', '50'))
+RRF_K = int(os.environ.get('RRF_K', '60'))
+REBUILD_PAGE_SIZE = 1000
+# Store each value of this metadata field (e.g. "product") in its own collection; empty for one collection
+PARTITION_BY = os.environ.get('PARTITION_BY', '')
+# Metadata fields the lexical index can filter on
+FILTER_FIELDS = [field for field in os.environ.get('FILTER_FIELDS', 'product,version,document_type').split(',') if field]
+
+# Most queries accepted by one /query_batch request
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '1000'))
+# HNSW settings for newly created collections; ef_search also applies to existing ones
+HNSW_SPACE = os.environ.get('HNSW_SPACE', 'l2')  # "l2", "cosine" or "ip"
+HNSW_M = int(os.environ.get('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION', '100'))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '100'))
+# "int8" or "float16" answers unfiltered vector searches from a compressed copy of the embeddings
+QUANTIZED_INDEX = os.environ.get('QUANTIZED_INDEX', '')
+QUANTIZED_INDEX_DIR = os.environ.get('QUANTIZED_INDEX_DIR',
+                                     os.path.join(os.path.dirname(CHROMA_DB_DIR.rstrip('/')), 'quantized'))
+# Candidates taken from the compressed vectors and re-scored exactly
+QUANTIZED_CANDIDATES = int(os.environ.get('QUANTIZED_CANDIDATES', '100'))
+
+SearchMode = Literal["vector", "lexical", "hybrid"]
+
+# Opened by the background start-up; requests are refused until it finishes
+collection: Optional[PartitionedCollection] = None
+lexical: Optional[LexicalIndex] = None
+# Compressed copy of the embeddings for unfiltered vector searches
+quantized: Optional[QuantizedIndex] = None
+startup = Startup("vector_db")
+
+
+def rebuild_lexical_index(index):
+    """Index every document already stored in the collection"""
+    for page in collection.iter_pages(REBUILD_PAGE_SIZE, include=["documents", "metadatas"]):
+        index.add((doc_id, text or "", metadata)
+                  for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]))
+    logger.info(f"Rebuilt lexical index with {len(index)} documents")
+
+
+def rebuild_quantized_index(index):
+    """Quantize every embedding already stored in the collection"""
+    for page in collection.iter_pages(REBUILD_PAGE_SIZE, include=["embeddings"]):
+        index.add(page["ids"], page["embeddings"])
+    logger.info(f"Rebuilt {index.dtype} quantized index with {len(index)} vectors")
+
+
+def warm_up():
+    """Open the collections and indexes, then run one search per collection to load its HNSW index"""
+    global collection, lexical, quantized
+    with startup.step("import chromadb"):
+        import chromadb
+        from chromadb.config import Settings
+    with startup.step("open collections"):
+        client = chromadb.PersistentClient(path=CHROMA_DB_DIR, settings=Settings(anonymized_telemetry=False))
+        # Create collection(s) if they don't exist
+        opened = PartitionedCollection(client, PARTITION_BY, metadata={
+            "hnsw:space": HNSW_SPACE,
+            "hnsw:M": HNSW_M,
+            "hnsw:construction_ef": HNSW_EF_CONSTRUCTION,
+            "hnsw:search_ef": HNSW_EF_SEARCH
+        }, search_ef=HNSW_EF_SEARCH)
+        count = opened.count()
+        collection = opened
+
+    with startup.step("lexical index"):
+        # BM25 index over the same ids as the collection
+        index = LexicalIndex(LEXICAL_INDEX_PATH, facet_fields=FILTER_FIELDS)
+        if not index.load() or len(index) != count:
+            index = LexicalIndex(LEXICAL_INDEX_PATH, facet_fields=FILTER_FIELDS)
+            rebuild_lexical_index(index)
+            index.save()
+        lexical = index
+
+    if QUANTIZED_INDEX:
+        with startup.step("quantized index"):
+            index = QuantizedIndex(QUANTIZED_INDEX_DIR, QUANTIZED_INDEX, HNSW_SPACE)
+            if not index.load() or len(index) != count:
+                index = QuantizedIndex(QUANTIZED_INDEX_DIR, QUANTIZED_INDEX, HNSW_SPACE)
+                rebuild_quantized_index(index)
+                index.save()
+            quantized = index
+
+    with startup.step("warm-up search"):
+        if quantized is not None:
+            # Searching Chroma would load its float32 HNSW index, which the quantized index is there to avoid
+            if len(quantized):
+                quantized.search(np.zeros(quantized.dimension, dtype=np.float32), 1, QUANTIZED_CANDIDATES)
+        else:
+            # Chroma loads a collection's HNSW index on its first query, so pay for that now
+            sample = next(collection.iter_pages(1, include=["embeddings"]), None)
+            if sample is not None:
+                collection.query(n_results=1, query_embeddings=np.asarray(sample["embeddings"], dtype=np.float32))
+        lexical.search("warm up", 1)
+
+
+def save_indexes():
+    if lexical is not None:
+        lexical.save()
+    if quantized is not None:
+        quantized.save()
+
 
-# Create collection if it doesn't exist
-try:
-    collection = client.get_collection("redhat_docs")
-except:
-    collection = client.create_collection("redhat_docs")
+def flush_indexes(stop):
+    while not stop.wait(LEXICAL_FLUSH_INTERVAL):
+        try:
+            save_indexes()
+        except Exception as e:
+            logger.error(f"Error saving search indexes: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    startup.start(warm_up)
+    stop = threading.Event()
+    flusher = threading.Thread(target=flush_indexes, args=(stop,), daemon=True)
+    flusher.start()
+    yield
+    stop.set()
+    flusher.join()
+    save_indexes()
+
+app = FastAPI(lifespan=lifespan)
+add_probes(app, startup)
+instrument_fastapi(app)
+
+Gauge('collection_documents', 'Chunks stored across all collections').set_function(
+    lambda: collection.count() if startup.ready else 0)
+Gauge('lexical_index_documents', 'Chunks in the BM25 index').set_function(
+    lambda: len(lexical) if lexical is not None else 0)
+Gauge('quantized_index_bytes', 'Resident bytes of the quantized index').set_function(
+    lambda: quantized.memory_bytes() if quantized is not None else 0)
 
 class Document(BaseModel):
     id: str
     text: str
     metadata: dict
 
+class EmbeddedDocument(BaseModel):
+    id: str
+    text: str
+    metadata: dict
+    embedding: List[float]
+
 class QueryRequest(BaseModel):
     query_text: str
     n_results: int = 5
+    mode: SearchMode = "vector"
+    # Chroma metadata filter, e.g. {"$and": [{"product": "..."}, {"version": "9"}]}
+    where: Optional[Dict[str, Any]] = None
+
+class EmbeddingQueryRequest(BaseModel):
+    query_embedding: List[float]
+    n_results: int = 5
+    # Needed for the lexical side of "lexical" and "hybrid" searches
+    query_text: Optional[str] = None
+    mode: SearchMode = "vector"
+    where: Optional[Dict[str, Any]] = None
+
+class BatchQuery(BaseModel):
+    # An embedding, or text for the collection to embed; text is also needed for "lexical" and "hybrid"
+    query_text: Optional[str] = None
+    query_embedding: Optional[List[float]] = None
+    n_results: int = 5
+    mode: SearchMode = "vector"
+    where: Optional[Dict[str, Any]] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQuery]
 
 class AddDocumentsRequest(BaseModel):
     documents: List[Document]
 
+class AddEmbeddingsRequest(BaseModel):
+    documents: List[EmbeddedDocument]
+
+class DeleteDocumentsRequest(BaseModel):
+    ids: List[str]
+
+class MetadataUpdate(BaseModel):
+    id: str
+    # Fields to set; fields not listed keep their values
+    metadata: dict
+
+class UpdateMetadataRequest(BaseModel):
+    documents: List[MetadataUpdate]
+
 @app.post("/add")
 def add_documents(request: AddDocumentsRequest):
     ids = [doc.id for doc in request.documents]
     documents = [doc.text for doc in request.documents]
     metadatas = [doc.metadata for doc in request.documents]
     
-    collection.add(
+    # Upsert so re-ingesting a chunk id replaces its text and embedding
+    collection.upsert(
         ids=ids,
         documents=documents,
         metadatas=metadatas
     )
+    lexical.add(zip(ids, documents, metadatas))
+    if quantized is not None and ids:
+        # Chroma computed these embeddings, so read them back
+        stored = collection.get(ids=ids, include=["embeddings"])
+        quantized.add(stored["ids"], stored["embeddings"])
     return {"status": "success", "count": len(ids)}
 
+@app.post("/add_embeddings")
+def add_embeddings(request: AddEmbeddingsRequest):
+    """Store documents whose embeddings were computed by the caller"""
+    if not request.documents:
+        return {"status": "success", "count": 0}
+    
+    ids = [doc.id for doc in request.documents]
+    embeddings = np.asarray([doc.embedding for doc in request.documents], dtype=np.float32)
+    collection.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        documents=[doc.text for doc in request.documents],
+        metadatas=[doc.metadata for doc in request.documents]
+    )
+    lexical.add((doc.id, doc.text, doc.metadata) for doc in request.documents)
+    if quantized is not None:
+        quantized.add(ids, embeddings)
+    return {"status": "success", "count": len(request.documents)}
+
+@app.post("/delete")
+def delete_documents(request: DeleteDocumentsRequest):
+    if request.ids:
+        collection.delete(ids=request.ids)
+        lexical.delete(request.ids)
+        if quantized is not None:
+            quantized.delete(request.ids)
+    return {"status": "success", "count": len(request.ids)}
+
+@app.post("/update_metadata")
+def update_metadata(request: UpdateMetadataRequest):
+    """Change chunk metadata without re-sending text and embeddings, e.g. the documents a shared chunk belongs to"""
+    if request.documents:
+        collection.update_metadata([doc.id for doc in request.documents],
+                                   [doc.metadata for doc in request.documents])
+    return {"status": "success", "count": len(request.documents)}
+
+def lexical_search(query_text, k, where):
+    try:
+        with stage("lexical_search"):
+            return lexical.search(query_text, k, where)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def lexical_results(query_text, n_results, where):
+    """BM25 hits shaped like a collection.query result"""
+    hits = lexical_search(query_text, n_results, where)
+    ids = [doc_id for doc_id, _ in hits]
+    with stage("fetch"):
+        stored = collection.get(ids=ids, include=["documents", "metadatas"]) if ids else {"ids": []}
+    found = {doc_id: i for i, doc_id in enumerate(stored["ids"])}
+    ids = [doc_id for doc_id in ids if doc_id in found]
+    scores = dict(hits)
+    return {
+        "ids": [ids],
+        "documents": [[stored["documents"][found[doc_id]] for doc_id in ids]],
+        "metadatas": [[stored["metadatas"][found[doc_id]] for doc_id in ids]],
+        "distances": [[None] * len(ids)],
+        "scores": [[scores[doc_id] for doc_id in ids]]
+    }
+
+
+def hybrid_results(vector, query_text, n_results, where):
+    """Fuse a vector result with BM25 hits by reciprocal rank
+
+    Distances are kept for documents the vector search found and are None
+    for lexical-only hits; "scores" holds the fused score.
+    """
+    lexical_ids = [doc_id for doc_id, _ in lexical_search(query_text, max(n_results, HYBRID_CANDIDATES), where)]
+    fused = reciprocal_rank_fusion([vector["ids"][0], lexical_ids], k=RRF_K)[:n_results]
+    rows = {doc_id: (document, metadata, distance) for doc_id, document, metadata, distance
+            in zip(vector["ids"][0], vector["documents"][0], vector["metadatas"][0], vector["distances"][0])}
+    missing = [doc_id for doc_id, _ in fused if doc_id not in rows]
+    if missing:
+        with stage("fetch"):
+            stored = collection.get(ids=missing, include=["documents", "metadatas"])
+        for doc_id, document, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            rows[doc_id] = (document, metadata, None)
+    fused = [(doc_id, score) for doc_id, score in fused if doc_id in rows]
+    return {
+        "ids": [[doc_id for doc_id, _ in fused]],
+        "documents": [[rows[doc_id][0] for doc_id, _ in fused]],
+        "metadatas": [[rows[doc_id][1] for doc_id, _ in fused]],
+        "distances": [[rows[doc_id][2] for doc_id, _ in fused]],
+        "scores": [[score for _, score in fused]]
+    }
+
+
+def stored_results(hits):
+    """Rows for ranked (ids, distances) per query, shaped like a collection.query result"""
+    wanted = list({doc_id for ids, _ in hits for doc_id in ids})
+    with stage("fetch"):
+        stored = collection.get(ids=wanted, include=["documents", "metadatas"]) if wanted else {"ids": []}
+    found = {doc_id: i for i, doc_id in enumerate(stored["ids"])}
+    results = {field: [] for field in RESULT_FIELDS}
+    for ids, distances in hits:
+        rows = [(doc_id, distance) for doc_id, distance in zip(ids, distances) if doc_id in found]
+        results["ids"].append([doc_id for doc_id, _ in rows])
+        results["documents"].append([stored["documents"][found[doc_id]] for doc_id, _ in rows])
+        results["metadatas"].append([stored["metadatas"][found[doc_id]] for doc_id, _ in rows])
+        results["distances"].append([distance for _, distance in rows])
+    return results
+
+
+def vector_search(query_embeddings, n_results, where):
+    """Nearest chunks to each embedding, from the quantized index when it can serve the query"""
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    if quantized is not None:
+        try:
+            # The lexical index's metadata facets pick the chunks a filter allows
+            allowed = lexical.matching_ids(where) if where else None
+        except ValueError:
+            # Filters on fields without facets are left to Chroma
+            pass
+        else:
+            with stage("vector_search"):
+                hits = quantized.search(query_embeddings, n_results, QUANTIZED_CANDIDATES, allowed)
+            return stored_results(hits)
+    with stage("vector_search"):
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+
+
+def vector_candidates(n_results, mode):
+    return max(n_results, HYBRID_CANDIDATES) if mode == "hybrid" else n_results
+
+
 @app.post("/query")
 def query(request: QueryRequest):
-    results = collection.query(
-        query_texts=[request.query_text],
-        n_results=request.n_results
-    )
+    if request.mode == "lexical":
+        return lexical_results(request.query_text, request.n_results, request.where)
+    # Chroma embeds the text, so this stage includes the embedding
+    with stage("vector_search"):
+        results = collection.query(
+            query_texts=[request.query_text],
+            n_results=vector_candidates(request.n_results, request.mode),
+            where=request.where
+        )
+    if request.mode == "hybrid":
+        return hybrid_results(results, request.query_text, request.n_results, request.where)
+    return results
+
+@app.post("/query_embeddings")
+def query_embeddings(request: EmbeddingQueryRequest):
+    """Search with a query embedding computed by the caller"""
+    if request.mode != "vector" and not request.query_text:
+        raise HTTPException(status_code=400, detail=f"query_text is required for {request.mode} search")
+    if request.mode == "lexical":
+        return lexical_results(request.query_text, request.n_results, request.where)
+    results = vector_search([request.query_embedding], vector_candidates(request.n_results, request.mode),
+                            request.where)
+    if request.mode == "hybrid":
+        return hybrid_results(results, request.query_text, request.n_results, request.where)
     return results
 
+@app.post("/query_batch")
+def query_batch(request: BatchQueryRequest):
+    """Run many searches at once; results come back in request order
+
+    Vector searches that share a filter and an input type are answered by
+    one batched search, so texts are embedded together and the index is
+    walked once per group rather than once per query.
+    """
+    queries = request.queries
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    for i, query in enumerate(queries):
+        if query.query_embedding is None and not query.query_text:
+            raise HTTPException(status_code=400, detail=f"Query {i} needs query_text or query_embedding")
+        if query.mode != "vector" and not query.query_text:
+            raise HTTPException(status_code=400, detail=f"Query {i} needs query_text for {query.mode} search")
+
+    groups = {}
+    for i, query in enumerate(queries):
+        if query.mode != "lexical":
+            groups.setdefault((repr(query.where), query.query_embedding is not None), []).append(i)
+    vector = {}
+    for (_, by_embedding), members in groups.items():
+        where = queries[members[0]].where
+        n_results = max(vector_candidates(queries[i].n_results, queries[i].mode) for i in members)
+        if by_embedding:
+            batch = vector_search([queries[i].query_embedding for i in members], n_results, where)
+        else:
+            with stage("vector_search"):
+                batch = collection.query(query_texts=[queries[i].query_text for i in members],
+                                         n_results=n_results, where=where)
+        for row, i in enumerate(members):
+            wanted = vector_candidates(queries[i].n_results, queries[i].mode)
+            vector[i] = {field: [batch[field][row][:wanted]] for field in RESULT_FIELDS}
+
+    results = []
+    for i, query in enumerate(queries):
+        if query.mode == "lexical":
+            results.append(lexical_results(query.query_text, query.n_results, query.where))
+        elif query.mode == "hybrid":
+            results.append(hybrid_results(vector[i], query.query_text, query.n_results, query.where))
+        else:
+            results.append(vector[i])
+    return {"results": results}
+
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    """Healthy when the collection answers; reports what is indexed"""
+    try:
+        documents = collection.count()
+    except Exception as e:
+        logger.error(f"Health check failed: {str(e)}")
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "error": str(e)})
+    return {
+        "status": "healthy",
+        "documents": documents,
+        "lexical_documents": len(lexical),
+        "quantized_vectors": len(quantized) if quantized is not None else None
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
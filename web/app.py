@@ -1,14 +1,47 @@
 import os
+import json
+import codecs
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import markdown
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from common.telemetry import instrument_flask, propagation_headers, stage
 
 app = Flask(__name__)
+instrument_flask(app)
 
 # Environment variables
 RAG_SERVICE_HOST = os.environ.get('RAG_SERVICE_HOST', 'localhost')
 RAG_SERVICE_PORT = os.environ.get('RAG_SERVICE_PORT', '5000')
 RAG_SERVICE_URL = f"http://{RAG_SERVICE_HOST}:{RAG_SERVICE_PORT}"
+RAG_SERVICE_POOL_SIZE = int(os.environ.get('RAG_SERVICE_POOL_SIZE', '32'))
+RAG_SERVICE_CONNECT_TIMEOUT = float(os.environ.get('RAG_SERVICE_CONNECT_TIMEOUT', '5'))
+RAG_SERVICE_TIMEOUT = float(os.environ.get('RAG_SERVICE_TIMEOUT', '120'))
+RAG_SERVICE_RETRIES = int(os.environ.get('RAG_SERVICE_RETRIES', '3'))
+RAG_SERVICE_BACKOFF = float(os.environ.get('RAG_SERVICE_BACKOFF', '0.2'))
+TIMEOUT = (RAG_SERVICE_CONNECT_TIMEOUT, RAG_SERVICE_TIMEOUT)
+# Request fields forwarded to the RAG service besides the query: search filters and the conversation
+PASSED_FIELDS = ('product', 'version', 'document_type', 'session_id')
+
+def create_session(retries=RAG_SERVICE_RETRIES, pool_size=RAG_SERVICE_POOL_SIZE):
+    """Create a keep-alive session to the RAG service shared by all request threads"""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=RAG_SERVICE_BACKOFF,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=None,  # Queries are read-only, so POSTs are safe to retry
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+session = create_session()
+# Starting an ingestion job is not idempotent: a retry after a lost response would be refused as a second job
+ingest_session = create_session(retries=0, pool_size=1)
 
 @app.route('/')
 def index():
@@ -19,13 +52,18 @@ def query():
     data = request.json
     query_text = data.get('query', '')
     max_results = data.get('max_results', 5)
+    # Optional filters and conversation, passed through only when set
+    filters = {field: data[field] for field in PASSED_FIELDS if data.get(field)}
     
     try:
         # Send query to RAG service
-        response = requests.post(
-            f"{RAG_SERVICE_URL}/query",
-            json={"query": query_text, "max_results": max_results}
-        )
+        with stage("rag_service"):
+            response = session.post(
+                f"{RAG_SERVICE_URL}/query",
+                json={"query": query_text, "max_results": max_results, **filters},
+                headers=propagation_headers(),
+                timeout=TIMEOUT
+            )
         
         if response.status_code != 200:
             return jsonify({"error": f"RAG service error: {response.text}"}), 500
@@ -34,29 +72,131 @@ def query():
         
         # Convert answer from markdown to HTML if needed
         if query_text.strip():
-            result['answer_html'] = markdown.markdown(result['answer'])
+            with stage("render"):
+                result['answer_html'] = markdown.markdown(result['answer'])
         
         return jsonify(result)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def sse(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def parse_sse(block):
+    """(event, data) of one server-sent event block"""
+    event, data = "message", []
+    for line in block.splitlines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+    return event, json.loads("\n".join(data)) if data else None
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    data = request.json
+    query_text = data.get('query', '')
+    max_results = data.get('max_results', 5)
+    filters = {field: data[field] for field in PASSED_FIELDS if data.get(field)}
+    
+    try:
+        upstream = session.post(
+            f"{RAG_SERVICE_URL}/query/stream",
+            json={"query": query_text, "max_results": max_results, **filters},
+            headers=propagation_headers(),
+            timeout=TIMEOUT,
+            stream=True
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if upstream.status_code != 200:
+        error = upstream.text
+        upstream.close()
+        return jsonify({"error": f"RAG service error: {error}"}), 500
+    
+    def relay():
+        """Forward events as they arrive, then send the answer rendered as HTML"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ""
+        answer = []
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+                buffer += decoder.decode(chunk)
+                *blocks, buffer = buffer.split("\n\n")
+                for block in blocks:
+                    event, payload = parse_sse(block)
+                    if event == "token":
+                        answer.append(payload["text"])
+            if answer:
+                yield sse("answer_html", {"html": markdown.markdown("".join(answer))})
+        finally:
+            upstream.close()
+    
+    # No buffering here or in a fronting proxy: time to first token is what users see
+    return Response(stream_with_context(relay()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/process', methods=['POST'])
 def process_documents():
     try:
-        response = requests.post(f"{RAG_SERVICE_URL}/process_documents", json={})
+        response = ingest_session.post(f"{RAG_SERVICE_URL}/process_documents", json={},
+                                       headers=propagation_headers(), timeout=TIMEOUT)
         
-        if response.status_code != 200:
+        if response.status_code == 409:
+            # Already running, e.g. started from another tab: follow that job instead
+            job_id = response.json()["detail"]["job_id"]
+            return jsonify({"job_id": job_id, "status": "running", "already_running": True}), 202
+        if response.status_code != 202:
             return jsonify({"error": f"Processing error: {response.text}"}), 500
         
+        return jsonify(response.json()), 202
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/process/<job_id>', methods=['GET'])
+def process_status(job_id):
+    try:
+        response = session.get(f"{RAG_SERVICE_URL}/process_documents/{job_id}", timeout=TIMEOUT)
+        
+        if response.status_code != 200:
+            return jsonify({"error": f"Processing error: {response.text}"}), response.status_code
+        
         return jsonify(response.json())
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/live')
+def live():
+    return jsonify({"status": "alive"})
+
+@app.route('/ready')
+def ready():
+    """Ready once the RAG service has finished warming up"""
+    try:
+        response = requests.get(f"{RAG_SERVICE_URL}/ready", headers=propagation_headers(), timeout=5)
+    except requests.RequestException as e:
+        return jsonify({"status": "starting", "error": f"RAG service unreachable: {e}"}), 503
+    if not response.ok:
+        return jsonify({"status": "starting", "rag_service": response.json()}), 503
+    return jsonify({"status": "ready", "rag_service": response.json()})
+
 @app.route('/health')
 def health():
-    return jsonify({"status": "healthy"})
+    """Healthy when the RAG service, and through it the vector DB, is healthy"""
+    try:
+        # A single attempt: probes should see failures, not retries
+        response = requests.get(f"{RAG_SERVICE_URL}/health", headers=propagation_headers(), timeout=5)
+    except requests.RequestException as e:
+        return jsonify({"status": "unhealthy", "error": f"RAG service unreachable: {e}"}), 503
+    if response.status_code != 200:
+        return jsonify({"status": "unhealthy", "error": f"RAG service: {response.text}"}), 503
+    return jsonify({"status": "healthy", "rag_service": response.json()})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)